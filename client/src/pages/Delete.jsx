@@ -60,7 +60,7 @@ function Delete() {
     
     let confirmMessage = '';
     if (isCascading) {
-      confirmMessage = `Warning: Deleting this ${deleteType} will also delete ${previewData.affected_count - 1} related record(s) due to cascading deletes. Are you sure you want to proceed?`;
+      confirmMessage = `Warning: Deleting this ${deleteType} will also delete ${previewData.affected_count - previewData.rows.length} related record(s) due to cascading deletes. Are you sure you want to proceed?`;
     } else {
       confirmMessage = `Are you sure you want to delete this ${deleteType}? This action cannot be undone.`;
     }
@@ -165,6 +165,12 @@ function Delete() {
               <>
                 <div className="preview-info">
                   <p>This will delete {previewData.affected_count} record(s).</p>
+                  {previewData.breakdown && (
+                    <p>
+                      Artists: {previewData.breakdown.artists}, Albums: {previewData.breakdown.albums}, Tracks: {previewData.breakdown.tracks}
+                      {' '}(plus {previewData.breakdown.artist_tracks + previewData.breakdown.artist_albums + previewData.breakdown.artist_genres} link row(s))
+                    </p>
+                  )}
                   {(deleteType === 'artist' || deleteType === 'album') && previewData.affected_count > 1 && (
                     <p style={{ color: '#d32f2f', fontWeight: 'bold' }}>
                       Warning: This will also delete related records due to cascading deletes.
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import '../App.css';
 
 // Search music page
@@ -7,6 +7,26 @@ function Search() {
   const [results, setResults] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [suggestions, setSuggestions] = useState([]);
+
+  // Suggest artist, album, and track names while typing
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (query.length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    fetch(`/api/suggest?q=${encodeURIComponent(query)}&limit=5`, { signal: controller.signal })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (!data) return;
+        const names = Object.values(data.suggestions).flat().map((suggestion) => suggestion.name);
+        setSuggestions([...new Set(names)]);
+      })
+      .catch(() => {});
+    return () => controller.abort();
+  }, [searchQuery]);
 
   const handleSearch = async (e) => {
     e.preventDefault();
@@ -59,7 +79,13 @@ function Search() {
               onChange={(e) => setSearchQuery(e.target.value)}
               placeholder="Search for a song, artist, or album..."
               disabled={loading}
+              list="music-suggestions"
             />
+            <datalist id="music-suggestions">
+              {suggestions.map((name) => (
+                <option key={name} value={name} />
+              ))}
+            </datalist>
             <button type="submit" className="music-search-button" disabled={loading || !searchQuery.trim()}>
               {loading ? 'Searching...' : 'Search'}
             </button>
@@ -7,21 +7,23 @@ function ViewAllData() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [limit] = useState(15);
-  const [offset, setOffset] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
-    fetchJoinedData(0);
+    fetchJoinedData(null);
   }, []);
 
-  const fetchJoinedData = async (newOffset) => {
+  // Pages are fetched with the cursor from the last page, so deep pages stay fast
+  const fetchJoinedData = async (afterCursor) => {
     try {
       setLoading(true);
       setError(null);
-      const response = await fetch(`/api/tracks/joined?limit=${limit}&offset=${newOffset}`);
+      const cursorParam = afterCursor ? `&after=${encodeURIComponent(afterCursor)}` : '';
+      const response = await fetch(`/api/tracks/joined?limit=${limit}${cursorParam}`);
       if (!response.ok) throw new Error('Failed to fetch joined data');
       const data = await response.json();
       
-      if (newOffset === 0) {
+      if (!afterCursor) {
 
         setJoinedData(data);
       } else {
@@ -29,10 +31,10 @@ function ViewAllData() {
           ...prev,
           results: [...prev.results, ...data.results],
           has_more: data.has_more,
-          offset: data.offset
+          next_cursor: data.next_cursor
         }));
       }
-      setOffset(newOffset + data.results.length);
+      setNextCursor(data.next_cursor);
     } catch (err) {
       setError(err.message);
       setJoinedData(null);
@@ -42,7 +44,7 @@ function ViewAllData() {
   };
 
   const handleShowMore = () => {
-    fetchJoinedData(offset);
+    fetchJoinedData(nextCursor);
   };
   // Render joined data view
   return (
@@ -60,7 +62,7 @@ function ViewAllData() {
           <div className="error-message">
             <h3>Error</h3>
             <p>{error}</p>
-            <button onClick={() => fetchJoinedData(0)}>Retry</button>
+            <button onClick={() => fetchJoinedData(null)}>Retry</button>
           </div>
         )}
 
@@ -1,12 +1,39 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 import psycopg2
-from psycopg2 import pool
+import psycopg2.extensions
+from psycopg2.extras import execute_values
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 from datetime import timedelta, date, datetime
 import json
+import csv
+import io
+import time
+import base64
+import binascii
+import functools
+import tempfile
+import threading
+import catalog
+import db_pool
+import discography
+import facets
+import metrics
+import migrate
+import music_batch
+import music_delete
+import query_stats
+import replicas
+import response_cache
+import schema
+import search
+import serializers
+import slow_queries
+import statements
+import search_index
+import suggest
 
 # Loads in the environment variables (from .env)
 env_path = Path(__file__).parent.parent / '.env'
@@ -18,6 +45,68 @@ CORS(app)
 
 # Initialize the connection variable
 connection_pool = None
+connection_pool_lock = threading.Lock()
+
+# Connection pool settings (the pool waits up to DB_POOL_TIMEOUT seconds for a free connection)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))
+
+# Optional read replicas (comma-separated connection strings): the read-only routes use them while their replication
+# lag is under DB_REPLICA_MAX_LAG seconds, and a client that wrote reads from the primary for the next
+# DB_REPLICA_READ_YOUR_WRITES seconds (see replicas.py)
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 2))
+DB_REPLICA_READ_YOUR_WRITES = float(os.getenv('DB_REPLICA_READ_YOUR_WRITES', DB_REPLICA_MAX_LAG))
+WROTE_AT_COOKIE = 'musedb_wrote_at'
+
+# Cached total number of tracks (so /api/tracks/joined does not count the whole table every page)
+TRACK_COUNT_TTL = int(os.getenv('TRACK_COUNT_TTL', 60))
+TRACK_COUNT_ESTIMATE_MIN = int(os.getenv('TRACK_COUNT_ESTIMATE_MIN', 100000))
+track_count_cache = {'value': None, 'expires_at': 0.0}
+
+# Rows per fetch when streaming a table (the first fetch is smaller so the first bytes go out quickly)
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 2000))
+STREAM_FIRST_CHUNK_SIZE = 100
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Rows per batch for /api/insert/bulk
+BULK_INSERT_BATCH_SIZE = int(os.getenv('BULK_INSERT_BATCH_SIZE', 1000))
+BULK_INSERT_MAX_BATCH_SIZE = 10000
+BULK_INSERT_MAX_ERRORS = 1000
+
+# /api/tracks/joined and /api/search/music read the denormalized track catalog once its migration is applied
+# (migrations/005_track_catalog.sql); TRACK_CATALOG=0 makes them join the base tables instead
+TRACK_CATALOG_ENABLED = os.getenv('TRACK_CATALOG', '1') == '1'
+
+# Albums whose stored length is off from the total of their tracks by more than this many seconds are flagged
+DISCOGRAPHY_LENGTH_TOLERANCE = float(os.getenv('DISCOGRAPHY_LENGTH_TOLERANCE', 1))
+
+# Optional in-memory index for /api/search/music (set SEARCH_INDEX=1 to turn it on)
+SEARCH_INDEX_ENABLED = os.getenv('SEARCH_INDEX', '0') == '1'
+music_index = search_index.SearchIndexManager()
+
+# In-memory bitmaps for the /api/browse facet counts (updated by writes, and rebuilt every FACET_INDEX_TTL seconds)
+FACET_INDEX_ENABLED = os.getenv('FACET_INDEX', '1') == '1'
+FACET_INDEX_TTL = int(os.getenv('FACET_INDEX_TTL', 300))
+facet_index = facets.FacetIndexManager(ttl=FACET_INDEX_TTL)
+
+# In-memory typeahead over artist, album, and track names for /api/suggest (built again every SUGGEST_INDEX_TTL seconds)
+SUGGEST_INDEX_ENABLED = os.getenv('SUGGEST_INDEX', '1') == '1'
+SUGGEST_INDEX_TTL = int(os.getenv('SUGGEST_INDEX_TTL', 3600))
+suggest_index = suggest.SuggestIndexManager(ttl=SUGGEST_INDEX_TTL)
+
+# Writes to these tables (lower case) are applied to the in-memory indexes
+INDEXED_TABLES = search_index.INDEXED_TABLES | facets.FACET_TABLES
+
+def apply_to_indexes(method, *args):
+    """Applies a committed write to the in-memory search, facet, and suggestion indexes"""
+    music_index.apply(method, *args)
+    facet_index.apply(method, *args)
+    suggest_index.apply(method, *args)
 
 def serialize_value(value):
     """Convert non-JSON values to JSON formats that we can use for our table"""
@@ -25,11 +114,7 @@ def serialize_value(value):
         return None
     # Converts the time to HH:MM:SS format
     elif isinstance(value, timedelta):
-        total_seconds = int(value.total_seconds())
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        return serializers.format_interval(value)
     # Converts to ISO format string
     elif isinstance(value, (date, datetime)):
         return value.isoformat()
@@ -40,75 +125,908 @@ def serialize_value(value):
     else:
         return value
 
-def get_db_connection():
-    """Creates and gets the database connection (based on the pool connection -- from db.js)"""
+def json_response(data, status=200):
+    """Sends data that was already converted to JSON values (encoded in one pass, without jsonify)"""
+    return Response(serializers.dumps(data), status=status, mimetype='application/json')
+
+def get_response_format():
+    """Gets (layout, encoding) from ?layout=rows|columnar, ?encoding=json|msgpack|arrow, or the Accept header"""
+    return serializers.negotiate(
+        request.args.get('layout'), request.args.get('encoding'), request.headers.get('Accept')
+    )
+
+def table_response(columns, type_oids, rows, response_format):
+    """Sends one table's rows in the negotiated layout and encoding"""
+    layout, encoding = response_format
+    if encoding == 'arrow':
+        body = serializers.encode_arrow(columns, type_oids, rows)
+    else:
+        body = serializers.encode(serializers.table_result(columns, type_oids, rows, layout), encoding)
+    return Response(body, mimetype=serializers.MIMETYPES[encoding])
+
+def get_connection_string():
+    """Builds the connection string from the environment variables"""
+    # Makes sure that all the required environment variables are set
+    required_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
+    missing = [var for var in required_vars if not os.getenv(var)]
+    
+    if missing:
+        raise ValueError(f'Required Environment variables missing!')
+    
+    db_host = os.getenv('DB_HOST')
+    db_port = int(os.getenv('DB_PORT', 5432))
+    db_name = os.getenv('DB_NAME')
+    db_user = os.getenv('DB_USER')
+    db_password = os.getenv('DB_PASSWORD')
+    
+    # Connection string for supabase
+    return (
+        f"host={db_host} "
+        f"port={db_port} "
+        f"dbname={db_name} "
+        f"user={db_user} "
+        f"password={db_password} "
+        f"sslmode={os.getenv('DB_SSLMODE', 'require')}"
+    )
+
+def get_connection_pool():
+    """Creates (once, even with many threads) and gets the connection pool"""
     global connection_pool
     
     if connection_pool is None:
-        # Makes sure that all the required environment variables are set
-        required_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
-        missing = [var for var in required_vars if not os.getenv(var)]
-        
-        if missing:
-            raise ValueError(f'Required Environment variables missing!')
-        
+        with connection_pool_lock:
+            if connection_pool is None:
+                connection_pool = db_pool.ConnectionPool(
+                    get_connection_string(),
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    recycle=DB_POOL_RECYCLE,
+                    ping_after=DB_POOL_PING_AFTER,
+                    on_open=open_connection
+                )
+    return connection_pool
+
+def open_connection(conn, info):
+    """Sets up a new pooled connection (the query counting cursor, then the prepared statements)"""
+    if COUNT_QUERIES:
+        conn.cursor_factory = query_stats.CountingCursor
+    prepared_statements.prepare(conn, info)
+
+def get_db_connection():
+    """Gets a database connection from the pool (waits for one if they are all in use)
+
+    Read-only routes get one from a healthy replica instead, unless the client wrote in the last few seconds.
+    """
+    started = time.perf_counter()
+    try:
+        if replica_set and reads_from_replica():
+            conn = replica_set.getconn()
+            if conn is not None:
+                g.used_replica = True
+                return conn
+        return get_connection_pool().getconn()
+    finally:
+        query_stats.record_pool_wait(time.perf_counter() - started)
+
+def release_db_connection(conn):
+    """Release the database connection"""
+    if conn:
+        pool = get_pool_of(conn)
+        if pool:
+            pool.putconn(conn)
+
+def get_pool_of(conn):
+    """Gets the pool a connection came from (the primary's or a replica's)"""
+    return (replica_set.pool_of(conn) if replica_set else None) or connection_pool
+
+replica_set = replicas.ReplicaSet(
+    DB_REPLICA_DSNS,
+    max_lag=DB_REPLICA_MAX_LAG,
+    check_interval=DB_REPLICA_CHECK_INTERVAL,
+    pool_kwargs={
+        'minconn': 0,
+        'maxconn': DB_POOL_MAX,
+        'timeout': DB_POOL_TIMEOUT,
+        'recycle': DB_POOL_RECYCLE,
+        'ping_after': DB_POOL_PING_AFTER,
+        'on_open': open_connection
+    }
+)
+
+def replica_read(view):
+    """Lets a read-only route use a replica (see get_db_connection)"""
+    @functools.wraps(view)
+    def wrapper(**view_args):
+        g.replica_read = True
+        return view(**view_args)
+    return wrapper
+
+def wrote_recently(cookies=None):
+    """Checks if the client wrote in the last DB_REPLICA_READ_YOUR_WRITES seconds (its reads go to the primary)
+
+    cookies are the Flask request's unless given (the async server passes its own request's).
+    """
+    try:
+        wrote_at = float((request.cookies if cookies is None else cookies).get(WROTE_AT_COOKIE, 0))
+    except ValueError:
+        return False
+    return time.time() - wrote_at < DB_REPLICA_READ_YOUR_WRITES
+
+def reads_from_replica():
+    """Checks if the current request can read from a replica"""
+    return has_request_context() and g.get('replica_read', False) and not wrote_recently()
+
+# Cached responses of the read endpoints (a write drops the ones that read the tables it changed)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE', '1') == '1'
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_TTLS = {
+    'tables': 300,
+    'table_data': 60,
+    'all_data': 60,
+    'tracks_joined': 30,
+    'search_music': 60,
+    'discography': 60,
+    'browse': 60
+}
+api_cache = response_cache.ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+# Cached table and column names (used to validate names without asking the database every time)
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', 300))
+SCHEMA_LISTEN = os.getenv('SCHEMA_LISTEN', '0') == '1'
+
+# Applies the pending migrations (see migrate.py) when the server starts
+DB_MIGRATE = os.getenv('DB_MIGRATE', '0') == '1'
+schema_registry = schema.SchemaRegistry(
+    get_db_connection, release_db_connection, ttl=SCHEMA_CACHE_TTL, on_invalidate=api_cache.clear
+)
+
+# Every table that /api/insert/music and /api/insert/music/batch can write to
+MUSIC_TABLES = ['Nation', 'Artist', 'Genre', 'ArtistGenre', 'Album', 'ArtistAlbum', 'Track', 'ArtistTrack']
+
+# Lookups, link checks, and inserts of /api/insert/music - SQL Queries
+# Names are matched case-insensitively with lower(), which uses the indexes from migrations/004_name_indexes.sql
+# (plain indexes: names are not unique, and a lookup takes one of the matches)
+FIND_NATION_QUERY = "SELECT nation_id FROM Nation WHERE lower(name) = lower(%s);"
+ANY_NATION_QUERY = "SELECT nation_id FROM Nation LIMIT 1;"
+INSERT_NATION_QUERY = "INSERT INTO Nation (name, comment) VALUES (%s, %s) RETURNING nation_id;"
+FIND_ARTIST_QUERY = "SELECT artist_id FROM Artist WHERE lower(name) = lower(%s);"
+INSERT_ARTIST_QUERY = "INSERT INTO Artist (name, description, nation_id) VALUES (%s, %s, %s) RETURNING artist_id;"
+FIND_GENRE_QUERY = "SELECT genre_id FROM Genre WHERE lower(name) = lower(%s);"
+INSERT_GENRE_QUERY = "INSERT INTO Genre (name, description) VALUES (%s, %s) RETURNING genre_id;"
+ARTIST_GENRE_EXISTS_QUERY = "SELECT 1 FROM ArtistGenre WHERE artist_id = %s AND genre_id = %s;"
+INSERT_ARTIST_GENRE_QUERY = "INSERT INTO ArtistGenre (artist_id, genre_id) VALUES (%s, %s);"
+FIND_ALBUM_QUERY = "SELECT album_id FROM Album WHERE lower(name) = lower(%s);"
+INSERT_ALBUM_QUERY = "INSERT INTO Album (name, release_date, description) VALUES (%s, %s, %s) RETURNING album_id;"
+ARTIST_ALBUM_EXISTS_QUERY = "SELECT 1 FROM ArtistAlbum WHERE artist_id = %s AND album_id = %s;"
+INSERT_ARTIST_ALBUM_QUERY = "INSERT INTO ArtistAlbum (artist_id, album_id) VALUES (%s, %s);"
+FIND_TRACK_QUERY = "SELECT track_id FROM Track WHERE lower(name) = lower(%s) AND album_id = %s;"
+INSERT_TRACK_QUERY = "INSERT INTO Track (name, length, album_id) VALUES (%s, %s, %s) RETURNING track_id;"
+ARTIST_TRACK_EXISTS_QUERY = "SELECT 1 FROM ArtistTrack WHERE artist_id = %s AND track_id = %s;"
+INSERT_ARTIST_TRACK_QUERY = "INSERT INTO ArtistTrack (artist_id, track_id) VALUES (%s, %s);"
+
+def coerce_value(column, col_type, val):
+    """Converts a value to insert based on its column type (raises ValueError if an integer is invalid)"""
+    col_type = col_type.upper()
+    # DATE and INTERVAL values are passed through for Postgres to parse (INTERVAL is checked before INT since it contains it)
+    if 'DATE' in col_type or 'INTERVAL' in col_type:
+        return val
+    elif 'INT' in col_type:
         try:
-            # Create the connection
-            db_host = os.getenv('DB_HOST')
-            db_port = int(os.getenv('DB_PORT', 5432))
-            db_name = os.getenv('DB_NAME')
-            db_user = os.getenv('DB_USER')
-            db_password = os.getenv('DB_PASSWORD')
+            return int(val)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid integer value for column {column}')
+    else:
+        return str(val)
+
+# Track count queries - SQL Queries
+TRACK_ESTIMATE_QUERY = "SELECT reltuples::bigint FROM pg_class WHERE oid = 'track'::regclass;"
+TRACK_COUNT_QUERY = "SELECT COUNT(*) FROM Track;"
+
+# Tracks with their albums, one page at a time (by offset, or after a track_id) - SQL Queries
+JOINED_TRACKS_COLUMNS = """
+        t.track_id,
+        t.name AS track_name,
+        t.length AS track_length,
+        a.album_id,
+        a.name AS album_name,
+        a.release_date AS album_release_date,
+        a.description AS album_description"""
+JOINED_TRACKS_QUERY = f"""
+    SELECT {JOINED_TRACKS_COLUMNS}
+    FROM Track t
+    INNER JOIN Album a ON t.album_id = a.album_id
+    ORDER BY t.track_id
+    LIMIT %s OFFSET %s;
+"""
+JOINED_TRACKS_AFTER_QUERY = f"""
+    SELECT {JOINED_TRACKS_COLUMNS}
+    FROM Track t
+    INNER JOIN Album a ON t.album_id = a.album_id
+    WHERE t.track_id > %s
+    ORDER BY t.track_id
+    LIMIT %s;
+"""
+
+# Tracks that match the /api/browse filters, one page at a time (by offset, or after a track_id) - SQL Query
+BROWSE_TRACKS_QUERY = f"""
+    SELECT {JOINED_TRACKS_COLUMNS}
+    FROM Track t
+    INNER JOIN Album a ON t.album_id = a.album_id
+    WHERE (%(after)s::int IS NULL OR t.track_id > %(after)s)
+    {facets.TRACK_FILTERS}
+    ORDER BY t.track_id
+    LIMIT %(limit)s OFFSET %(offset)s;
+"""
+
+# Track artists and album artists for a whole page of tracks - SQL Query
+JOINED_ARTISTS_QUERY = """
+    SELECT 'track' AS source, at.track_id AS owner_id, ar.artist_id, ar.name, ar.type, ar.description
+    FROM Artist ar
+    INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+    WHERE at.track_id = ANY(%s)
+    UNION ALL
+    SELECT 'album' AS source, aa.album_id AS owner_id, ar.artist_id, ar.name, ar.type, ar.description
+    FROM Artist ar
+    INNER JOIN ArtistAlbum aa ON ar.artist_id = aa.artist_id
+    WHERE aa.album_id = ANY(%s)
+    ORDER BY name;
+"""
+
+# Counts the queries and database time of every request (X-Query-Count and X-DB-Time-Ms headers, see query_stats.py)
+QUERY_STATS_ENABLED = os.getenv('QUERY_STATS', '0') == '1'
+
+# Request latency, queries, and database time per route at /api/metrics (see metrics.py)
+METRICS_ENABLED = os.getenv('METRICS', '1') == '1'
+METRICS_N_PLUS_ONE = int(os.getenv('METRICS_N_PLUS_ONE', 10))
+
+# Queries slower than SLOW_QUERY_MS are logged, and the plans of a sample of them stored (see slow_queries.py)
+SLOW_QUERY_LOG_ENABLED = os.getenv('SLOW_QUERY_LOG', '1') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 250))
+SLOW_QUERY_SAMPLE = float(os.getenv('SLOW_QUERY_SAMPLE', 0.1))
+SLOW_QUERY_PLANS = int(os.getenv('SLOW_QUERY_PLANS', 200))
+SLOW_QUERY_DIR = os.getenv('SLOW_QUERY_DIR', str(Path(tempfile.gettempdir()) / 'musedb-slow-queries'))
+COUNT_QUERIES = QUERY_STATS_ENABLED or METRICS_ENABLED or SLOW_QUERY_LOG_ENABLED
+metrics_registry = metrics.Registry()
+request_metrics = metrics.RequestMetrics(metrics_registry, n_plus_one_threshold=METRICS_N_PLUS_ONE)
+
+def pool_gauge(key):
+    """Gets the collect function of a connection pool metric (nothing until the pool is created)"""
+    return lambda: [((), connection_pool.stats()[key])] if connection_pool else []
+
+def cache_gauge(key):
+    """Gets the collect function of a response cache metric"""
+    return lambda: [((), api_cache.stats()[key])]
+
+for name, key, help_text, kind in [
+    ('musedb_pool_connections', 'size', 'Open pooled connections', 'gauge'),
+    ('musedb_pool_connections_in_use', 'in_use', 'Pooled connections checked out', 'gauge'),
+    ('musedb_pool_waiters', 'waiters', 'Requests waiting for a pooled connection', 'gauge'),
+    ('musedb_pool_timeouts_total', 'timeouts', 'Requests that gave up waiting for a pooled connection', 'counter')
+]:
+    metrics_registry.add(metrics.Gauge(name, help_text, (), pool_gauge(key), kind))
+for name, key, help_text, kind in [
+    ('musedb_response_cache_bytes', 'bytes', 'Size of the cached responses', 'gauge'),
+    ('musedb_response_cache_hits_total', 'hits', 'Requests answered from the response cache', 'counter'),
+    ('musedb_response_cache_misses_total', 'misses', 'Cacheable requests that missed the response cache', 'counter')
+]:
+    metrics_registry.add(metrics.Gauge(name, help_text, (), cache_gauge(key), kind))
+metrics_registry.add(metrics.Gauge(
+    'musedb_replica_healthy', 'Whether reads can go to the replica', ('replica',),
+    lambda: [((replica.name,), int(replica.healthy)) for replica in replica_set.replicas]
+))
+metrics_registry.add(metrics.Gauge(
+    'musedb_replica_lag_seconds', 'Replication lag at the last check', ('replica',),
+    lambda: [((replica.name,), replica.lag) for replica in replica_set.replicas if replica.lag is not None]
+))
+
+# Hot fixed queries, PREPAREd once on every pooled connection and then run by name (see statements.py)
+# DB_PREPARE=off turns this off; it is always off through Supabase's transaction pooler (port 6543)
+DB_PREPARE_ENABLED = os.getenv('DB_PREPARE', 'on') != 'off'
+DB_BEHIND_POOLER = int(os.getenv('DB_PORT', 5432)) == statements.TRANSACTION_POOLER_PORT
+prepared_statements = statements.StatementRegistry(
+    lambda conn: get_pool_of(conn).conn_info(conn) if get_pool_of(conn) else None,
+    enabled=DB_PREPARE_ENABLED and not DB_BEHIND_POOLER,
+    disabled_reason='DB_PREPARE=off' if not DB_PREPARE_ENABLED else (
+        'the connection goes through a transaction pooler' if DB_BEHIND_POOLER else None
+    ),
+    cursor_base=query_stats.CountingCursor if COUNT_QUERIES else psycopg2.extensions.cursor
+)
+PREPARED_QUERIES = {
+    'track_estimate': TRACK_ESTIMATE_QUERY,
+    'track_count': TRACK_COUNT_QUERY,
+    'joined_tracks': JOINED_TRACKS_QUERY,
+    'joined_tracks_after': JOINED_TRACKS_AFTER_QUERY,
+    'joined_artists': JOINED_ARTISTS_QUERY,
+    'catalog_tracks': catalog.CATALOG_TRACKS_QUERY,
+    'catalog_tracks_after': catalog.CATALOG_TRACKS_AFTER_QUERY,
+    'catalog_search_trgm': search.CATALOG_SEARCH_QUERIES[True],
+    'catalog_search_fallback': search.CATALOG_SEARCH_QUERIES[False],
+    'catalog_hydrate': search.CATALOG_HYDRATE_QUERY,
+    'discography': discography.DISCOGRAPHY_QUERY,
+    'discography_fallback': discography.DISCOGRAPHY_FALLBACK_QUERY,
+    'search_trgm': search.SEARCH_QUERIES[True],
+    'search_fallback': search.SEARCH_QUERIES[False],
+    'search_hydrate': search.HYDRATE_QUERY,
+    'find_nation': FIND_NATION_QUERY,
+    'any_nation': ANY_NATION_QUERY,
+    'insert_nation': INSERT_NATION_QUERY,
+    'find_artist': FIND_ARTIST_QUERY,
+    'insert_artist': INSERT_ARTIST_QUERY,
+    'find_genre': FIND_GENRE_QUERY,
+    'insert_genre': INSERT_GENRE_QUERY,
+    'artist_genre_exists': ARTIST_GENRE_EXISTS_QUERY,
+    'insert_artist_genre': INSERT_ARTIST_GENRE_QUERY,
+    'find_album': FIND_ALBUM_QUERY,
+    'insert_album': INSERT_ALBUM_QUERY,
+    'artist_album_exists': ARTIST_ALBUM_EXISTS_QUERY,
+    'insert_artist_album': INSERT_ARTIST_ALBUM_QUERY,
+    'find_track': FIND_TRACK_QUERY,
+    'insert_track': INSERT_TRACK_QUERY,
+    'artist_track_exists': ARTIST_TRACK_EXISTS_QUERY,
+    'insert_artist_track': INSERT_ARTIST_TRACK_QUERY
+}
+PREPARED_QUERIES.update({f'preview_delete_{name}': sql for name, sql in music_delete.PREVIEW_QUERIES.items()})
+PREPARED_QUERIES.update({f'delete_{name}': sql for name, sql in music_delete.DELETE_QUERIES.items()})
+
+slow_query_log = slow_queries.SlowQueryLog(
+    lambda: psycopg2.connect(get_connection_string()),
+    threshold_ms=SLOW_QUERY_MS,
+    sample_rate=SLOW_QUERY_SAMPLE,
+    plans_dir=SLOW_QUERY_DIR,
+    max_plans=SLOW_QUERY_PLANS,
+    resolve=prepared_statements.original
+)
+if SLOW_QUERY_LOG_ENABLED:
+    query_stats.slow_query_log = slow_query_log
+for statement_name, statement_sql in PREPARED_QUERIES.items():
+    prepared_statements.register(statement_name, statement_sql)
+
+def joined_artist_params(tracks):
+    """Gets the track ids and album ids of a page of tracks (the parameters of JOINED_ARTISTS_QUERY)"""
+    return ([track[0] for track in tracks], list({track[3] for track in tracks}))
+
+def merge_joined_tracks(tracks, artist_rows):
+    """Formats a page of tracks with their track artists followed by any other album artists"""
+    # Groups the artists by the track or album they belong to
+    artists_by_track, artists_by_album = {}, {}
+    for source, owner_id, artist_id, name, artist_type, description in artist_rows:
+        grouped = artists_by_track if source == 'track' else artists_by_album
+        grouped.setdefault(owner_id, []).append({
+            'artist_id': artist_id,
+            'name': name,
+            'type': artist_type,
+            'description': description
+        })
+    
+    results = []
+    for track in tracks:
+        track_id = track[0]
+        
+        # Combine track artists and album artists
+        all_artists = {artist['artist_id']: artist for artist in artists_by_track.get(track_id, [])}
+        
+        # Add album artists, avoiding duplicates
+        for artist in artists_by_album.get(track[3], []):
+            if artist['artist_id'] not in all_artists:
+                all_artists[artist['artist_id']] = artist
+        
+        # Append the track with this info
+        results.append({
+            'track_id': track_id,
+            'track_name': track[1],
+            'track_length': serialize_value(track[2]),
+            'album_id': track[3],
+            'album_name': track[4],
+            'album_release_date': serialize_value(track[5]) if track[5] else None,
+            'album_description': track[6],
+            'artists': list(all_artists.values())
+        })
+    return results
+
+def format_catalog_tracks(tracks):
+    """Formats a page of track catalog rows (the artists are already merged and ordered like merge_joined_tracks)"""
+    return [
+        {
+            'track_id': track[0],
+            'track_name': track[1],
+            'track_length': serialize_value(track[2]),
+            'album_id': track[3],
+            'album_name': track[4],
+            'album_release_date': serialize_value(track[5]) if track[5] else None,
+            'album_description': track[6],
+            'artists': track[7]
+        }
+        for track in tracks
+    ]
+
+def format_music_results(tracks):
+    """Formats the rows from a music search"""
+    results = []
+    for track in tracks:
+        results.append({
+            'track_id': track[0],
+            'track_name': track[1],
+            'track_length': serialize_value(track[2]),
+            'album_id': track[3],
+            'album_name': track[4],
+            'album_release_date': serialize_value(track[5]) if track[5] else None,
+            'artists': list(track[6])
+        })
+    return results
+
+def cached_track_total():
+    """Gets the cached number of tracks (None if it is not cached or has expired)"""
+    if track_count_cache['value'] is not None and time.monotonic() < track_count_cache['expires_at']:
+        return track_count_cache['value']
+    return None
+
+def store_track_total(total_count):
+    """Caches the number of tracks for TRACK_COUNT_TTL seconds"""
+    track_count_cache['value'] = total_count
+    track_count_cache['expires_at'] = time.monotonic() + TRACK_COUNT_TTL
+    return total_count
+
+def get_track_total(cursor):
+    """Gets the number of tracks from the cache, the planner estimate, or an exact count (in that order)"""
+    total_count = cached_track_total()
+    if total_count is not None:
+        return total_count
+    
+    # Large tables use the planner's row estimate instead of scanning the whole table
+    cursor.execute(TRACK_ESTIMATE_QUERY)
+    estimate = cursor.fetchone()[0]
+    if estimate is not None and estimate >= TRACK_COUNT_ESTIMATE_MIN:
+        return store_track_total(estimate)
+    
+    # Small (or never analyzed) tables are cheap enough to count exactly
+    cursor.execute(TRACK_COUNT_QUERY)
+    return store_track_total(cursor.fetchone()[0])
+
+def invalidate_track_total():
+    """Clears the cached track count (called after every write that is committed)"""
+    track_count_cache['value'] = None
+
+def invalidate_after_write(table_names, cascade=False):
+    """Drops the cached track count and the cached responses that read the tables (called after every commit)
+
+    Deletes also drop the responses of every table the delete can cascade to.
+    """
+    if has_request_context():
+        g.wrote = True
+    replica_set.last_write = time.time()
+    invalidate_track_total()
+    if not cascade:
+        api_cache.invalidate(table_names)
+        return
+    try:
+        api_cache.invalidate(schema_registry.with_dependents(table_names))
+    except Exception as e:
+        # Without the foreign keys there is no way to know what else changed
+        print(f'Error loading foreign keys, clearing the response cache: {e}')
+        api_cache.clear()
+
+def send_cached(entry, cache_status):
+    """Sends a cached response, or 304 Not Modified if the client already has it (If-None-Match)"""
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    # Browsers keep the response but check the ETag with the server before using it again
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Cache'] = cache_status
+    return response
+
+def cached_response(name, tables):
+    """Caches an endpoint's responses for RESPONSE_CACHE_TTLS[name] seconds
+
+    tables lists the tables the endpoint reads (or is a function of the URL parameters that gets them);
+    None means it reads every table. The cache key is the path, the query parameters, the Accept header, and the body.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            # Streams are sent while they are read, so they are never cached
+            if not RESPONSE_CACHE_ENABLED or request.args.get('stream') == '1':
+                return view(**view_args)
             
-            # Connection string for supabase
-            conn_string = (
-                f"host={db_host} "
-                f"port={db_port} "
-                f"dbname={db_name} "
-                f"user={db_user} "
-                f"password={db_password} "
-                f"sslmode=require"
+            key = (
+                request.method, request.path, tuple(sorted(request.args.items(multi=True))),
+                request.headers.get('Accept'), request.get_data()
             )
+            entry = api_cache.get(key)
+            if entry is not None:
+                return send_cached(entry, 'HIT')
             
-            # Tries to create the connection
-            connection_pool = psycopg2.pool.SimpleConnectionPool(1, 20, conn_string)
+            # The versions are read first, so a write that commits while the response is built keeps it out of the cache
+            read_tables = tables(**view_args) if callable(tables) else tables
+            snapshot = api_cache.snapshot(read_tables)
+            response = app.make_response(view(**view_args))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            # A replica may not have the last write yet, so what it read is not kept for everyone else
+            if g.get('used_replica') and time.time() - replica_set.last_write < DB_REPLICA_MAX_LAG:
+                return response
+            entry = api_cache.put(
+                key, response.get_data(), response.mimetype, read_tables, RESPONSE_CACHE_TTLS[name], snapshot
+            )
+            return send_cached(entry, 'MISS')
+        return wrapper
+    return decorator
+
+def encode_cursor(track_id):
+    """Makes an opaque page cursor out of the last track_id on a page"""
+    return base64.urlsafe_b64encode(str(track_id).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Reads the track_id back out of a page cursor (raises ValueError if the cursor is invalid)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def get_stream_format():
+    """Gets the streaming format from ?format=ndjson|csv&stream=1 (None if the request is not streaming)"""
+    if request.args.get('stream') != '1':
+        return None
+    return request.args.get('format', 'ndjson')
+
+def format_stream_header(columns, stream_format):
+    """Formats the first line of a stream (CSV has a header row, NDJSON has none)"""
+    if stream_format != 'csv':
+        return ''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue()
+
+def format_stream_rows(rows, columns, type_oids, stream_format, table=None):
+    """Formats a chunk of streamed rows (rows from /api/all-data also say which table they came from)"""
+    rows = serializers.convert_rows(type_oids, rows)
+    if stream_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if val is None else val for val in row])
+        return buffer.getvalue()
+    
+    lines = []
+    for row in rows:
+        row_dict = dict(zip(columns, row))
+        line = {'table': table, 'row': row_dict} if table else row_dict
+        lines.append(json.dumps(line, default=str))
+    return '\n'.join(lines) + '\n'
+
+def stream_table_rows(conn, tables, stream_format, include_table=False):
+    """Streams every row of the tables through a server-side cursor (and releases the connection at the end)"""
+    try:
+        for table in tables:
+            # Named cursors keep the rows on the server and only send over one chunk at a time
+            cursor = conn.cursor(name=f'stream_{table}')
+            cursor.execute(f"SELECT * FROM {schema.quote_ident(table)} ORDER BY 1;")
+            
+            rows = cursor.fetchmany(STREAM_FIRST_CHUNK_SIZE)
+            columns, type_oids = serializers.describe(cursor.description)
+            header = format_stream_header(columns, stream_format)
+            if header:
+                yield header
+            
+            while rows:
+                yield format_stream_rows(rows, columns, type_oids, stream_format, table if include_table else None)
+                rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+            
+            cursor.close()
+    except Exception as e:
+        # The status code has already been sent, so the error can only be logged
+        print(f'Error streaming rows: {e}')
+    finally:
+        try:
+            # Ends the read-only transaction the named cursors ran in
+            conn.rollback()
+        finally:
+            release_db_connection(conn)
+
+def start_background_tasks():
+    """Starts the work that should happen once when the server starts"""
+    if DB_MIGRATE:
+        conn = None
+        try:
+            conn = psycopg2.connect(get_connection_string())
+            migrate.migrate(conn)
         except Exception as e:
-        # If there is an error, print it and describe why
-            raise ConnectionError(f'Failed to create connection pool: {str(e)}')    
-    return connection_pool.getconn()
+            print(f'Error applying the migrations: {e}')
+        finally:
+            if conn is not None:
+                conn.close()
+    # Opens the pool's first connections before the first request needs them
+    try:
+        get_connection_pool().warm_up()
+    except Exception as e:
+        print(f'Error warming up the connection pool: {e}')
+    # Warns about the indexes the queries need but the database does not have
+    conn = None
+    try:
+        conn = get_db_connection()
+        migrate.check_indexes(conn)
+    except Exception as e:
+        print(f'Error checking the indexes: {e}')
+    finally:
+        release_db_connection(conn)
+    # Measures the replication lag before any read goes to a replica
+    replica_set.start()
+    if SCHEMA_LISTEN:
+        schema_registry.start_listener(lambda: psycopg2.connect(get_connection_string()))
+    if SEARCH_INDEX_ENABLED:
+        music_index.start_build(get_db_connection, release_db_connection)
+    if FACET_INDEX_ENABLED:
+        facet_index.start_build(get_db_connection, release_db_connection)
+    if SUGGEST_INDEX_ENABLED:
+        suggest_index.start_build(get_db_connection, release_db_connection)
 
-def release_db_connection(conn):
-    """Release the database connection"""
-    if connection_pool and conn:
-        connection_pool.putconn(conn)
+@app.after_request
+def remember_write(response):
+    """Sends the client the time of its write, so its reads go to the primary for a few seconds (with replicas)"""
+    if replica_set and g.get('wrote'):
+        response.set_cookie(
+            WROTE_AT_COOKIE, f'{time.time():.3f}', max_age=max(int(DB_REPLICA_READ_YOUR_WRITES + 0.999), 1),
+            httponly=True, samesite='Lax'
+        )
+    return response
+
+def route_label():
+    """Gets the route of the request as it was registered (e.g. /api/tables/<table_name>)"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_query_stats():
+    """Starts counting the queries of the request (QUERY_STATS=1, METRICS=1, or SLOW_QUERY_LOG=1)"""
+    if COUNT_QUERIES:
+        query_stats.start(route_label())
+
+@app.after_request
+def add_query_stats(response):
+    """Records the request metrics and sends the number of queries and the database time of the request
+    (streamed bodies are not included)"""
+    stats = query_stats.finish() if COUNT_QUERIES else None
+    if stats is None:
+        return response
+    if QUERY_STATS_ENABLED:
+        response.headers['X-Query-Count'] = str(stats.queries)
+        response.headers['X-DB-Time-Ms'] = f'{stats.db_seconds * 1000:.3f}'
+    if METRICS_ENABLED:
+        request_metrics.observe(
+            stats.route,
+            request.method,
+            response.status_code,
+            time.perf_counter() - stats.started,
+            stats,
+            None if response.is_streamed else response.content_length
+        )
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get the request, query, pool, and cache metrics in the Prometheus text format"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are turned off (METRICS=0)'}), 404
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Makes sure that the server is running"""
     return jsonify({'status': 'ok', 'message': 'Server is running'})
 
-@app.route('/api/tables', methods=['GET'])
-def get_tables():
-    """Makes sure that one can get all table names from the database"""
+@app.route('/api/admin/pool', methods=['GET'])
+def pool_stats():
+    """Get the connection pool usage and wait times"""
+    if connection_pool is None:
+        return jsonify({'error': 'Connection pool has not been created yet'}), 404
+    return jsonify(connection_pool.stats())
+
+@app.route('/api/admin/replicas', methods=['GET'])
+def replica_stats():
+    """Get the health, replication lag, and usage of the read replicas"""
+    stats = replica_set.stats()
+    stats['enabled'] = bool(replica_set)
+    stats['read_your_writes_seconds'] = DB_REPLICA_READ_YOUR_WRITES
+    return jsonify(stats)
+
+@app.route('/api/admin/schema/refresh', methods=['POST'])
+def refresh_schema():
+    """Reloads the cached table and column names (call this after changing the schema)"""
+    try:
+        tables = schema_registry.load()
+        catalog.forget_catalog()
+        discography.forget_album_stats()
+        prepared_statements.forget_failures()
+        api_cache.clear()
+        return jsonify({'success': True, 'tables': len(tables)})
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error refreshing schema!')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/statements', methods=['GET'])
+def statement_stats():
+    """Get how often each prepared statement ran, with the plan counts from one pooled connection"""
+    conn = None
+    try:
+        plans = {}
+        if prepared_statements.enabled:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            # generic_plans and custom_plans only exist on Postgres 14 and newer - SQL Query
+            cursor.execute(
+                """SELECT * FROM pg_prepared_statements WHERE name = ANY(%s);""",
+                (list(PREPARED_QUERIES),)
+            )
+            columns = [desc[0] for desc in cursor.description]
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                plans[row['name']] = (row.get('generic_plans'), row.get('custom_plans'))
+            cursor.close()
+            conn.commit()
+        return jsonify(prepared_statements.stats(plans))
+    
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching prepared statement stats!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
+@app.route('/api/admin/catalog', methods=['GET'])
+def check_catalog():
+    """Compares the track catalog with the base tables (reads every track)"""
     conn = None
     try:
-        # Get the connection
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # Query to get all table names
-        query = """
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public' 
-            AND table_type = 'BASE TABLE'
-            ORDER BY table_name;
-        """
-        
-        cursor.execute(query)
-        tables = [row[0] for row in cursor.fetchall()]
-        
+        if not catalog.has_catalog(cursor):
+            return jsonify({'error': 'The track catalog does not exist (apply migrations/005_track_catalog.sql)'}), 404
+        result = catalog.check(cursor)
+        cursor.close()
+        conn.commit()
+        result['enabled'] = TRACK_CATALOG_ENABLED
+        return jsonify(result)
+    
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error checking the track catalog!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
+@app.route('/api/admin/catalog/repair', methods=['POST'])
+def repair_catalog():
+    """Recomputes the track catalog rows that differ from the base tables"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if not catalog.has_catalog(cursor):
+            return jsonify({'error': 'The track catalog does not exist (apply migrations/005_track_catalog.sql)'}), 404
+        repaired = catalog.repair(cursor)
+        conn.commit()
         cursor.close()
+        if repaired:
+            invalidate_after_write(['Track'])
+        return jsonify({'success': True, 'repaired': repaired})
+    
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        # If there is an error, print it and return Error 500
+        print(f'Error repairing the track catalog!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
+@app.route('/api/admin/cache', methods=['GET'])
+def cache_stats():
+    """Get the response cache size, hit ratio, and evictions"""
+    stats = api_cache.stats()
+    stats['enabled'] = RESPONSE_CACHE_ENABLED
+    return jsonify(stats)
+
+@app.route('/api/admin/cache/clear', methods=['POST'])
+def clear_cache():
+    """Drops every cached response"""
+    return jsonify({'success': True, 'cleared': api_cache.clear()})
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def slow_query_stats():
+    """Get the queries with the most total time over the slow query threshold"""
+    stats = slow_query_log.stats()
+    stats['enabled'] = SLOW_QUERY_LOG_ENABLED
+    stats['top'] = slow_query_log.top(request.args.get('limit', type=int, default=20))
+    return jsonify(stats)
+
+@app.route('/api/admin/slow-queries/plans/<int:seq>', methods=['GET'])
+def slow_query_plan(seq):
+    """Get a captured slow query plan by its number (listed under plans in /api/admin/slow-queries)"""
+    record = slow_query_log.plans.get(seq) if slow_query_log.plans else None
+    if record is None:
+        return jsonify({'error': f'Plan {seq} was not captured or was overwritten'}), 404
+    return jsonify(record)
+
+@app.route('/api/admin/slow-queries/clear', methods=['POST'])
+def clear_slow_queries():
+    """Forgets the slow queries seen so far (the captured plans stay)"""
+    return jsonify({'success': True, 'cleared': slow_query_log.clear()})
+
+@app.route('/api/search/index', methods=['GET'])
+def search_index_stats():
+    """Get the size and memory use of the in-memory search index"""
+    stats = music_index.stats()
+    stats['enabled'] = SEARCH_INDEX_ENABLED
+    return jsonify(stats)
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest_names():
+    """Get the most popular artist, album, and track names that start with the typed text (or have a word that does)"""
+    text = request.args.get('q', '')
+    kind = request.args.get('kind')
+    if kind is not None and kind not in suggest.KINDS:
+        return jsonify({'error': f"kind must be one of {', '.join(suggest.KINDS)}"}), 400
+    try:
+        limit = request.args.get('limit', type=int, default=suggest.DEFAULT_LIMIT)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    limit = min(limit, suggest.MAX_LIMIT)
+    
+    if not SUGGEST_INDEX_ENABLED:
+        return jsonify({'error': 'Suggestions are turned off (SUGGEST_INDEX=0)'}), 404
+    # Builds the index the first time (and again once it is older than SUGGEST_INDEX_TTL, using the old one meanwhile)
+    if suggest_index.expired and not suggest_index.building:
+        suggest_index.start_build(get_db_connection, release_db_connection)
+    if not suggest_index.ready:
+        response = jsonify({'error': 'Suggestions are not ready yet'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    
+    found = suggest_index.suggest(text, [kind] if kind else suggest.KINDS, limit)
+    return jsonify({
+        'query': text,
+        'suggestions': {
+            found_kind: [
+                {f'{found_kind}_id': row_id, 'name': name, 'popularity': popularity}
+                for row_id, name, popularity in rows
+            ]
+            for found_kind, rows in found.items()
+        }
+    })
+
+@app.route('/api/suggest/index', methods=['GET'])
+def suggest_index_stats():
+    """Get the size and memory use of the in-memory suggestion index"""
+    stats = suggest_index.stats()
+    stats['enabled'] = SUGGEST_INDEX_ENABLED
+    return jsonify(stats)
+
+@app.route('/api/browse/index', methods=['GET'])
+def facet_index_stats():
+    """Get the size and memory use of the in-memory facet bitmaps"""
+    stats = facet_index.stats()
+    stats['enabled'] = FACET_INDEX_ENABLED
+    return jsonify(stats)
+
+@app.route('/api/tables', methods=['GET'])
+@replica_read
+@cached_response('tables', tables=[])
+def get_tables():
+    """Makes sure that one can get all table names from the database"""
+    try:
+        # Get all table names from the schema cache
+        tables = schema_registry.table_names()
+        
         # Returns list of tables
         return jsonify(tables)
         
@@ -116,124 +1034,70 @@ def get_tables():
         # If there is an error, print it and return Error 500
         print(f'Error fetching tables!')
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Kills DB Connection
-        release_db_connection(conn)
 
 @app.route('/api/tracks/joined', methods=['GET'])
+@replica_read
+@cached_response('tracks_joined', tables=['Track', 'Album', 'Artist', 'ArtistTrack', 'ArtistAlbum'])
 def get_tracks_joined():
     """Get tracks with their associated artists and albums"""
     conn = None
     try:
-        # Get limit and offset from query parameters
+        # Get limit and offset (or the cursor from the last page) from query parameters
         limit = request.args.get('limit', type=int, default=15)
         offset = request.args.get('offset', type=int, default=0)
+        if limit < 1 or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset must not be negative'}), 400
+        after = request.args.get('after')
+        
+        after_track_id = None
+        if after:
+            try:
+                after_track_id = decode_cursor(after)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
         
         # Get the connection
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # Get total count
-        count_query = "SELECT COUNT(DISTINCT t.track_id) FROM Track t;"
-        cursor.execute(count_query)
-        total_count = cursor.fetchone()[0]
-        
-        # Get tracks with their albums and artists - SQL Query
-        query = """
-            SELECT DISTINCT
-                t.track_id,
-                t.name AS track_name,
-                t.length AS track_length,
-                a.album_id,
-                a.name AS album_name,
-                a.release_date AS album_release_date,
-                a.description AS album_description
-            FROM Track t
-            INNER JOIN Album a ON t.album_id = a.album_id
-            ORDER BY t.track_id
-            LIMIT %s OFFSET %s;
-        """
-        
-        # Execute the main query and gets the output
-        cursor.execute(query, (limit, offset))
+        total_count = get_track_total(cursor)
+        
+        # The catalog has the albums and the merged artists of every track, so one query gets the whole page
+        use_catalog = TRACK_CATALOG_ENABLED and catalog.has_catalog(cursor)
+        
+        # Get tracks with their albums (one extra row is fetched to know if there are more pages)
+        if after_track_id is not None:
+            # Cursor mode seeks straight to the next track_id using the primary key
+            query = catalog.CATALOG_TRACKS_AFTER_QUERY if use_catalog else JOINED_TRACKS_AFTER_QUERY
+            cursor.execute(query, (after_track_id, limit + 1))
+        else:
+            query = catalog.CATALOG_TRACKS_QUERY if use_catalog else JOINED_TRACKS_QUERY
+            cursor.execute(query, (limit + 1, offset))
         tracks = cursor.fetchall()
+        has_more = len(tracks) > limit
+        tracks = tracks[:limit]
         
-        # Get all associated artists
-        results = []
-        for track in tracks:
-            track_id = track[0]
-            
-            # Get all artists for this track - SQL Query
-            artist_query = """
-                SELECT ar.artist_id, ar.name, ar.type, ar.description
-                FROM Artist ar
-                INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
-                WHERE at.track_id = %s
-                ORDER BY ar.name;
-            """
-            cursor.execute(artist_query, (track_id,))
-            artists = cursor.fetchall()
-            
-            # Formats the artists
-            artist_list = []
-            for artist in artists:
-                artist_list.append({
-                    'artist_id': artist[0],
-                    'name': artist[1],
-                    'type': artist[2],
-                    'description': artist[3]
-                })
-            
-            # Get album artists - SQL Query
-            album_artist_query = """
-                SELECT ar.artist_id, ar.name, ar.type, ar.description
-                FROM Artist ar
-                INNER JOIN ArtistAlbum aa ON ar.artist_id = aa.artist_id
-                WHERE aa.album_id = %s
-                ORDER BY ar.name;
-            """
-            cursor.execute(album_artist_query, (track[3],))
-            album_artists = cursor.fetchall()
-            
-            # Combine track artists and album artists
-            all_artists = {artist[0]: {
-                'artist_id': artist[0],
-                'name': artist[1],
-                'type': artist[2],
-                'description': artist[3]
-            } for artist in artists}
-            
-            # Add album artists, avoiding duplicates
-            for artist in album_artists:
-                if artist[0] not in all_artists:
-                    all_artists[artist[0]] = {
-                        'artist_id': artist[0],
-                        'name': artist[1],
-                        'type': artist[2],
-                        'description': artist[3]
-                    }
-            
-            # Append the track with this info
-            results.append({
-                'track_id': track_id,
-                'track_name': track[1],
-                'track_length': serialize_value(track[2]),
-                'album_id': track[3],
-                'album_name': track[4],
-                'album_release_date': serialize_value(track[5]) if track[5] else None,
-                'album_description': track[6],
-                'artists': list(all_artists.values())
-            })
+        if use_catalog:
+            results = format_catalog_tracks(tracks)
+        else:
+            # Get the track artists and album artists for the whole page in one query
+            artist_rows = []
+            if tracks:
+                cursor.execute(JOINED_ARTISTS_QUERY, joined_artist_params(tracks))
+                artist_rows = cursor.fetchall()
+            results = merge_joined_tracks(tracks, artist_rows)
         
         cursor.close()
         
-        # Return the results with the info
+        # Return the results with the info (next_cursor can be passed back as ?after= for the next page)
         return jsonify({
             'results': results,
             'total_count': total_count,
             'limit': limit,
             'offset': offset,
-            'has_more': (offset + limit) < total_count
+            'has_more': has_more,
+            'next_cursor': encode_cursor(tracks[-1][0]) if has_more else None
         })
         
     except Exception as e:
@@ -244,43 +1108,186 @@ def get_tracks_joined():
         # Kills DB Connection
         release_db_connection(conn)
 
+@app.route('/api/browse', methods=['GET'])
+@replica_read
+@cached_response('browse', tables=MUSIC_TABLES)
+def browse_tracks():
+    """Get a page of the tracks that match the genre, nation, artist type, and release year filters,
+    with the number of tracks of every value of those facets"""
+    conn = None
+    try:
+        # Get the filters, the limit, and the offset (or the cursor from the last page) from query parameters
+        try:
+            filters = facets.parse_filters(request.args)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filter: {e}'}), 400
+        limit = request.args.get('limit', type=int, default=facets.DEFAULT_LIMIT)
+        offset = request.args.get('offset', type=int, default=0)
+        if limit < 1 or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset must not be negative'}), 400
+        limit = min(limit, facets.MAX_LIMIT)
+        after = request.args.get('after')
+        
+        after_track_id = None
+        if after:
+            try:
+                after_track_id = decode_cursor(after)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+        
+        # The bitmaps count every facet without the database once the writes they follow are read again
+        counted = facet_index.counts(filters) if FACET_INDEX_ENABLED else None
+        if FACET_INDEX_ENABLED and counted is None and facet_index.needs_build:
+            facet_index.start_build(get_db_connection, release_db_connection)
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Otherwise every facet is counted in one query
+        facet_source = 'index' if counted is not None else 'query'
+        if counted is None:
+            counted = facets.query_counts(cursor, filters)
+        total_count, counts = counted
+        
+        # Get the matching tracks with their albums (one extra row is fetched to know if there are more pages)
+        # Nothing to look for when no track matches (the query would have to check every track to find that out)
+        tracks = []
+        if total_count:
+            cursor.execute(BROWSE_TRACKS_QUERY, dict(
+                filters, after=after_track_id, limit=limit + 1, offset=0 if after_track_id is not None else offset
+            ))
+            tracks = cursor.fetchall()
+        has_more = len(tracks) > limit
+        tracks = tracks[:limit]
+        
+        # Get the track artists and album artists for the whole page in one query
+        artist_rows = []
+        if tracks:
+            cursor.execute(JOINED_ARTISTS_QUERY, joined_artist_params(tracks))
+            artist_rows = cursor.fetchall()
+        cursor.close()
+        
+        # Return the page with the facet counts (next_cursor can be passed back as ?after= for the next page)
+        return jsonify({
+            'results': merge_joined_tracks(tracks, artist_rows),
+            'total_count': total_count,
+            'limit': limit,
+            'offset': offset,
+            'has_more': has_more,
+            'next_cursor': encode_cursor(tracks[-1][0]) if has_more else None,
+            'filters': filters,
+            'facets': facets.format_facets(counts, filters),
+            'facet_source': facet_source
+        })
+        
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error browsing tracks!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
+@app.route('/api/artists/<int:artist_id>/discography', methods=['GET'])
+@replica_read
+@cached_response('discography', tables=['Artist', 'ArtistAlbum', 'Album', 'Track'])
+def get_discography(artist_id):
+    """Get an artist's albums with their track count and total track length (flags albums whose length is off)"""
+    conn = None
+    try:
+        tolerance = request.args.get('tolerance', type=float, default=DISCOGRAPHY_LENGTH_TOLERANCE)
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # The counts and totals are kept per album by triggers (computed from Track until the migration is applied)
+        rows = discography.get_discography(cursor, artist_id, discography.has_album_stats(cursor))
+        cursor.close()
+        if not rows:
+            return jsonify({'error': f'Artist {artist_id} not found'}), 404
+        
+        albums = []
+        for _, _, album_id, album_name, release_date, album_length, track_count, computed_length in rows:
+            # An artist without albums has one row with no album
+            if album_id is None:
+                continue
+            drift = discography.length_drift(album_length, computed_length)
+            albums.append({
+                'album_id': album_id,
+                'album_name': album_name,
+                'release_date': serialize_value(release_date),
+                'length': serialize_value(album_length),
+                'track_count': track_count,
+                'computed_length': serialize_value(computed_length),
+                'length_drift_seconds': drift,
+                'length_drifts': discography.drifts(drift, tolerance)
+            })
+        
+        return jsonify({
+            'artist_id': rows[0][0],
+            'artist_name': rows[0][1],
+            'albums': albums,
+            'drifting_albums': sum(album['length_drifts'] for album in albums),
+            'tolerance_seconds': tolerance
+        })
+        
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching the discography!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
 @app.route('/api/tables/<table_name>', methods=['GET'])
+@replica_read
+@cached_response('table_data', tables=lambda table_name: [table_name])
 def get_table_data(table_name):
     """Get data from a specific table -- based on the table name"""
     conn = None
     try:
-        # Sanitize table name so there is no SQL injection
-        sanitized_table_name = ''.join(c for c in table_name if c.isalnum() or c == '_')
-        
-        if not sanitized_table_name:
-            return jsonify({'error': 'Invalid table name'}), 400
+        # Only tables in the schema are allowed (so there is no SQL injection)
+        table = schema_registry.get_table(table_name)
+        if not table:
+            return jsonify({'error': 'Table not found'}), 404
+        table_sql = schema.quote_ident(table.name)
+        
+        # Streams the whole table when asked (?format=ndjson|csv&stream=1)
+        stream_format = get_stream_format()
+        if stream_format and stream_format not in STREAM_MIMETYPES:
+            return jsonify({'error': 'Invalid format, must be ndjson or csv'}), 400
+        
+        # Rows or one list per column, as JSON, MessagePack, or Arrow
+        try:
+            response_format = get_response_format()
+        except serializers.NotAcceptable as e:
+            return jsonify({'error': str(e)}), 406
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         conn = get_db_connection()
+        
+        if stream_format:
+            # The stream now owns the connection and releases it when it is done
+            stream_conn, conn = conn, None
+            return Response(
+                stream_with_context(stream_table_rows(stream_conn, [table.name], stream_format)),
+                mimetype=STREAM_MIMETYPES[stream_format]
+            )
+        
         cursor = conn.cursor()
         
         # Get data from the table - SQL Query
-        query = f"SELECT * FROM {sanitized_table_name} ORDER BY 1 LIMIT 1000;"
+        query = f"SELECT * FROM {table_sql} ORDER BY 1 LIMIT 1000;"
         cursor.execute(query)
         
-        columns = [desc[0] for desc in cursor.description]
+        columns, type_oids = serializers.describe(cursor.description)
         rows = cursor.fetchall()
         
-        # Convert rows to dictionaries and to JSON values
-        data = []
-        for row in rows:
-            row_dict = {}
-            for col, val in zip(columns, row):
-                row_dict[col] = serialize_value(val)
-            data.append(row_dict)
-        
         cursor.close()
 
-        # Return the data
-        return jsonify({
-            'columns': columns,
-            'rows': data,
-            'count': len(data)
-        })
+        # Return the data (converted to JSON values with converters picked once from the column types)
+        return table_response(columns, type_oids, rows, response_format)
         
     except Exception as e:
         # If there is an error, print it and return Error 500
@@ -291,44 +1298,15 @@ def get_table_data(table_name):
         release_db_connection(conn)
 
 @app.route('/api/tables/<table_name>/columns', methods=['GET'])
+@replica_read
 def get_table_columns(table_name):
     """Get column information for a specific table"""
-    conn = None
     try:
-        # Sanitize table name so there is no SQL injection
-        sanitized_table_name = ''.join(c for c in table_name if c.isalnum() or c == '_')
-        
-        # If not sanitized, returns  400
-        if not sanitized_table_name:
-            return jsonify({'error': 'Invalid table name'}), 400
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get column information - SQL Query
-        query = """
-            SELECT 
-                column_name,
-                data_type,
-                is_nullable,
-                CASE WHEN is_identity = 'YES' THEN true ELSE false END as is_identity
-            FROM information_schema.columns
-            WHERE table_name = %s AND table_schema = 'public'
-            ORDER BY ordinal_position;
-        """
-        cursor.execute(query, (sanitized_table_name,))
-        
-        # Formats the columns
-        columns = []
-        for row in cursor.fetchall():
-            columns.append({
-                'column_name': row[0],
-                'data_type': row[1],
-                'is_nullable': row[2] == 'YES',
-                'is_identity': row[3]
-            })
+        # Get column information from the schema cache
+        table = schema_registry.get_table(table_name)
         
-        cursor.close()
+        # Unknown tables have no columns
+        columns = table.columns if table else []
 
         # Return the columns
         return jsonify(columns)
@@ -337,56 +1315,58 @@ def get_table_columns(table_name):
         # If there is an error, print it and return Error 500
         print(f'Error fetching columns from {table_name}!')
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Kills DB Connection
-        release_db_connection(conn)
 
 @app.route('/api/all-data', methods=['GET'])
+@replica_read
+@cached_response('all_data', tables=None)
 def get_all_data():
     """Get all data from all tables within the database """
     conn = None
     try:
+        # Streams every table when asked (?format=ndjson&stream=1) -- CSV needs one header, so it is one table at a time
+        stream_format = get_stream_format()
+        if stream_format and stream_format != 'ndjson':
+            return jsonify({'error': 'Invalid format, all tables can only be streamed as ndjson'}), 400
+        
+        # Rows or one list per column, as JSON or MessagePack (an Arrow stream can only hold one table)
+        try:
+            layout, encoding = get_response_format()
+        except serializers.NotAcceptable as e:
+            return jsonify({'error': str(e)}), 406
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if encoding == 'arrow':
+            return jsonify({'error': 'Arrow responses are one table at a time, use /api/tables/<table_name>'}), 400
+        
+        # Stores all table names (from the schema cache)
+        tables = schema_registry.table_names()
+        
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # Get all table names - SQL Query
-        query = """
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public' 
-            AND table_type = 'BASE TABLE'
-            ORDER BY table_name;
-        """
-        cursor.execute(query)
-
-        # Stores all table names
-        tables = [row[0] for row in cursor.fetchall()]
+        if stream_format:
+            # The stream now owns the connection and releases it when it is done
+            stream_conn, conn = conn, None
+            return Response(
+                stream_with_context(stream_table_rows(stream_conn, tables, stream_format, include_table=True)),
+                mimetype=STREAM_MIMETYPES[stream_format]
+            )
         
+        cursor = conn.cursor()
         all_data = {}
         
         # For each table, get the data
         for table in tables:
             # Get data from the table - SQL Query
-            cursor.execute(f"SELECT * FROM {table} ORDER BY 1 LIMIT 1000;")
-            columns = [desc[0] for desc in cursor.description]
+            cursor.execute(f"SELECT * FROM {schema.quote_ident(table)} ORDER BY 1 LIMIT 1000;")
+            columns, type_oids = serializers.describe(cursor.description)
             rows = cursor.fetchall()
-            # Convert rows to dictionaries and stores JSON values
-            data = []
-            for row in rows:
-                row_dict = {}
-                for col, val in zip(columns, row):
-                    row_dict[col] = serialize_value(val)
-                data.append(row_dict)
-            all_data[table] = {
-                'columns': columns,
-                'rows': data,
-                'count': len(data)
-            }
+            # Convert rows to JSON values and stores them
+            all_data[table] = serializers.table_result(columns, type_oids, rows, layout)
         
         cursor.close()
 
         # Return all data
-        return jsonify(all_data)
+        return Response(serializers.encode(all_data, encoding), mimetype=serializers.MIMETYPES[encoding])
         
     except Exception as e:
         # If there is an error, print it and return Error 500
@@ -397,6 +1377,7 @@ def get_all_data():
         release_db_connection(conn)
 
 @app.route('/api/search', methods=['POST'])
+@replica_read
 def search_data():
     """Search for records in a table based on the column value"""
     conn = None
@@ -414,12 +1395,22 @@ def search_data():
         if not all([table_name, column_name, search_value]):
             return jsonify({'error': 'Missing required fields: table, column, value'}), 400
         
-        # Makes sure to sanitize table and column names for no SQL injection
-        sanitized_table = ''.join(c for c in table_name if c.isalnum() or c == '_')
-        sanitized_column = ''.join(c for c in column_name if c.isalnum() or c == '_')
+        # Only tables and columns in the schema are allowed (so there is no SQL injection)
+        table = schema_registry.get_table(table_name)
+        column = table.resolve_column(column_name) if table else None
         
-        if not sanitized_table or not sanitized_column:
+        if not table or not column:
             return jsonify({'error': 'Invalid table or column name'}), 400
+        sanitized_table = schema.quote_ident(table.name)
+        sanitized_column = schema.quote_ident(column)
+        
+        # Rows or one list per column, as JSON, MessagePack, or Arrow
+        try:
+            response_format = get_response_format()
+        except serializers.NotAcceptable as e:
+            return jsonify({'error': str(e)}), 406
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -428,25 +1419,13 @@ def search_data():
         query = f'SELECT * FROM {sanitized_table} WHERE {sanitized_column}::text ILIKE %s ORDER BY 1;'
         cursor.execute(query, (f'%{search_value}%',))
         
-        columns = [desc[0] for desc in cursor.description]
+        columns, type_oids = serializers.describe(cursor.description)
         rows = cursor.fetchall()
         
-        # Convert rows to dictionaries and changes to JSON values
-        data_list = []
-        for row in rows:
-            row_dict = {}
-            for col, val in zip(columns, row):
-                row_dict[col] = serialize_value(val)
-            data_list.append(row_dict)
-        
         cursor.close()
         
-        # Return the search results
-        return jsonify({
-            'columns': columns,
-            'rows': data_list,
-            'count': len(data_list)
-        })
+        # Return the search results (converted to JSON values)
+        return table_response(columns, type_oids, rows, response_format)
         
     except Exception as e:
         # If there is an error, print it and return Error 500
@@ -457,6 +1436,8 @@ def search_data():
         release_db_connection(conn)
 
 @app.route('/api/search/music', methods=['POST'])
+@replica_read
+@cached_response('search_music', tables=['Track', 'Album', 'Artist', 'ArtistTrack'])
 def search_music():
     """Search for music across tracks, artists, and albums using a query"""
     conn = None
@@ -471,67 +1452,36 @@ def search_music():
         if not search_query:
             return jsonify({'error': 'Missing search query'}), 400
         
+        # Get the max number of results
+        try:
+            limit = search.parse_limit(data.get('limit', request.args.get('limit')))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid limit'}), 400
+        
+        # Answer from the in-memory index when it is built (the database is only used to get the matched rows)
+        use_index = SEARCH_INDEX_ENABLED and music_index.ready
+        if SEARCH_INDEX_ENABLED and not music_index.ready and not music_index.building:
+            music_index.start_build(get_db_connection, release_db_connection)
+        
+        if use_index:
+            ranked = music_index.search(search_query, limit)
+            if not ranked:
+                return jsonify([])
+        
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Search across tracks, artists, and albums - SQL Query
-        query = """
-            SELECT DISTINCT
-                t.track_id,
-                t.name AS track_name,
-                t.length AS track_length,
-                a.album_id,
-                a.name AS album_name,
-                a.release_date AS album_release_date
-            FROM Track t
-            INNER JOIN Album a ON t.album_id = a.album_id
-            LEFT JOIN ArtistTrack at ON t.track_id = at.track_id
-            LEFT JOIN Artist ar ON at.artist_id = ar.artist_id
-            WHERE 
-                t.name ILIKE %s
-                OR ar.name ILIKE %s
-                OR a.name ILIKE %s
-            ORDER BY t.name, a.name;
-        """
-        
-        search_pattern = f'%{search_query}%'
-        cursor.execute(query, (search_pattern, search_pattern, search_pattern))
+        # The catalog has every track with its album and artist names in one row
+        use_catalog = TRACK_CATALOG_ENABLED and catalog.has_catalog(cursor)
         
-        tracks = cursor.fetchall()
-        
-        # Group tracks and collect all artists for each track
-        results = []
-        track_artists_map = {}
-        
-        # First collects track info
-        for track in tracks:
-            track_id = track[0]
-            if track_id not in track_artists_map:
-                track_artists_map[track_id] = {
-                    'track_id': track_id,
-                    'track_name': track[1],
-                    'track_length': serialize_value(track[2]),
-                    'album_id': track[3],
-                    'album_name': track[4],
-                    'album_release_date': serialize_value(track[5]) if track[5] else None,
-                    'artists': []
-                }
-        
-        # Second gets all artists for each track
-        for track_id in track_artists_map.keys():
-            artist_query = """
-                SELECT ar.name
-                FROM Artist ar
-                INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
-                WHERE at.track_id = %s
-                ORDER BY ar.name;
-            """
-            cursor.execute(artist_query, (track_id,))
-            artists = [row[0] for row in cursor.fetchall()]
-            track_artists_map[track_id]['artists'] = artists
+        if use_index:
+            tracks = search.hydrate_tracks(cursor, ranked, use_catalog)
+        else:
+            # Search across tracks, artists, and albums (ranked by relevance, artists are fetched in the same query)
+            tracks = search.search_tracks(cursor, search_query, limit, use_catalog)
         
         # Lists the final results
-        results = list(track_artists_map.values())
+        results = format_music_results(tracks)
         
         cursor.close()
 
@@ -563,30 +1513,16 @@ def insert_data():
         if not table_name or not insert_data_dict:
             return jsonify({'error': 'Missing required fields: table, data'}), 400
         
-        # Sanitize table name to prevent SQL injection
-        sanitized_table = ''.join(c for c in table_name if c.isalnum() or c == '_')
-        if not sanitized_table:
+        # Only tables in the schema are allowed (to prevent SQL injection)
+        table = schema_registry.get_table(table_name)
+        if not table:
             return jsonify({'error': 'Invalid table name'}), 400
+        sanitized_table = schema.quote_ident(table.name)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Query to get column info for the table - SQL Query
-        cursor.execute(f"""
-            SELECT 
-                c.column_name, 
-                c.data_type,
-                CASE WHEN c.is_identity = 'YES' THEN true ELSE false END as is_identity
-            FROM information_schema.columns c
-            WHERE c.table_name = %s AND c.table_schema = 'public'
-            ORDER BY c.ordinal_position;
-        """, (sanitized_table,))
-        
-        # Get column names, types, and identity columns
-        table_columns = cursor.fetchall()
-        column_names = [col[0] for col in table_columns]
-        column_types = {col[0]: col[1] for col in table_columns}
-        identity_columns = {col[0] for col in table_columns if col[2]}
+        # Get column names, types, and identity columns (from the schema cache)
+        column_names = [col['column_name'] for col in table.columns]
+        column_types = table.column_types
+        identity_columns = table.identity_columns
         
         # Filter out columns that don't exist
         valid_data = {k: v for k, v in insert_data_dict.items() 
@@ -610,22 +1546,13 @@ def insert_data():
         query = f'INSERT INTO {sanitized_table} ({column_names_str}) VALUES ({placeholders}) RETURNING *;'
         
         # Prepare values while doing correct type conversion
-        values = []
-        for col in columns:
-            val = filtered_data[col]
-            # Try to convert based on column type
-            col_type = column_types.get(col, '').upper()
-            if 'INT' in col_type:
-                try:
-                    values.append(int(val))
-                except ValueError:
-                    return jsonify({'error': f'Invalid integer value for column {col}'}), 400
-            elif 'DATE' in col_type:
-                values.append(val)
-            elif 'INTERVAL' in col_type:
-                values.append(val)
-            else:
-                values.append(str(val))
+        try:
+            values = [coerce_value(col, column_types.get(col, ''), filtered_data[col]) for col in columns]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
         
         cursor.execute(query, values)
         result = cursor.fetchone()
@@ -637,8 +1564,13 @@ def insert_data():
             inserted_row[col] = serialize_value(val)
         
         conn.commit()
+        invalidate_after_write([table.name])
         cursor.close()
         
+        # Keep the in-memory indexes up to date
+        if table.name.lower() in INDEXED_TABLES:
+            apply_to_indexes('apply_insert', table.name, dict(zip(columns_result, result)))
+        
         # Return the inserted record
         return jsonify({
             'success': True,
@@ -659,6 +1591,170 @@ def insert_data():
         # Kills DB Connection
         release_db_connection(conn)
 
+def read_bulk_rows():
+    """Gets the table, rows, and batch size for a bulk insert (from a JSON body or an NDJSON body)"""
+    parse_errors = []
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        # NDJSON: one row per line, the table and batch size come from the query parameters
+        table_name = request.args.get('table')
+        batch_size = request.args.get('batch_size')
+        rows = []
+        for line_num, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                parse_errors.append({'row': len(rows), 'line': line_num + 1, 'error': 'Invalid JSON'})
+                rows.append(None)
+    else:
+        data = request.get_json(silent=True) or {}
+        table_name = data.get('table')
+        batch_size = data.get('batch_size', request.args.get('batch_size'))
+        rows = data.get('rows')
+    return table_name, rows, batch_size, parse_errors
+
+@app.route('/api/insert/bulk', methods=['POST'])
+def insert_bulk():
+    """Insert many records into a table at once (in batches, each batch is committed separately)"""
+    conn = None
+    try:
+        table_name, rows, batch_size, errors = read_bulk_rows()
+        
+        if not table_name or not isinstance(rows, list) or not rows:
+            return jsonify({'error': 'Missing required fields: table, rows'}), 400
+        
+        try:
+            batch_size = int(batch_size) if batch_size is not None else BULK_INSERT_BATCH_SIZE
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid batch_size'}), 400
+        if batch_size < 1:
+            return jsonify({'error': 'Invalid batch_size'}), 400
+        batch_size = min(batch_size, BULK_INSERT_MAX_BATCH_SIZE)
+        
+        # Only tables in the schema are allowed (to prevent SQL injection)
+        table = schema_registry.get_table(table_name)
+        if not table:
+            return jsonify({'error': 'Invalid table name'}), 400
+        
+        # Columns to insert: every non-identity column that shows up in any row (in table order)
+        column_types = table.column_types
+        identity_columns = table.identity_columns
+        given_columns = set()
+        for row in rows:
+            if isinstance(row, dict):
+                given_columns.update(k for k, v in row.items() if v is not None and v != '')
+        columns = [col['column_name'] for col in table.columns
+                   if col['column_name'] in given_columns and col['column_name'] not in identity_columns]
+        
+        if not columns:
+            return jsonify({'error': 'No valid data provided'}), 400
+        
+        # Convert every row once (rows that cannot be converted are reported and skipped)
+        converters = [(col, column_types.get(col, '')) for col in columns]
+        prepared = []
+        for row_num, row in enumerate(rows):
+            if row is None:
+                continue
+            if not isinstance(row, dict):
+                errors.append({'row': row_num, 'error': 'Row must be an object'})
+                continue
+            try:
+                values = []
+                for col, col_type in converters:
+                    val = row.get(col)
+                    values.append(None if val is None or val == '' else coerce_value(col, col_type, val))
+                prepared.append((row_num, tuple(values)))
+            except ValueError as e:
+                errors.append({'row': row_num, 'error': str(e)})
+        
+        # Inserted rows are only returned when the in-memory indexes need them
+        index_rows = table.name.lower() in INDEXED_TABLES
+        column_names_str = ', '.join(schema.quote_ident(col) for col in columns)
+        returning = ' RETURNING *' if index_rows else ''
+        query = f'INSERT INTO {schema.quote_ident(table.name)} ({column_names_str}) VALUES %s{returning}'
+        row_query = f'INSERT INTO {schema.quote_ident(table.name)} ({column_names_str}) VALUES ({", ".join(["%s"] * len(columns))}){returning}'
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        started = time.monotonic()
+        batches = []
+        inserted_rows = []
+        result_columns = []
+        inserted = 0
+        for batch_num, start in enumerate(range(0, len(prepared), batch_size)):
+            batch = prepared[start:start + batch_size]
+            batch_started = time.monotonic()
+            batch_errors = []
+            try:
+                # The whole batch goes in with one multi-row INSERT
+                result = execute_values(cursor, query, [values for _, values in batch],
+                                        page_size=len(batch), fetch=index_rows)
+                batch_inserted = len(batch)
+                if index_rows:
+                    inserted_rows.extend(result)
+                    result_columns = [desc[0] for desc in cursor.description]
+            except psycopg2.Error:
+                # The batch failed, so each row is tried on its own to find the bad ones
+                conn.rollback()
+                batch_inserted = 0
+                for row_num, values in batch:
+                    cursor.execute('SAVEPOINT bulk_row;')
+                    try:
+                        cursor.execute(row_query, values)
+                        if index_rows:
+                            inserted_rows.append(cursor.fetchone())
+                            result_columns = [desc[0] for desc in cursor.description]
+                        cursor.execute('RELEASE SAVEPOINT bulk_row;')
+                        batch_inserted += 1
+                    except psycopg2.Error as e:
+                        cursor.execute('ROLLBACK TO SAVEPOINT bulk_row;')
+                        batch_errors.append({'row': row_num, 'error': str(e).strip()})
+            conn.commit()
+            invalidate_after_write([table.name])
+            
+            inserted += batch_inserted
+            errors.extend(batch_errors)
+            batches.append({
+                'batch': batch_num,
+                'rows': len(batch),
+                'inserted': batch_inserted,
+                'failed': len(batch_errors),
+                'elapsed_seconds': round(time.monotonic() - batch_started, 4)
+            })
+        
+        elapsed = time.monotonic() - started
+        cursor.close()
+        
+        # Keep the in-memory indexes up to date
+        for row in inserted_rows:
+            apply_to_indexes('apply_insert', table.name, dict(zip(result_columns, row)))
+        
+        # Return the results of each batch and the throughput
+        errors.sort(key=lambda error: error['row'])
+        return jsonify({
+            'success': not errors,
+            'table': table.name,
+            'inserted': inserted,
+            'failed': len(errors),
+            'batches': batches,
+            'errors': errors[:BULK_INSERT_MAX_ERRORS],
+            'errors_truncated': len(errors) > BULK_INSERT_MAX_ERRORS,
+            'elapsed_seconds': round(elapsed, 4),
+            'rows_per_second': round(inserted / elapsed, 1) if elapsed > 0 else None
+        })
+    
+    # If there is an error then rollback; print it and return Error
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f'Error bulk inserting data!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
 @app.route('/api/delete', methods=['DELETE'])
 def delete_data():
     """Delete records from a table matching a column value"""
@@ -677,25 +1773,40 @@ def delete_data():
         if not all([table_name, column_name, delete_value]):
             return jsonify({'error': 'Missing required fields: table, column, value'}), 400
         
-        # Sanitize table and column names to prevent SQL injection
-        sanitized_table = ''.join(c for c in table_name if c.isalnum() or c == '_')
-        sanitized_column = ''.join(c for c in column_name if c.isalnum() or c == '_')
+        # Only tables and columns in the schema are allowed (to prevent SQL injection)
+        table = schema_registry.get_table(table_name)
+        column = table.resolve_column(column_name) if table else None
         
-        if not sanitized_table or not sanitized_column:
+        if not table or not column:
             return jsonify({'error': 'Invalid table or column name'}), 400
+        sanitized_table = schema.quote_ident(table.name)
+        sanitized_column = schema.quote_ident(column)
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # Deleted rows are only returned when the in-memory indexes need them
+        index_rows = table.name.lower() in INDEXED_TABLES
+        returning = ' RETURNING *' if index_rows else ''
+        
         # Use parameterized query for the delete value to prevent SQL injection
-        query = f'DELETE FROM {sanitized_table} WHERE {sanitized_column}::text ILIKE %s;'
+        query = f'DELETE FROM {sanitized_table} WHERE {sanitized_column}::text ILIKE %s{returning};'
         cursor.execute(query, (f'%{delete_value}%',))
         
         # Get number of deleted records
         deleted_count = cursor.rowcount
+        deleted_rows = []
+        if index_rows:
+            deleted_columns = [desc[0] for desc in cursor.description]
+            deleted_rows = [dict(zip(deleted_columns, row)) for row in cursor.fetchall()]
         conn.commit()
+        invalidate_after_write([table.name], cascade=True)
         cursor.close()
         
+        # Keep the in-memory indexes up to date
+        if deleted_rows:
+            apply_to_indexes('apply_delete', table.name, deleted_rows)
+        
         # Return the result
         return jsonify({
             'success': True,
@@ -750,20 +1861,20 @@ def insert_music():
         nation_id = None
         if nation_name:
             # Sees if the nation already exists
-            cursor.execute("SELECT nation_id FROM Nation WHERE name ILIKE %s;", (nation_name,))
+            cursor.execute(FIND_NATION_QUERY, (nation_name,))
             nation_row = cursor.fetchone()
             if nation_row:
                 nation_id = nation_row[0]
             else:
                 # Adds the new nation in
                 cursor.execute(
-                    "INSERT INTO Nation (name, comment) VALUES (%s, %s) RETURNING nation_id;",
+                    INSERT_NATION_QUERY,
                     (nation_name, nation_comment)
                 )
                 nation_id = cursor.fetchone()[0]
         
         # Handles Artist if not currently within the DB
-        cursor.execute("SELECT artist_id FROM Artist WHERE name ILIKE %s;", (artist_name,))
+        cursor.execute(FIND_ARTIST_QUERY, (artist_name,))
         artist_row = cursor.fetchone()
         if artist_row:
             artist_id = artist_row[0]
@@ -771,7 +1882,7 @@ def insert_music():
             # Create new artist
             if not nation_id:
                 # If nation not provided in request, try to find one in DB
-                cursor.execute("SELECT nation_id FROM Nation LIMIT 1;")
+                cursor.execute(ANY_NATION_QUERY)
                 nation_row = cursor.fetchone()
                 if not nation_row:
                     return jsonify({'error': 'No nation found in database and none provided. Please add a nation.'}), 400
@@ -779,7 +1890,7 @@ def insert_music():
             
             # Insert
             cursor.execute(
-                "INSERT INTO Artist (name, description, nation_id) VALUES (%s, %s, %s) RETURNING artist_id;",
+                INSERT_ARTIST_QUERY,
                 (artist_name, artist_description, nation_id)
             )
             artist_id = cursor.fetchone()[0]
@@ -787,55 +1898,55 @@ def insert_music():
         # Handles Genre if not cucrently within the DB
         if genre_name:
             # Tries to select the Genre
-            cursor.execute("SELECT genre_id FROM Genre WHERE name ILIKE %s;", (genre_name,))
+            cursor.execute(FIND_GENRE_QUERY, (genre_name,))
             genre_row = cursor.fetchone()
             if genre_row:
                 genre_id = genre_row[0]
             else:
                 # If not in the DB, then insert it in
                 cursor.execute(
-                    "INSERT INTO Genre (name, description) VALUES (%s, %s) RETURNING genre_id;",
+                    INSERT_GENRE_QUERY,
                     (genre_name, genre_description)
                 )
                 genre_id = cursor.fetchone()[0]
             
             cursor.execute(
-                "SELECT 1 FROM ArtistGenre WHERE artist_id = %s AND genre_id = %s;",
+                ARTIST_GENRE_EXISTS_QUERY,
                 (artist_id, genre_id)
             )
             if not cursor.fetchone():
                 cursor.execute(
-                    "INSERT INTO ArtistGenre (artist_id, genre_id) VALUES (%s, %s);",
+                    INSERT_ARTIST_GENRE_QUERY,
                     (artist_id, genre_id)
                 )
         
         # Handles Album if not cucrently within the DB -- Tries to get the Album
-        cursor.execute("SELECT album_id FROM Album WHERE name ILIKE %s;", (album_name,))
+        cursor.execute(FIND_ALBUM_QUERY, (album_name,))
         album_row = cursor.fetchone()
         if album_row:
             album_id = album_row[0]
         else:
             # If the album is not there, then add it in
             cursor.execute(
-                "INSERT INTO Album (name, release_date, description) VALUES (%s, %s, %s) RETURNING album_id;",
+                INSERT_ALBUM_QUERY,
                 (album_name, album_release_date if album_release_date else None, album_description if album_description else None)
             )
             album_id = cursor.fetchone()[0]
         
         # Link artist to album
         cursor.execute(
-            "SELECT 1 FROM ArtistAlbum WHERE artist_id = %s AND album_id = %s;",
+            ARTIST_ALBUM_EXISTS_QUERY,
             (artist_id, album_id)
         )
         if not cursor.fetchone():
             cursor.execute(
-                "INSERT INTO ArtistAlbum (artist_id, album_id) VALUES (%s, %s);",
+                INSERT_ARTIST_ALBUM_QUERY,
                 (artist_id, album_id)
             )
         
         # Check if track already exists in the album, if not then add
         cursor.execute(
-            "SELECT track_id FROM Track WHERE name ILIKE %s AND album_id = %s;",
+            FIND_TRACK_QUERY,
             (song_name, album_id)
         )
         track_row = cursor.fetchone()
@@ -846,7 +1957,7 @@ def insert_music():
         else:
             # Create track and then adds to the DB
             cursor.execute(
-                "INSERT INTO Track (name, length, album_id) VALUES (%s, %s, %s) RETURNING track_id;",
+                INSERT_TRACK_QUERY,
                 (song_name, track_length if track_length else None, album_id)
             )
             track_id = cursor.fetchone()[0]
@@ -854,18 +1965,25 @@ def insert_music():
         
         # Link artist to track
         cursor.execute(
-            "SELECT 1 FROM ArtistTrack WHERE artist_id = %s AND track_id = %s;",
+            ARTIST_TRACK_EXISTS_QUERY,
             (artist_id, track_id)
         )
         if not cursor.fetchone():
             cursor.execute(
-                "INSERT INTO ArtistTrack (artist_id, track_id) VALUES (%s, %s);",
+                INSERT_ARTIST_TRACK_QUERY,
                 (artist_id, track_id)
             )
         
         conn.commit()
+        invalidate_after_write(MUSIC_TABLES)
         cursor.close()
         
+        # Keep the in-memory indexes up to date (rows that were already there are left alone)
+        apply_to_indexes('add_artist', artist_id, artist_name)
+        apply_to_indexes('add_album', album_id, album_name)
+        apply_to_indexes('add_track', track_id, song_name, album_id)
+        apply_to_indexes('link_artist_track', artist_id, track_id)
+        
         # Return the Json data
         return jsonify({
             'success': True,
@@ -887,7 +2005,73 @@ def insert_music():
         # Kills DB Connection
         release_db_connection(conn)
 
+@app.route('/api/insert/music/batch', methods=['POST'])
+def insert_music_batch():
+    """Insert a list of songs at once (same rules as /api/insert/music, with a fixed number of queries per batch)"""
+    conn = None
+    try:
+        # Get the JSON data from the request
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        songs = data.get('songs')
+        if not isinstance(songs, list) or not songs:
+            return jsonify({'error': 'Missing required field: songs'}), 400
+        if len(songs) > music_batch.MAX_BATCH_SONGS:
+            return jsonify({'error': f'At most {music_batch.MAX_BATCH_SONGS} songs can be inserted at once'}), 400
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Resolves and creates every nation, artist, genre, album, and track for the whole batch
+        started = time.monotonic()
+        results = music_batch.insert_songs(cursor, songs)
+        
+        conn.commit()
+        invalidate_after_write(MUSIC_TABLES)
+        cursor.close()
+        elapsed = time.monotonic() - started
+        
+        # Keep the in-memory indexes up to date (rows that were already there are left alone)
+        for song, result in zip(songs, results):
+            if result['success']:
+                apply_to_indexes('add_artist', result['artist_id'], song['artist_name'])
+                apply_to_indexes('add_album', result['album_id'], song['album_name'])
+                apply_to_indexes('add_track', result['track_id'], song['song_name'], result['album_id'])
+                apply_to_indexes('link_artist_track', result['artist_id'], result['track_id'])
+        
+        # Return the result of each song
+        inserted = sum(1 for result in results if result['success'])
+        return jsonify({
+            'success': inserted == len(results),
+            'results': results,
+            'inserted': inserted,
+            'failed': len(results) - inserted,
+            'elapsed_seconds': round(elapsed, 4),
+            'songs_per_second': round(len(results) / elapsed, 1) if elapsed > 0 else None
+        })
+    
+    # If there is an error then rollback; print it and return Error
+    except music_batch.MusicBatchError as e:
+        if conn:
+            conn.rollback()
+        return jsonify({'error': str(e)}), 400
+    except psycopg2.IntegrityError as e:
+        if conn:
+            conn.rollback()
+        return jsonify({'error': f'Database constraint violation: {str(e)}'}), 400
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f'Error inserting music batch!')
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Kills DB Connection
+        release_db_connection(conn)
+
 @app.route('/api/delete/preview', methods=['POST'])
+@replica_read
 def delete_preview():
     """Preview what will be deleted so that the user knows the impact"""
     conn = None
@@ -904,109 +2088,22 @@ def delete_preview():
         if not all([delete_type, delete_value]):
             return jsonify({'error': 'Missing type or value'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Depending on delete type, prepare the preview - SQL Queries
-        if delete_type == 'song':
-            # Get song and count affected records
-            query = "SELECT * FROM Track WHERE name ILIKE %s;"
-            cursor.execute(query, (f'%{delete_value}%',))
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            
-            # Count affected
-            affected_count = len(rows)
-            
-        elif delete_type == 'artist':
-            # Get artist and count all related records
-            cursor.execute("SELECT artist_id FROM Artist WHERE name ILIKE %s;", (f'%{delete_value}%',))
-            artists = cursor.fetchall()
-            if not artists:
-                return jsonify({
-                    'columns': [],
-                    'rows': [],
-                    'affected_count': 0
-                })
-            
-            artist_ids = [a[0] for a in artists]
-            
-            # Count tracks associated with this artist
-            cursor.execute(
-                "SELECT COUNT(DISTINCT t.track_id) FROM Track t INNER JOIN ArtistTrack at ON t.track_id = at.track_id WHERE at.artist_id = ANY(%s);",
-                (artist_ids,)
-            )
-            track_count = cursor.fetchone()[0]
-            
-            # Count albums associated with this artist
-            cursor.execute(
-                "SELECT COUNT(DISTINCT a.album_id) FROM Album a INNER JOIN ArtistAlbum aa ON a.album_id = aa.album_id WHERE aa.artist_id = ANY(%s);",
-                (artist_ids,)
-            )
-            album_count = cursor.fetchone()[0]
-            
-            # Count tracks in those albums
-            cursor.execute(
-                "SELECT COUNT(*) FROM Track t INNER JOIN Album a ON t.album_id = a.album_id INNER JOIN ArtistAlbum aa ON a.album_id = aa.album_id WHERE aa.artist_id = ANY(%s);",
-                (artist_ids,)
-            )
-            album_track_count = cursor.fetchone()[0]
-            
-            # Returns the total affected count
-            affected_count = len(artists) + album_count + track_count + album_track_count
-            
-            # Return the data
-            query = "SELECT * FROM Artist WHERE name ILIKE %s;"
-            cursor.execute(query, (f'%{delete_value}%',))
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            
-        elif delete_type == 'album':
-            # Get album and count related tracks
-            cursor.execute("SELECT album_id FROM Album WHERE name ILIKE %s;", (f'%{delete_value}%',))
-            albums = cursor.fetchall()
-            if not albums:
-                return jsonify({
-                    'columns': [],
-                    'rows': [],
-                    'affected_count': 0
-                })
-            
-            album_ids = [a[0] for a in albums]
-            
-            # Count tracks that will be deleted
-            cursor.execute(
-                "SELECT COUNT(*) FROM Track WHERE album_id = ANY(%s);",
-                (album_ids,)
-            )
-            track_count = cursor.fetchone()[0]
-            
-            # Get total affected count
-            affected_count = len(albums) + track_count
-            
-            # Return the data
-            query = "SELECT * FROM Album WHERE name ILIKE %s;"
-            cursor.execute(query, (f'%{delete_value}%',))
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-        else:
+        if delete_type not in music_delete.TARGETS:
             return jsonify({'error': 'Invalid delete type'}), 400
         
-        # Convert rows to dictionaries and to JSON values
-        data_list = []
-        for row in rows:
-            row_dict = {}
-            for col, val in zip(columns, row):
-                row_dict[col] = serialize_value(val)
-            data_list.append(row_dict)
+        conn = get_db_connection()
+        cursor = conn.cursor()
         
+        # Counts and rows come from the same statement as the delete's targets, so they match what it removes
+        columns, type_oids, rows, breakdown = music_delete.preview(cursor, delete_type, delete_value)
         cursor.close()
         
         # Return the data
-        return jsonify({
+        return json_response({
             'columns': columns,
-            'rows': data_list,
-            'affected_count': affected_count
+            'rows': serializers.rows_to_dicts(columns, type_oids, rows),
+            'affected_count': music_delete.deleted_count(breakdown),
+            'breakdown': breakdown
         })
         
     except Exception as e:
@@ -1034,77 +2131,33 @@ def delete_music():
         if not all([delete_type, delete_value]):
             return jsonify({'error': 'Missing type or value'}), 400
         
+        if delete_type not in music_delete.TARGETS:
+            return jsonify({'error': 'Invalid delete type'}), 400
+        
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        deleted_count = 0
-        
-        if delete_type == 'song':
-            # Delete the track
-            cursor.execute("DELETE FROM Track WHERE name ILIKE %s;", (f'%{delete_value}%',))
-            deleted_count = cursor.rowcount
-            
-        elif delete_type == 'artist':
-            # Get the artist IDs
-            cursor.execute("SELECT artist_id FROM Artist WHERE name ILIKE %s;", (f'%{delete_value}%',))
-            artist_ids = [row[0] for row in cursor.fetchall()]
-            
-            if artist_ids:
-                # Get album IDs from this artist
-                cursor.execute(
-                    "SELECT DISTINCT album_id FROM ArtistAlbum WHERE artist_id = ANY(%s);",
-                    (artist_ids,)
-                )
-                album_ids = [row[0] for row in cursor.fetchall()]
-                
-                # Delete all tracks associated with this artist
-                if album_ids:
-                    cursor.execute(
-                        """DELETE FROM Track 
-                           WHERE track_id IN (SELECT track_id FROM ArtistTrack WHERE artist_id = ANY(%s))
-                           AND album_id NOT IN (SELECT unnest(%s::int[]));""",
-                        (artist_ids, album_ids)
-                    )
-                else:
-                    # No albums, so delete all tracks
-                    cursor.execute(
-                        "DELETE FROM Track WHERE track_id IN (SELECT track_id FROM ArtistTrack WHERE artist_id = ANY(%s));",
-                        (artist_ids,)
-                    )
-                tracks_deleted = cursor.rowcount
-                
-                # Delete all albums associated with this artist (this will cascade delete tracks in those albums)
-                if album_ids:
-                    cursor.execute(
-                        "DELETE FROM Album WHERE album_id = ANY(%s);",
-                        (album_ids,)
-                    )
-                    albums_deleted = cursor.rowcount
-                else:
-                    albums_deleted = 0
-                
-                # Delete the artist and cascade delete the rest
-                cursor.execute("DELETE FROM Artist WHERE artist_id = ANY(%s);", (artist_ids,))
-                artists_deleted = cursor.rowcount
-                
-                # Return JSON response
-                deleted_count = artists_deleted + albums_deleted + tracks_deleted
-            
-        elif delete_type == 'album':
-            # Delete the album and cascade delete the rest
-            cursor.execute("DELETE FROM Album WHERE name ILIKE %s;", (f'%{delete_value}%',))
-            deleted_count = cursor.rowcount
-        else:
-            return jsonify({'error': 'Invalid delete type'}), 400
+        # One statement deletes the targets, their tracks, and their link rows, and counts each of them
+        deleted_artist_ids, deleted_album_ids, deleted_track_ids, breakdown = music_delete.delete(
+            cursor, delete_type, delete_value
+        )
+        deleted_count = music_delete.deleted_count(breakdown)
         
         conn.commit()
+        invalidate_after_write(music_delete.changed_tables(breakdown))
         cursor.close()
         
+        # Keep the in-memory indexes up to date
+        apply_to_indexes('remove_tracks', deleted_track_ids)
+        apply_to_indexes('remove_albums', deleted_album_ids)
+        apply_to_indexes('remove_artists', deleted_artist_ids)
+        
         # Return JSON response
         return jsonify({
             'success': True,
             'message': f'Deleted {deleted_count} record(s)',
-            'deleted_count': deleted_count
+            'deleted_count': deleted_count,
+            'breakdown': breakdown
         })
     
     # If there is a constraint violation, rollback and return Error 400
@@ -1125,5 +2178,8 @@ if __name__ == '__main__':
     # Starts the server and the connection
     port = int(os.getenv('PORT', 3001))
     print(f'Server running on http://localhost:{port}')
+    # With the debug reloader, only the process that serves requests starts the background work
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
     app.run(host='0.0.0.0', port=port, debug=True)
 
@@ -0,0 +1,686 @@
+"""Async (ASGI) server for the API -- run with: uvicorn asgi:app --port 3001
+
+The read endpoints are served here with asyncpg, so a slow query only holds a connection and not a worker thread.
+Everything else (inserts, deletes, admin endpoints) is passed through to the Flask app in app.py.
+Reads go to a healthy replica when DB_REPLICA_DSNS is set, the same way as in the Flask app.
+"""
+import asyncio
+import functools
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+import psycopg2.extensions
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+import app as server
+import catalog
+import query_stats
+import schema
+import search
+import serializers
+
+# Matches psycopg2 placeholders (%s and %(name)s) so the same SQL can be sent through asyncpg
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s')
+
+# Supabase's transaction pooler (port 6543) cannot keep prepared statements between transactions
+PGBOUNCER_PORT = 6543
+
+class JSONResponse(Response):
+    """JSON response encoded the same way as Flask's jsonify (so both servers return the same bytes)"""
+    media_type = 'application/json'
+
+    def render(self, content):
+        return (server.app.json.dumps(content) + '\n').encode('utf-8')
+
+def table_response(columns, type_oids, rows, response_format):
+    """Sends one table's rows in the negotiated layout and encoding"""
+    layout, encoding = response_format
+    if encoding == 'arrow':
+        body = serializers.encode_arrow(columns, type_oids, rows)
+    else:
+        body = serializers.encode(serializers.table_result(columns, type_oids, rows, layout), encoding)
+    return Response(body, media_type=serializers.MIMETYPES[encoding])
+
+def send_cached(request, entry, cache_status):
+    """Sends a cached response, or 304 Not Modified if the client already has it (like server.send_cached)"""
+    if request.method in ('GET', 'HEAD') and parse_etags(request.headers.get('if-none-match')).contains(entry.etag):
+        response = Response(status_code=304)
+    else:
+        response = Response(entry.body, media_type=entry.mimetype)
+    response.headers['ETag'] = quote_etag(entry.etag)
+    # Browsers keep the response but check the ETag with the server before using it again
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept'
+    response.headers['X-Cache'] = cache_status
+    return response
+
+def observed(route):
+    """Counts an endpoint's requests in the Flask app's metrics under its Flask route (see server.add_query_stats)
+
+    Sends the X-Query-Count and X-DB-Time-Ms headers too when QUERY_STATS=1 (streamed bodies are not included).
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            if not server.COUNT_QUERIES:
+                return await endpoint(request)
+            query_stats.start(route)
+            try:
+                response = await endpoint(request)
+            finally:
+                stats = query_stats.finish()
+            if server.QUERY_STATS_ENABLED:
+                response.headers['X-Query-Count'] = str(stats.queries)
+                response.headers['X-DB-Time-Ms'] = f'{stats.db_seconds * 1000:.3f}'
+            if server.METRICS_ENABLED:
+                server.request_metrics.observe(
+                    stats.route,
+                    request.method,
+                    response.status_code,
+                    time.perf_counter() - stats.started,
+                    stats,
+                    None if isinstance(response, StreamingResponse) else len(response.body)
+                )
+            return response
+        return wrapper
+    return decorator
+
+def cached_response(name, tables):
+    """Caches an endpoint's responses in the Flask app's response cache (see server.cached_response)
+
+    The writes are passed through to the Flask app in this process, so they drop the cached responses the same way.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            # Streams are sent while they are read, so they are never cached
+            if not server.RESPONSE_CACHE_ENABLED or request.query_params.get('stream') == '1':
+                return await endpoint(request)
+
+            key = (
+                request.method, request.url.path, tuple(sorted(request.query_params.multi_items())),
+                request.headers.get('accept'), await request.body()
+            )
+            entry = server.api_cache.get(key)
+            if entry is not None:
+                return send_cached(request, entry, 'HIT')
+
+            # The versions are read first, so a write that commits while the response is built keeps it out of the cache
+            read_tables = tables(**request.path_params) if callable(tables) else tables
+            snapshot = server.api_cache.snapshot(read_tables)
+            response = await endpoint(request)
+            if response.status_code != 200 or isinstance(response, StreamingResponse):
+                return response
+            # A replica may not have the last write yet, so what it read is not kept for everyone else
+            used_replica = getattr(request.state, 'used_replica', False)
+            if used_replica and time.time() - server.replica_set.last_write < server.DB_REPLICA_MAX_LAG:
+                return response
+            entry = server.api_cache.put(
+                key, response.body, response.media_type, read_tables, server.RESPONSE_CACHE_TTLS[name], snapshot
+            )
+            return send_cached(request, entry, 'MISS')
+        return wrapper
+    return decorator
+
+def get_response_format(request):
+    """Gets (layout, encoding) from ?layout=rows|columnar, ?encoding=json|msgpack|arrow, or the Accept header"""
+    return serializers.negotiate(
+        request.query_params.get('layout'), request.query_params.get('encoding'), request.headers.get('accept')
+    )
+
+def describe(statement):
+    """Gets the column names and type OIDs of a prepared statement"""
+    attributes = statement.get_attributes()
+    return [attribute.name for attribute in attributes], [attribute.type.oid for attribute in attributes]
+
+def to_asyncpg(query, params=()):
+    """Converts a psycopg2 query and its parameters to asyncpg's numbered ($1, $2, ...) parameters"""
+    args = []
+    named = {}
+    positional = iter(params) if not isinstance(params, dict) else None
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            args.append(next(positional))
+            return f'${len(args)}'
+        # A name used more than once is sent once
+        if name not in named:
+            args.append(params[name])
+            named[name] = len(args)
+        return f'${named[name]}'
+
+    return PLACEHOLDER.sub(replace, query), args
+
+def get_connect_kwargs():
+    """Builds the asyncpg connection settings from the environment variables"""
+    # Makes sure that all the required environment variables are set
+    required_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
+    missing = [var for var in required_vars if not os.getenv(var)]
+
+    if missing:
+        raise ValueError(f'Required Environment variables missing!')
+
+    db_port = int(os.getenv('DB_PORT', 5432))
+    return {
+        'host': os.getenv('DB_HOST'),
+        'port': db_port,
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        # Same values as libpq's sslmode (run.py sets DB_SSLMODE=disable for a local Postgres)
+        'ssl': os.getenv('DB_SSLMODE', 'require'),
+        'statement_cache_size': 0 if db_port == PGBOUNCER_PORT else 100
+    }
+
+def get_replica_connect_kwargs(dsn):
+    """Builds the asyncpg connection settings of a replica from its libpq connection string (key=value or URI)"""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    db_port = int(params.get('port', 5432))
+    return {
+        'host': params.get('host'),
+        'port': db_port,
+        'database': params.get('dbname'),
+        'user': params.get('user'),
+        'password': params.get('password'),
+        'ssl': params.get('sslmode', os.getenv('DB_SSLMODE', 'require')),
+        'statement_cache_size': 0 if db_port == PGBOUNCER_PORT else 100
+    }
+
+class ReadPool:
+    """The pool a read request uses: a healthy replica's, unless the client just wrote (like server.get_db_connection)
+
+    The replica is picked at the first acquire() and then kept for the rest of the request.
+    """
+
+    # Errors that mean a replica cannot give a connection (it is skipped until the next check finds it healthy)
+    REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+    def __init__(self, request):
+        self.request = request
+        self.pool = None
+        self.choosing = asyncio.Lock()
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        started = time.perf_counter()
+        try:
+            pool, conn = await self.get_connection(timeout)
+        finally:
+            query_stats.record_pool_wait(time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    async def get_connection(self, timeout):
+        """Gets a connection and the pool it came from"""
+        if self.pool is None:
+            async with self.choosing:
+                if self.pool is None:
+                    return await self.choose(timeout)
+        return self.pool, await self.pool.acquire(timeout=timeout)
+
+    async def choose(self, timeout):
+        state = self.request.app.state
+        replica_set = server.replica_set
+        if replica_set and not server.wrote_recently(self.request.cookies):
+            for replica in replica_set.candidates():
+                if not replica.healthy:
+                    continue
+                pool = state.replica_pools[replica.name]
+                try:
+                    conn = await pool.acquire(timeout=timeout)
+                except self.REPLICA_ERRORS as e:
+                    replica_set.mark_failed(replica, e)
+                    continue
+                replica_set.record_read(replica)
+                self.request.state.used_replica = True
+                self.pool = pool
+                return pool, conn
+            replica_set.record_fallback()
+        self.pool = state.pool
+        return self.pool, await self.pool.acquire(timeout=timeout)
+
+async def count_query(awaitable, query, params=None):
+    """Awaits a query and counts it in the request's stats and the slow query log (like query_stats.CountingCursor)
+
+    query and params are the psycopg2 ones, so the slow query log can explain the query again.
+    """
+    started = time.perf_counter()
+    result = None
+    try:
+        result = await awaitable
+        return result
+    finally:
+        seconds = time.perf_counter() - started
+        query_stats.record(seconds, len(result) if isinstance(result, list) else 1)
+        query_stats.check_slow(query, params, seconds)
+
+async def fetch(pool, query, params=()):
+    """Runs a query on a connection from the pool and gets all the rows"""
+    asyncpg_query, args = to_asyncpg(query, params)
+    async with pool.acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+        return await count_query(conn.fetch(asyncpg_query, *args), query, params)
+
+async def fetch_value(pool, query, params=()):
+    """Runs a query on a connection from the pool and gets the first value"""
+    asyncpg_query, args = to_asyncpg(query, params)
+    async with pool.acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+        return await count_query(conn.fetchval(asyncpg_query, *args), query, params)
+
+async def fetch_table(pool, table, limit=1000):
+    """Gets the first rows of a table with its column names and type OIDs"""
+    async with pool.acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+        # Get data from the table - SQL Query
+        query = f"SELECT * FROM {schema.quote_ident(table)} ORDER BY 1 LIMIT {int(limit)};"
+        statement = await conn.prepare(query)
+        columns, type_oids = describe(statement)
+        return columns, type_oids, await count_query(statement.fetch(), query)
+
+async def has_catalog(pool):
+    """Checks (and caches) whether the catalog migration is applied, like catalog.has_catalog"""
+    if catalog.catalog_check_due():
+        catalog.store_catalog(await fetch_value(pool, catalog.CATALOG_CHECK_QUERY))
+    return catalog.catalog_state['available']
+
+async def get_track_total(pool):
+    """Gets the number of tracks from the cache, the planner estimate, or an exact count (in that order)"""
+    total_count = server.cached_track_total()
+    if total_count is not None:
+        return total_count
+
+    async with pool.acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+        # Large tables use the planner's row estimate instead of scanning the whole table
+        estimate = await count_query(conn.fetchval(server.TRACK_ESTIMATE_QUERY), server.TRACK_ESTIMATE_QUERY)
+        if estimate is not None and estimate >= server.TRACK_COUNT_ESTIMATE_MIN:
+            return server.store_track_total(estimate)
+
+        # Small (or never analyzed) tables are cheap enough to count exactly
+        total_count = await count_query(conn.fetchval(server.TRACK_COUNT_QUERY), server.TRACK_COUNT_QUERY)
+        return server.store_track_total(total_count)
+
+async def stream_table_rows(pool, tables, stream_format, include_table=False):
+    """Streams every row of the tables through a server-side cursor"""
+    try:
+        async with pool.acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+            # Cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                for table in tables:
+                    statement = await conn.prepare(f"SELECT * FROM {schema.quote_ident(table)} ORDER BY 1;")
+                    columns, type_oids = describe(statement)
+                    header = server.format_stream_header(columns, stream_format)
+                    if header:
+                        yield header
+
+                    rows = []
+                    chunk_size = server.STREAM_FIRST_CHUNK_SIZE
+                    async for row in statement.cursor(prefetch=server.STREAM_CHUNK_SIZE):
+                        rows.append(row)
+                        if len(rows) >= chunk_size:
+                            yield server.format_stream_rows(rows, columns, type_oids, stream_format, table if include_table else None)
+                            rows = []
+                            chunk_size = server.STREAM_CHUNK_SIZE
+                    if rows:
+                        yield server.format_stream_rows(rows, columns, type_oids, stream_format, table if include_table else None)
+    except Exception as e:
+        # The status code has already been sent, so the error can only be logged
+        print(f'Error streaming rows: {e}')
+
+def get_stream_format(request):
+    """Gets the streaming format from ?format=ndjson|csv&stream=1 (None if the request is not streaming)"""
+    if request.query_params.get('stream') != '1':
+        return None
+    return request.query_params.get('format', 'ndjson')
+
+def get_int_arg(request, name, default):
+    """Gets an integer query parameter (the default if it is missing or not a number, like Flask's type=int)"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+async def get_json(request):
+    """Gets the JSON body of the request (None if there is no valid JSON)"""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+@observed('/api/health')
+async def health_check(request):
+    """Makes sure that the server is running"""
+    return JSONResponse({'status': 'ok', 'message': 'Server is running'})
+
+@observed('/api/tables')
+@cached_response('tables', tables=[])
+async def get_tables(request):
+    """Makes sure that one can get all table names from the database"""
+    try:
+        # Get all table names from the schema cache (it might have to be reloaded, which blocks)
+        tables = await run_in_threadpool(server.schema_registry.table_names)
+        return JSONResponse(tables)
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching tables!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/tracks/joined')
+@cached_response('tracks_joined', tables=['Track', 'Album', 'Artist', 'ArtistTrack', 'ArtistAlbum'])
+async def get_tracks_joined(request):
+    """Get tracks with their associated artists and albums"""
+    try:
+        # Get limit and offset (or the cursor from the last page) from query parameters
+        limit = get_int_arg(request, 'limit', 15)
+        offset = get_int_arg(request, 'offset', 0)
+        if limit < 1 or offset < 0:
+            return JSONResponse({'error': 'limit must be positive and offset must not be negative'}, 400)
+        after = request.query_params.get('after')
+
+        after_track_id = None
+        if after:
+            try:
+                after_track_id = server.decode_cursor(after)
+            except ValueError:
+                return JSONResponse({'error': 'Invalid cursor'}, 400)
+
+        pool = ReadPool(request)
+
+        # One index scan of the track catalog when it exists (otherwise the base tables are joined)
+        use_catalog = server.TRACK_CATALOG_ENABLED and await has_catalog(pool)
+        if use_catalog:
+            after_query, page_query = catalog.CATALOG_TRACKS_AFTER_QUERY, catalog.CATALOG_TRACKS_QUERY
+        else:
+            after_query, page_query = server.JOINED_TRACKS_AFTER_QUERY, server.JOINED_TRACKS_QUERY
+        if after_track_id is not None:
+            page = fetch(pool, after_query, (after_track_id, limit + 1))
+        else:
+            page = fetch(pool, page_query, (limit + 1, offset))
+
+        # The total and the page do not depend on each other, so they run at the same time
+        total_count, tracks = await asyncio.gather(get_track_total(pool), page)
+        has_more = len(tracks) > limit
+        tracks = tracks[:limit]
+
+        if use_catalog:
+            results = server.format_catalog_tracks(tracks)
+        else:
+            # Get the track artists and album artists for the whole page in one query
+            artist_rows = []
+            if tracks:
+                artist_rows = await fetch(pool, server.JOINED_ARTISTS_QUERY, server.joined_artist_params(tracks))
+            results = server.merge_joined_tracks(tracks, artist_rows)
+
+        return JSONResponse({
+            'results': results,
+            'total_count': total_count,
+            'limit': limit,
+            'offset': offset,
+            'has_more': has_more,
+            'next_cursor': server.encode_cursor(tracks[-1][0]) if has_more else None
+        })
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching joined tracks!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/tables/<table_name>')
+@cached_response('table_data', tables=lambda table_name: [table_name])
+async def get_table_data(request):
+    """Get data from a specific table -- based on the table name"""
+    table_name = request.path_params['table_name']
+    try:
+        # Only tables in the schema are allowed (so there is no SQL injection)
+        table = await run_in_threadpool(server.schema_registry.get_table, table_name)
+        if not table:
+            return JSONResponse({'error': 'Table not found'}, 404)
+
+        # Streams the whole table when asked (?format=ndjson|csv&stream=1)
+        stream_format = get_stream_format(request)
+        if stream_format and stream_format not in server.STREAM_MIMETYPES:
+            return JSONResponse({'error': 'Invalid format, must be ndjson or csv'}, 400)
+
+        # Rows or one list per column, as JSON, MessagePack, or Arrow
+        try:
+            response_format = get_response_format(request)
+        except serializers.NotAcceptable as e:
+            return JSONResponse({'error': str(e)}, 406)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        if stream_format:
+            return StreamingResponse(
+                stream_table_rows(ReadPool(request), [table.name], stream_format),
+                media_type=server.STREAM_MIMETYPES[stream_format]
+            )
+
+        return table_response(*await fetch_table(ReadPool(request), table.name), response_format)
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching data from {table_name}!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/tables/<table_name>/columns')
+async def get_table_columns(request):
+    """Get column information for a specific table"""
+    table_name = request.path_params['table_name']
+    try:
+        # Get column information from the schema cache
+        table = await run_in_threadpool(server.schema_registry.get_table, table_name)
+
+        # Unknown tables have no columns
+        return JSONResponse(table.columns if table else [])
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching columns from {table_name}!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/all-data')
+@cached_response('all_data', tables=None)
+async def get_all_data(request):
+    """Get all data from all tables within the database """
+    try:
+        # Streams every table when asked (?format=ndjson&stream=1) -- CSV needs one header, so it is one table at a time
+        stream_format = get_stream_format(request)
+        if stream_format and stream_format != 'ndjson':
+            return JSONResponse({'error': 'Invalid format, all tables can only be streamed as ndjson'}, 400)
+
+        # Rows or one list per column, as JSON or MessagePack (an Arrow stream can only hold one table)
+        try:
+            layout, encoding = get_response_format(request)
+        except serializers.NotAcceptable as e:
+            return JSONResponse({'error': str(e)}, 406)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+        if encoding == 'arrow':
+            return JSONResponse({'error': 'Arrow responses are one table at a time, use /api/tables/<table_name>'}, 400)
+
+        # Stores all table names (from the schema cache)
+        tables = await run_in_threadpool(server.schema_registry.table_names)
+        pool = ReadPool(request)
+
+        if stream_format:
+            return StreamingResponse(
+                stream_table_rows(pool, tables, stream_format, include_table=True),
+                media_type=server.STREAM_MIMETYPES[stream_format]
+            )
+
+        # Each table is read on its own connection, all at the same time (the pool size caps how many)
+        results = await asyncio.gather(*(fetch_table(pool, table) for table in tables))
+        all_data = {
+            table: serializers.table_result(columns, type_oids, rows, layout)
+            for table, (columns, type_oids, rows) in zip(tables, results)
+        }
+        return Response(serializers.encode(all_data, encoding), media_type=serializers.MIMETYPES[encoding])
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error fetching all data!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/search')
+async def search_data(request):
+    """Search for records in a table based on the column value"""
+    try:
+        # Get the JSON data from the request
+        data = await get_json(request)
+        if not data:
+            return JSONResponse({'error': 'No data provided'}, 400)
+
+        # Get table, column, and search value
+        table_name = data.get('table')
+        column_name = data.get('column')
+        search_value = data.get('value')
+
+        if not all([table_name, column_name, search_value]):
+            return JSONResponse({'error': 'Missing required fields: table, column, value'}, 400)
+
+        # Only tables and columns in the schema are allowed (so there is no SQL injection)
+        table = await run_in_threadpool(server.schema_registry.get_table, table_name)
+        column = table.resolve_column(column_name) if table else None
+
+        if not table or not column:
+            return JSONResponse({'error': 'Invalid table or column name'}, 400)
+
+        # Rows or one list per column, as JSON, MessagePack, or Arrow
+        try:
+            response_format = get_response_format(request)
+        except serializers.NotAcceptable as e:
+            return JSONResponse({'error': str(e)}, 406)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        # Make sure to use parameterized query to prevent SQL injection - SQL Query
+        query = f'SELECT * FROM {schema.quote_ident(table.name)} WHERE {schema.quote_ident(column)}::text ILIKE %s ORDER BY 1;'
+        params = (f'%{search_value}%',)
+        asyncpg_query, args = to_asyncpg(query, params)
+        async with ReadPool(request).acquire(timeout=server.DB_POOL_TIMEOUT) as conn:
+            statement = await conn.prepare(asyncpg_query)
+            columns, type_oids = describe(statement)
+            rows = await count_query(statement.fetch(*args), query, params)
+
+        # Return the search results (converted to JSON values)
+        return table_response(columns, type_oids, rows, response_format)
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error searching data!')
+        return JSONResponse({'error': str(e)}, 500)
+
+@observed('/api/search/music')
+@cached_response('search_music', tables=['Track', 'Album', 'Artist', 'ArtistTrack'])
+async def search_music(request):
+    """Search for music across tracks, artists, and albums using a query"""
+    try:
+        # Get the JSON data from the request
+        data = await get_json(request)
+        if not data:
+            return JSONResponse({'error': 'No data provided'}, 400)
+
+        # Get the search query
+        search_query = data.get('query')
+        if not search_query:
+            return JSONResponse({'error': 'Missing search query'}, 400)
+
+        # Get the max number of results
+        try:
+            limit = search.parse_limit(data.get('limit', request.query_params.get('limit')))
+        except (TypeError, ValueError):
+            return JSONResponse({'error': 'Invalid limit'}, 400)
+
+        pool = ReadPool(request)
+        music_index = server.music_index
+
+        # Answer from the in-memory index when it is built (the database is only used to get the matched rows)
+        use_index = server.SEARCH_INDEX_ENABLED and music_index.ready
+        if server.SEARCH_INDEX_ENABLED and not music_index.ready and not music_index.building:
+            music_index.start_build(server.get_db_connection, server.release_db_connection)
+
+        # The matched rows come from the track catalog when it exists (otherwise the base tables are joined)
+        use_catalog = server.TRACK_CATALOG_ENABLED and await has_catalog(pool)
+
+        if use_index:
+            ranked = music_index.search(search_query, limit)
+            if not ranked:
+                return JSONResponse([])
+            hydrate_query = search.CATALOG_HYDRATE_QUERY if use_catalog else search.HYDRATE_QUERY
+            rows = await fetch(pool, hydrate_query, ([track_id for track_id, _ in ranked],))
+            tracks = search.order_hydrated(rows, ranked)
+        else:
+            if search.trigram_check_due():
+                search.store_trigram_support(await fetch_value(pool, search.TRGM_CHECK_QUERY))
+            # Search across tracks, artists, and albums (ranked by relevance, artists are fetched in the same query)
+            queries = search.CATALOG_SEARCH_QUERIES if use_catalog else search.SEARCH_QUERIES
+            query = queries[search.trgm_state['available']]
+            tracks = await fetch(pool, query, search.search_params(search_query, limit))
+
+        return JSONResponse(server.format_music_results(tracks))
+
+    except Exception as e:
+        # If there is an error, print it and return Error 500
+        print(f'Error searching music!')
+        return JSONResponse({'error': str(e)}, 500)
+
+async def init_connection(conn):
+    """Decodes jsonb like psycopg2 does (the catalog's artists column is sent as it is stored)"""
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+@asynccontextmanager
+async def lifespan(app):
+    """Opens the asyncpg pools (and starts the Flask app's background tasks) for the life of the server"""
+    app.state.pool = await asyncpg.create_pool(
+        min_size=server.DB_POOL_MIN,
+        max_size=server.DB_POOL_MAX,
+        max_inactive_connection_lifetime=server.DB_POOL_RECYCLE,
+        init=init_connection,
+        **get_connect_kwargs()
+    )
+    # One pool per replica, opened on first use (the Flask app's replica set decides which replicas are healthy)
+    app.state.replica_pools = {}
+    for replica in server.replica_set.replicas:
+        app.state.replica_pools[replica.name] = await asyncpg.create_pool(
+            min_size=0,
+            max_size=server.DB_POOL_MAX,
+            max_inactive_connection_lifetime=server.DB_POOL_RECYCLE,
+            init=init_connection,
+            **get_replica_connect_kwargs(replica.dsn)
+        )
+    # Warms up the psycopg2 pool used by the write endpoints, and builds the search index if enabled
+    await run_in_threadpool(server.start_background_tasks)
+    try:
+        yield
+    finally:
+        for pool in [app.state.pool, *app.state.replica_pools.values()]:
+            await pool.close()
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/tables', get_tables, methods=['GET']),
+        Route('/api/tables/{table_name}', get_table_data, methods=['GET']),
+        Route('/api/tables/{table_name}/columns', get_table_columns, methods=['GET']),
+        Route('/api/all-data', get_all_data, methods=['GET']),
+        Route('/api/tracks/joined', get_tracks_joined, methods=['GET']),
+        Route('/api/search', search_data, methods=['POST']),
+        Route('/api/search/music', search_music, methods=['POST']),
+        # Every other endpoint is still served by the Flask app (in a thread)
+        Mount('/', app=WSGIMiddleware(server.app))
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
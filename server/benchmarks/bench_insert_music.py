@@ -0,0 +1,89 @@
+"""Compares /api/insert/music (one song per request) with /api/insert/music/batch.
+
+Runs against the database in .env and removes everything it inserted when it is done.
+
+    cd server
+    python benchmarks/bench_insert_music.py --songs 500 --batch-size 500
+"""
+import argparse
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as server  # noqa: E402
+
+def make_songs(prefix, count):
+    """Makes songs spread over a few artists and albums (about 10 songs per album)"""
+    songs = []
+    for i in range(count):
+        artist = i % 10
+        songs.append({
+            'song_name': f'{prefix} song {i}',
+            'artist_name': f'{prefix} artist {artist}',
+            'album_name': f'{prefix} album {i // 10}',
+            'album_release_date': '2024-01-01',
+            'track_length': '00:03:00',
+            'nation_name': f'{prefix} nation {artist % 3}',
+            'genre_name': f'{prefix} genre {artist % 4}',
+        })
+    return songs
+
+def cleanup(prefix):
+    """Deletes every row the benchmark made (artists first, so the cascades remove the links)"""
+    conn = server.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        pattern = f'{prefix}%'
+        cursor.execute("DELETE FROM Artist WHERE name LIKE %s;", (pattern,))
+        cursor.execute("DELETE FROM Album WHERE name LIKE %s;", (pattern,))
+        cursor.execute("DELETE FROM Genre WHERE name LIKE %s;", (pattern,))
+        cursor.execute("DELETE FROM Nation WHERE name LIKE %s;", (pattern,))
+        conn.commit()
+    finally:
+        server.release_db_connection(conn)
+
+def run_single(client, songs):
+    started = time.perf_counter()
+    for song in songs:
+        response = client.post('/api/insert/music', json=song)
+        if response.status_code != 200:
+            raise RuntimeError(f'Single insert failed: {response.get_json()}')
+    return time.perf_counter() - started
+
+def run_batch(client, songs, batch_size):
+    started = time.perf_counter()
+    for start in range(0, len(songs), batch_size):
+        response = client.post('/api/insert/music/batch', json={'songs': songs[start:start + batch_size]})
+        if response.status_code != 200 or not response.get_json()['success']:
+            raise RuntimeError(f'Batch insert failed: {response.get_json()}')
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    tag = uuid.uuid4().hex[:8]
+    client = server.app.test_client()
+    results = {}
+    for mode in ('single', 'batch'):
+        prefix = f'bench-{mode}-{tag}'
+        songs = make_songs(prefix, args.songs)
+        try:
+            if mode == 'single':
+                results[mode] = run_single(client, songs)
+            else:
+                results[mode] = run_batch(client, songs, args.batch_size)
+        finally:
+            cleanup(prefix)
+
+    for mode, elapsed in results.items():
+        print(f'{mode:>6}: {args.songs} songs in {elapsed:.3f}s ({args.songs / elapsed:.1f} songs/s)')
+    print(f'speedup: {results["single"] / results["batch"]:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Compares the old per-cell serialize_value + jsonify path with the serializers fast path (rows/s),
+and the payload size and client decode time of each layout and encoding.
+
+Does not need a database: it builds rows shaped like Track and Album pages in memory.
+
+    cd server
+    python benchmarks/bench_serialize.py --rows 1000 --repeat 50
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as server  # noqa: E402
+import serializers  # noqa: E402
+
+# (name, type OID) like psycopg2's cursor.description
+TRACK_COLUMNS = [('track_id', serializers.INT4_OID), ('name', serializers.VARCHAR_OID),
+                 ('length', serializers.INTERVAL_OID), ('album_id', serializers.INT4_OID)]
+ALBUM_COLUMNS = [('album_id', serializers.INT4_OID), ('name', serializers.VARCHAR_OID),
+                 ('release_date', serializers.DATE_OID), ('description', serializers.TEXT_OID)]
+
+def make_rows(kind, count):
+    if kind == 'track':
+        return [(i, f'Track {i}', timedelta(seconds=120 + i % 300), i // 10) for i in range(count)]
+    return [(i, f'Album {i}', date(2000 + i % 25, 1 + i % 12, 1 + i % 28), None if i % 3 else f'About album {i}')
+            for i in range(count)]
+
+def old_path(columns, rows):
+    """The code the endpoints used before: a loop over every cell, then jsonify"""
+    names = [name for name, _ in columns]
+    data = []
+    for row in rows:
+        row_dict = {}
+        for col, val in zip(names, row):
+            row_dict[col] = server.serialize_value(val)
+        data.append(row_dict)
+    return server.jsonify({'columns': names, 'rows': data, 'count': len(data)}).get_data()
+
+def new_path(columns, rows):
+    names = [name for name, _ in columns]
+    data = serializers.rows_to_dicts(names, [oid for _, oid in columns], rows)
+    return server.json_response({'columns': names, 'rows': data, 'count': len(data)}).get_data()
+
+def measure(fn, columns, rows, repeat):
+    """Gets the best rows/s over the repeats"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(columns, rows)
+        best = min(best, time.perf_counter() - started)
+    return len(rows) / best
+
+def decode_time(decode, body, repeat):
+    """Gets the best time to decode a response body"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode(body)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def compare_layouts(columns, rows, repeat):
+    """Prints the size and decode time of every layout and encoding that is installed"""
+    names = [name for name, _ in columns]
+    type_oids = [oid for _, oid in columns]
+    payloads = [
+        ('rows, json', serializers.encode(serializers.table_result(names, type_oids, rows, 'rows')), json.loads),
+        ('columnar, json', serializers.encode(serializers.table_result(names, type_oids, rows, 'columnar')), json.loads),
+    ]
+    if serializers.msgpack is not None:
+        body = serializers.encode(serializers.table_result(names, type_oids, rows, 'columnar'), 'msgpack')
+        payloads.append(('columnar, msgpack', body, serializers.msgpack.unpackb))
+    if serializers.pyarrow is not None:
+        body = serializers.encode_arrow(names, type_oids, rows)
+        payloads.append(('columnar, arrow', body, lambda data: serializers.pyarrow.ipc.open_stream(data).read_all()))
+
+    baseline_size = len(payloads[0][1])
+    baseline_time = decode_time(payloads[0][2], payloads[0][1], repeat)
+    for label, body, decode in payloads:
+        elapsed = decode_time(decode, body, repeat)
+        print(f'    {label:<36} {len(body):>10,} bytes {len(body) / baseline_size:5.2f}x  '
+              f'decode {elapsed * 1000:7.3f} ms {elapsed / baseline_time:5.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with server.app.app_context():
+        for kind, columns in (('track', TRACK_COLUMNS), ('album', ALBUM_COLUMNS)):
+            rows = make_rows(kind, args.rows)
+            # Both paths have to produce the same values
+            assert json.loads(old_path(columns, rows)) == json.loads(new_path(columns, rows))
+
+            before = measure(old_path, columns, rows, args.repeat)
+            results = [('before (serialize_value + jsonify)', before)]
+            backends = [False, True] if serializers.orjson is not None else [False]
+            for use_orjson in backends:
+                serializers.USE_ORJSON = use_orjson
+                after = measure(new_path, columns, rows, args.repeat)
+                results.append((f"after ({'orjson' if use_orjson else 'json'})", after))
+
+            print(f'{kind} rows ({args.rows} per page):')
+            for label, rate in results:
+                print(f'    {label:<36} {rate:>12,.0f} rows/s  {rate / before:5.2f}x')
+            compare_layouts(columns, rows, args.repeat)
+
+if __name__ == '__main__':
+    main()
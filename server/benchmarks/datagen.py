@@ -0,0 +1,359 @@
+"""Seeded synthetic music catalog, loaded with COPY from parallel workers (for benchmarks and tests).
+
+    cd server
+    python benchmarks/datagen.py --dsn "host=localhost dbname=musedb user=postgres" --tracks 10000000 --workers 8
+
+The same --seed and --tracks always make the same catalog, whatever the number of workers. The counts are skewed
+like a real catalog: a few nations have most of the artists, most artists have one or two albums while a few have
+dozens, most albums are short, a few genres are on most artists, a few words are in most names (so the same names
+come up many times, like "Greatest Hits" does), and some tracks and albums are collaborations between artists.
+
+The catalog is added after the rows that are already there (the ids start after the current largest ones), so it
+can be loaded on top of sample_data.txt. The tables are loaded in foreign key order:
+    1. Nation and Genre (the names that are missing)
+    2. Artist and Album
+    3. Track, ArtistGenre, and ArtistAlbum
+    4. ArtistTrack
+Every step is split into chunks of CHUNK_TRACKS tracks that the workers load at the same time.
+"""
+import argparse
+import bisect
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+# Tracks per chunk (a chunk is the unit of work of one worker, and is made the same way whoever makes it)
+CHUNK_TRACKS = 50000
+
+NATIONS = [
+    'United States', 'United Kingdom', 'Canada', 'Germany', 'France', 'Japan', 'South Korea', 'Sweden',
+    'Australia', 'Brazil', 'Iceland', 'Norway', 'Netherlands', 'Italy', 'Spain', 'Mexico', 'Ireland', 'Jamaica',
+    'Nigeria', 'South Africa', 'India', 'China', 'Argentina', 'Colombia', 'Finland', 'Denmark', 'Belgium',
+    'Poland', 'Portugal', 'New Zealand', 'Cuba', 'Ghana', 'Chile', 'Austria', 'Switzerland', 'Greece',
+    'Turkey', 'Egypt', 'Philippines', 'Indonesia'
+]
+
+GENRES = [
+    'Pop', 'Rock', 'Hip Hop', 'Electronic', 'Indie', 'R&B', 'Jazz', 'Country', 'Folk', 'Classical', 'Metal',
+    'Soul', 'Reggae', 'Blues', 'Punk', 'Latin', 'K-Pop', 'House', 'Techno', 'Ambient', 'Funk', 'Disco',
+    'Gospel', 'Alternative', 'Dance', 'Trance', 'Afrobeat', 'Bossa Nova', 'Grunge', 'Ska', 'Synthwave',
+    'Lo-Fi', 'Drum and Bass', 'Dubstep', 'Shoegaze', 'Emo', 'Bluegrass', 'Flamenco', 'Opera', 'Soundtrack'
+]
+
+ARTIST_TYPES = ['Solo Artist', 'Band', 'Duo', 'DJ', 'Orchestra']
+ARTIST_TYPE_WEIGHTS = [55, 30, 8, 5, 2]
+
+# Words for the names, most common first
+WORDS = [
+    'Love', 'Night', 'Heart', 'Dream', 'Light', 'Fire', 'Time', 'Blue', 'Home', 'Summer', 'Rain', 'Star',
+    'Gold', 'Moon', 'River', 'Golden', 'Wild', 'Dark', 'Midnight', 'Sweet', 'Electric', 'Silver', 'Ocean',
+    'Shadow', 'City', 'Echo', 'Velvet', 'Paper', 'Glass', 'Winter', 'Ghost', 'Honey', 'Neon', 'Stone',
+    'Crystal', 'Thunder', 'Morning', 'Lonely', 'Broken', 'Secret', 'Highway', 'Garden', 'Cherry', 'Violet',
+    'Harbor', 'Static', 'Autumn', 'Paradise', 'Desert', 'Northern', 'Lucky', 'Hollow', 'Crimson', 'Wave',
+    'Sunset', 'Satellite', 'Mirror', 'Diamond', 'Storm', 'Angel', 'Forest', 'Island', 'Rose', 'Cloud',
+    'Silent', 'Shine', 'Fever', 'Magic', 'Coast', 'Radio', 'Tiger', 'Ember', 'Frost', 'Horizon', 'Canyon',
+    'Marble', 'Saint', 'Orbit', 'Cobalt', 'Lantern', 'Meadow', 'Pilot', 'Comet', 'Atlas', 'Prism', 'Mosaic',
+    'Aurora', 'Solstice', 'Nomad', 'Raven', 'Willow', 'Sparrow', 'Tundra', 'Lagoon', 'Saffron', 'Juniper',
+    'Quartz', 'Zephyr', 'Obsidian', 'Monsoon'
+]
+
+class Zipf:
+    """Draws 1..n with a probability proportional to 1 / k**s (so 1 is the most common)"""
+
+    def __init__(self, n, s):
+        self.cum_weights = list(itertools.accumulate(1 / k ** s for k in range(1, n + 1)))
+        self.total = self.cum_weights[-1]
+        self.last = n - 1
+
+    def draw(self, rng):
+        return min(bisect.bisect(self.cum_weights, rng.random() * self.total), self.last) + 1
+
+ALBUMS_PER_ARTIST = Zipf(40, 1.3)
+TRACKS_PER_ALBUM = Zipf(30, 0.7)
+NATION_RANK = Zipf(len(NATIONS), 1.1)
+GENRE_RANK = Zipf(len(GENRES), 1.0)
+GENRES_PER_ARTIST = Zipf(5, 1.5)
+WORD_RANK = Zipf(len(WORDS), 1.0)
+FEATURED_ARTISTS = Zipf(3, 1.5)
+
+# Share of the tracks with featured artists, and of the albums with a second album artist
+FEATURE_RATE = 0.08
+COLLABORATION_ALBUM_RATE = 0.03
+
+def chunk_shape(seed, chunk, track_budget):
+    """Gets the number of tracks of every album of every artist in a chunk ([[tracks per album] per artist])"""
+    rng = random.Random(f'{seed}-shape-{chunk}')
+    artists = []
+    remaining = track_budget
+    while remaining > 0:
+        albums = []
+        for _ in range(ALBUMS_PER_ARTIST.draw(rng)):
+            tracks = min(TRACKS_PER_ALBUM.draw(rng), remaining)
+            albums.append(tracks)
+            remaining -= tracks
+            if not remaining:
+                break
+        artists.append(albums)
+    return artists
+
+class Chunk:
+    """A chunk of the catalog and the first id of each of its tables"""
+
+    def __init__(self, seed, index, track_budget, first_artist_id, first_album_id, first_track_id):
+        self.seed = seed
+        self.index = index
+        self.track_budget = track_budget
+        self.first_artist_id = first_artist_id
+        self.first_album_id = first_album_id
+        self.first_track_id = first_track_id
+        # Set once every chunk is planned (featured artists can come from any chunk)
+        self.artist_id_range = None
+        self.nation_ids = None
+        self.genre_ids = None
+
+def plan(seed, tracks, first_artist_id, first_album_id, first_track_id):
+    """Splits the catalog into chunks and gives each one its ids (the shapes are made here only to count them)"""
+    chunks = []
+    for index in range((tracks + CHUNK_TRACKS - 1) // CHUNK_TRACKS):
+        budget = min(CHUNK_TRACKS, tracks - index * CHUNK_TRACKS)
+        chunks.append(Chunk(seed, index, budget, first_artist_id, first_album_id, first_track_id))
+        shape = chunk_shape(seed, index, budget)
+        first_artist_id += len(shape)
+        first_album_id += sum(len(albums) for albums in shape)
+        first_track_id += budget
+    return chunks, first_artist_id
+
+def name(rng, words=2):
+    """Makes a name out of the (Zipf-ranked) words"""
+    return ' '.join(WORDS[WORD_RANK.draw(rng) - 1] for _ in range(words))
+
+def other_artists(rng, chunk, exclude, count):
+    """Picks distinct artists for a collaboration (artists with low ids are featured more often)"""
+    first, last = chunk.artist_id_range
+    picked = set()
+    for _ in range(count * 4):
+        if len(picked) == count or last - first <= 1:
+            break
+        # Squared uniform numbers lean towards the first artists
+        artist_id = first + int((last - first) * rng.random() ** 2)
+        if artist_id != exclude:
+            picked.add(artist_id)
+    return sorted(picked)
+
+def chunk_rows(chunk):
+    """Makes every row of a chunk: {table: (columns, rows)}"""
+    shape = chunk_shape(chunk.seed, chunk.index, chunk.track_budget)
+    rng = random.Random(f'{chunk.seed}-rows-{chunk.index}')
+    artists, albums, tracks = [], [], []
+    artist_genres, artist_albums, artist_tracks = [], [], []
+
+    album_id = chunk.first_album_id
+    track_id = chunk.first_track_id
+    for offset, album_tracks in enumerate(shape):
+        artist_id = chunk.first_artist_id + offset
+        artist_type = rng.choices(ARTIST_TYPES, weights=ARTIST_TYPE_WEIGHTS)[0]
+        nation_id = chunk.nation_ids[NATION_RANK.draw(rng) - 1]
+        # Names repeat like real ones do (the common words make the same names again and again)
+        artists.append((artist_id, name(rng, rng.choice((1, 2, 2, 3))), None, artist_type, nation_id))
+
+        genre_count = GENRES_PER_ARTIST.draw(rng)
+        genres = set()
+        for _ in range(genre_count * 3):
+            genres.add(chunk.genre_ids[GENRE_RANK.draw(rng) - 1])
+            if len(genres) == genre_count:
+                break
+        artist_genres.extend((artist_id, genre_id) for genre_id in sorted(genres))
+
+        first_year = rng.randint(1960, 2020)
+        for album_num, track_count in enumerate(album_tracks, start=1):
+            release_date = date(min(first_year + (album_num - 1) * rng.randint(1, 3), 2025), 1, 1) + timedelta(days=rng.randrange(365))
+            album_length = timedelta()
+            track_names = set()
+            for position in range(track_count):
+                track_name = name(rng, rng.choice((1, 2, 2, 3)))
+                # Track names do not repeat within an album (other albums can have the same ones)
+                if track_name.lower() in track_names:
+                    track_name = f'{track_name} (Part {position + 1})'
+                track_names.add(track_name.lower())
+                length = timedelta(seconds=int(rng.lognormvariate(5.3, 0.3)))
+                album_length += length
+                tracks.append((track_id, track_name, length, album_id))
+                artist_tracks.append((artist_id, track_id))
+                if rng.random() < FEATURE_RATE:
+                    for featured_id in other_artists(rng, chunk, artist_id, FEATURED_ARTISTS.draw(rng)):
+                        artist_tracks.append((featured_id, track_id))
+                track_id += 1
+
+            albums.append((album_id, name(rng, rng.choice((1, 2, 2, 3))), None, release_date, album_length, album_num))
+            artist_albums.append((artist_id, album_id))
+            if rng.random() < COLLABORATION_ALBUM_RATE:
+                for featured_id in other_artists(rng, chunk, artist_id, 1):
+                    artist_albums.append((featured_id, album_id))
+            album_id += 1
+
+    return {
+        'Artist': (['artist_id', 'name', 'description', 'type', 'nation_id'], artists),
+        'Album': (['album_id', 'name', 'description', 'release_date', 'length', 'album_num'], albums),
+        'Track': (['track_id', 'name', 'length', 'album_id'], tracks),
+        'ArtistGenre': (['artist_id', 'genre_id'], artist_genres),
+        'ArtistAlbum': (['artist_id', 'album_id'], artist_albums),
+        'ArtistTrack': (['artist_id', 'track_id'], artist_tracks)
+    }
+
+# Tables loaded by each step (every table only references tables of earlier steps)
+STEPS = [['Artist', 'Album'], ['Track', 'ArtistGenre', 'ArtistAlbum'], ['ArtistTrack']]
+
+def copy_value(value):
+    """Formats a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, timedelta):
+        return f'{int(value.total_seconds())} seconds'
+    return str(value)
+
+def copy_rows(cursor, table, columns, rows):
+    """Loads rows with COPY (the ids are given, which COPY allows even for GENERATED ALWAYS columns)"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def load_chunk(args):
+    """Loads the tables of one step of one chunk (runs in a worker process) and gets {table: rows}"""
+    dsn, chunk, tables, skip_fk_checks = args
+    rows = chunk_rows(chunk)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SET synchronous_commit = off;')
+            # The track catalog is filled once at the end (see refresh_catalog), not by its triggers on every step
+            cursor.execute("SET musedb.track_catalog = 'defer';")
+            if skip_fk_checks:
+                # Turns off the foreign key triggers (needs superuser; the generated keys are already consistent)
+                cursor.execute("SET session_replication_role = 'replica';")
+            counts = {}
+            for table in tables:
+                columns, table_rows = rows[table]
+                copy_rows(cursor, table, columns, table_rows)
+                counts[table] = len(table_rows)
+        conn.commit()
+        return counts
+    finally:
+        conn.close()
+
+def refresh_catalog(args):
+    """Fills the track catalog rows of one chunk's tracks (runs in a worker process) and gets how many"""
+    dsn, chunk = args
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SET synchronous_commit = off;')
+            cursor.execute(
+                'SELECT refresh_track_catalog(ARRAY(SELECT generate_series(%s, %s)));',
+                (chunk.first_track_id, chunk.first_track_id + chunk.track_budget - 1)
+            )
+        conn.commit()
+        return chunk.track_budget
+    finally:
+        conn.close()
+
+def has_function(cursor, signature):
+    """Whether a migration added a function (e.g. 'refresh_track_catalog(integer[])')"""
+    cursor.execute('SELECT to_regprocedure(%s) IS NOT NULL;', (signature,))
+    return cursor.fetchone()[0]
+
+def ensure_named(cursor, table, id_column, names):
+    """Gets the id of every name (in order), inserting the ones that are missing"""
+    cursor.execute(f'SELECT lower(name), MIN({id_column}) FROM {table} GROUP BY lower(name);')
+    ids = dict(cursor.fetchall())
+    for row_name in names:
+        if row_name.lower() not in ids:
+            cursor.execute(f'INSERT INTO {table} (name) VALUES (%s) RETURNING {id_column};', (row_name,))
+            ids[row_name.lower()] = cursor.fetchone()[0]
+    return [ids[row_name.lower()] for row_name in names]
+
+def next_id(cursor, table, id_column):
+    cursor.execute(f'SELECT COALESCE(MAX({id_column}), 0) + 1 FROM {table};')
+    return cursor.fetchone()[0]
+
+def generate(dsn, tracks, seed=1, workers=None, skip_fk_checks=False, log=print):
+    """Adds a synthetic catalog of the given number of tracks and gets {table: rows added}"""
+    workers = workers or os.cpu_count() or 1
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            nation_ids = ensure_named(cursor, 'Nation', 'nation_id', NATIONS)
+            genre_ids = ensure_named(cursor, 'Genre', 'genre_id', GENRES)
+            first_ids = [next_id(cursor, table, id_column)
+                         for table, id_column in (('Artist', 'artist_id'), ('Album', 'album_id'), ('Track', 'track_id'))]
+            catalog = has_function(cursor, 'refresh_track_catalog(integer[])')
+            # Without the foreign key checks no trigger runs, so the album stats are recomputed at the end
+            album_stats = skip_fk_checks and has_function(cursor, 'refresh_album_stats(integer[])')
+        conn.commit()
+
+        chunks, end_artist_id = plan(seed, tracks, *first_ids)
+        for chunk in chunks:
+            chunk.artist_id_range = (first_ids[0], end_artist_id)
+            chunk.nation_ids = nation_ids
+            chunk.genre_ids = genre_ids
+
+        added = {table: 0 for tables in STEPS for table in tables}
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(min(workers, max(1, len(chunks)))) as pool:
+            for tables in STEPS:
+                started = time.perf_counter()
+                jobs = [(dsn, chunk, tables, skip_fk_checks) for chunk in chunks]
+                for counts in pool.imap_unordered(load_chunk, jobs):
+                    for table, count in counts.items():
+                        added[table] += count
+                loaded = ', '.join(f'{added[table]:,} {table}' for table in tables)
+                log(f'Loaded {loaded} in {time.perf_counter() - started:.1f}s')
+            if catalog:
+                started = time.perf_counter()
+                refreshed = sum(pool.imap_unordered(refresh_catalog, [(dsn, chunk) for chunk in chunks]))
+                log(f'Filled {refreshed:,} track catalog rows in {time.perf_counter() - started:.1f}s')
+
+        # The identity columns continue after the generated ids, then the planner gets the new statistics
+        with conn.cursor() as cursor:
+            if album_stats:
+                cursor.execute(
+                    'SELECT refresh_album_stats(ARRAY(SELECT album_id FROM Album WHERE album_id >= %s));', (first_ids[1],)
+                )
+            for table, id_column in (('Nation', 'nation_id'), ('Genre', 'genre_id'), ('Artist', 'artist_id'),
+                                     ('Album', 'album_id'), ('Track', 'track_id')):
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), (SELECT COALESCE(MAX({id_column}), 1) FROM {table}));",
+                    (table.lower(), id_column)
+                )
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('ANALYZE;')
+    finally:
+        conn.close()
+    return added
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True, help='Database to add the catalog to (the schema must exist)')
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--skip-fk-checks', action='store_true',
+                        help='Turn off the foreign key checks while loading (superuser only, faster)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    generate(args.dsn, args.tracks, args.seed, args.workers, args.skip_fk_checks)
+    print(f'Added {args.tracks:,} tracks in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
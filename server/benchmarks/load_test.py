@@ -0,0 +1,161 @@
+"""Load test for the read endpoints: many concurrent clients, reports throughput and latency percentiles.
+
+Start both servers against the same database (a local Postgres gives the fairest numbers), then compare them:
+
+    cd server
+    pip install -r requirements-async.txt
+    python app.py                               # Flask on :3001
+    uvicorn asgi:app --port 3002                # ASGI on :3002
+    python benchmarks/load_test.py --url http://localhost:3001 --compare http://localhost:3002 --clients 200
+
+Or let it start both servers on a throwaway benchmark database (the same setup as run.py, see --dsn and --pg-bin):
+
+    python benchmarks/load_test.py --local --tracks 100000 --clients 200
+"""
+import argparse
+import asyncio
+import itertools
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+import run
+
+# (method, path, JSON body) -- a mix of the endpoints the pages call
+REQUESTS = [
+    ('GET', '/api/tracks/joined?limit=15', None),
+    ('GET', '/api/tracks/joined?limit=15&offset=300', None),
+    ('POST', '/api/search/music', {'query': 'love'}),
+    ('POST', '/api/search/music', {'query': 'the'}),
+    ('GET', '/api/tables/Track', None),
+    ('GET', '/api/tables', None),
+    ('GET', '/api/health', None),
+]
+
+def percentile(sorted_values, pct):
+    """Gets a percentile of an already sorted list (nearest rank)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def client(http, base_url, requests, deadline, latencies, errors):
+    """Sends requests one after another until the deadline"""
+    while time.monotonic() < deadline:
+        method, path, body = next(requests)
+        started = time.perf_counter()
+        try:
+            response = await http.request(method, base_url + path, json=body)
+            await response.aread()
+            if response.status_code >= 400:
+                errors.append(f'{response.status_code} {path}')
+                continue
+        except httpx.HTTPError as e:
+            errors.append(f'{type(e).__name__} {path}')
+            continue
+        latencies.append(time.perf_counter() - started)
+
+async def run_load(base_url, clients, duration, warmup):
+    """Runs the load test against one server and gets its numbers"""
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as http:
+        # Warms up the server's pools and caches before measuring
+        requests = itertools.cycle(REQUESTS)
+        await asyncio.gather(*(
+            client(http, base_url, requests, time.monotonic() + warmup, [], []) for _ in range(min(clients, 10))
+        ))
+
+        latencies, errors = [], []
+        started = time.monotonic()
+        await asyncio.gather(*(
+            client(http, base_url, requests, started + duration, latencies, errors) for _ in range(clients)
+        ))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'url': base_url,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'error_samples': sorted(set(errors))[:5],
+    }
+
+def print_result(result):
+    print(f"{result['url']}: {result['rps']:.1f} req/s, "
+          f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+          f"{result['requests']} ok, {result['errors']} errors")
+    for sample in result['error_samples']:
+        print(f'    {sample}')
+
+def run_and_print(url, args):
+    result = asyncio.run(run_load(url.rstrip('/'), args.clients, args.duration, args.warmup))
+    print_result(result)
+    return result
+
+def run_local(args):
+    """Runs the test against the Flask and the ASGI server, one after the other, on a new benchmark database"""
+    postgres = None
+    log_dir = Path(tempfile.mkdtemp(prefix='musedb-load-logs-'))
+    results = []
+    try:
+        if args.dsn:
+            admin_dsn = args.dsn
+        else:
+            postgres = run.LocalPostgres(run.find_pg_bin(args.pg_bin), run.free_port())
+            postgres.start()
+            admin_dsn = postgres.dsn
+        dsn = run.create_database(admin_dsn)
+        if args.tracks:
+            run.datagen.generate(dsn, args.tracks, args.seed)
+        for kind in ('flask', 'asgi'):
+            port = run.free_port()
+            server = run.start_server(kind, dsn, port, log_dir / f'{kind}.log')
+            try:
+                print(f'{kind}:', end=' ')
+                results.append(run_and_print(f'http://127.0.0.1:{port}', args))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        if args.dsn:
+            run.drop_database(args.dsn)
+        if postgres is not None:
+            postgres.stop()
+    shutil.rmtree(log_dir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:3001')
+    parser.add_argument('--compare', help='Second server to run the same test against')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--local', action='store_true', help='Starts the Flask and the ASGI server to compare')
+    parser.add_argument('--dsn', help='Postgres server for --local instead of starting one (needs CREATE DATABASE)')
+    parser.add_argument('--pg-bin', help='Directory with initdb and pg_ctl')
+    parser.add_argument('--tracks', type=int, default=0, help='Size of the synthetic catalog to add (see datagen.py)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.local or args.dsn:
+        results = run_local(args)
+    else:
+        results = [
+            run_and_print(url, args) for url in [args.url] + ([args.compare] if args.compare else [])
+        ]
+
+    if len(results) == 2 and results[0]['rps']:
+        first, second = results
+        print(f"\n{second['url']} vs {first['url']}: {second['rps'] / first['rps']:.2f}x throughput, "
+              f"p99 {first['p99_ms']:.1f} ms -> {second['p99_ms']:.1f} ms")
+
+if __name__ == '__main__':
+    main()
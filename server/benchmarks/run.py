@@ -0,0 +1,497 @@
+"""Benchmarks every route of the server against a throwaway local Postgres, and compares the results with a baseline.
+
+Starts Postgres with initdb and pg_ctl (or uses --dsn), creates the schema from table_schema.txt, applies the
+migrations, loads sample_data.txt (plus a synthetic catalog of --tracks tracks, see datagen.py), and starts the
+server with QUERY_STATS=1. Then --clients threads send a mix of reads and writes (--read-ratio) to every endpoint.
+For each endpoint it reports the throughput, the p50/p95/p99 latency, the queries per request, and the database
+time per request (from the X-Query-Count and X-DB-Time-Ms headers).
+
+    cd server
+    python benchmarks/run.py --clients 16 --duration 30 --output results.json
+    python benchmarks/run.py --tracks 1000000 --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json      # exits with 1 on a regression
+
+initdb will not run as root. Use --dsn to point at a Postgres server that is already running instead: a
+musedb_bench database is created on it and dropped at the end.
+
+The admin endpoints that change the server's state (schema refresh, cache clear) are not driven.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg2
+import psycopg2.extensions
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+
+import datagen  # noqa: E402
+import migrate  # noqa: E402
+
+ROOT_DIR = SERVER_DIR.parent
+SCHEMA_FILE = ROOT_DIR / 'table_schema.txt'
+SAMPLE_DATA_FILE = ROOT_DIR / 'sample_data.txt'
+BENCH_DATABASE = 'musedb_bench'
+
+# Endpoints with fewer requests than this are not compared with the baseline (their percentiles are noise)
+MIN_SAMPLES = 20
+
+def free_port():
+    """Gets a TCP port nobody is listening on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def find_pg_bin(pg_bin=None):
+    """Gets the directory with initdb and pg_ctl (--pg-bin, the PATH, or pg_config --bindir)"""
+    if pg_bin:
+        return Path(pg_bin)
+    pg_ctl = shutil.which('pg_ctl')
+    if pg_ctl:
+        return Path(pg_ctl).parent
+    try:
+        return Path(subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        raise RuntimeError('Cannot find pg_ctl, pass --pg-bin or --dsn')
+
+class LocalPostgres:
+    """A throwaway Postgres cluster in a temporary directory"""
+
+    def __init__(self, pg_bin, port):
+        self.pg_bin = pg_bin
+        self.port = port
+        self.directory = Path(tempfile.mkdtemp(prefix='musedb-bench-'))
+        self.data_dir = self.directory / 'data'
+
+    @property
+    def dsn(self):
+        return f'host=localhost port={self.port} dbname=postgres user=postgres'
+
+    def start(self):
+        subprocess.run(
+            [str(self.pg_bin / 'initdb'), '-D', str(self.data_dir), '-U', 'postgres', '-A', 'trust', '--no-sync'],
+            check=True, capture_output=True
+        )
+        options = f'-p {self.port} -k {self.directory} -c listen_addresses=localhost'
+        subprocess.run(
+            [str(self.pg_bin / 'pg_ctl'), '-D', str(self.data_dir), '-o', options,
+             '-l', str(self.directory / 'postgres.log'), '-w', 'start'],
+            check=True, capture_output=True
+        )
+
+    def stop(self):
+        subprocess.run([str(self.pg_bin / 'pg_ctl'), '-D', str(self.data_dir), '-m', 'fast', 'stop'], capture_output=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def with_database(dsn, dbname):
+    """Gets the same connection string for another database"""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    params['dbname'] = dbname
+    return psycopg2.extensions.make_dsn(**params)
+
+def create_database(admin_dsn):
+    """Creates an empty benchmark database with the schema, the migrations, and the sample data"""
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {BENCH_DATABASE};')
+        # UTF8 like the real database, whatever the server's default is
+        cursor.execute(f"CREATE DATABASE {BENCH_DATABASE} ENCODING 'UTF8' TEMPLATE template0;")
+    conn.close()
+
+    dsn = with_database(admin_dsn, BENCH_DATABASE)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_FILE.read_text())
+            conn.commit()
+        migrate.migrate(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(SAMPLE_DATA_FILE.read_text())
+            cursor.execute('ANALYZE;')
+        conn.commit()
+    finally:
+        conn.close()
+    return dsn
+
+def drop_database(admin_dsn):
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {BENCH_DATABASE} WITH (FORCE);')
+    conn.close()
+
+def catalog_facts(dsn):
+    """Gets the number of tracks and some words from the names (used to build the requests)"""
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM Track;')
+            track_count = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT DISTINCT lower(word) FROM (
+                    SELECT split_part(name, ' ', 1) AS word FROM Track
+                    UNION ALL SELECT split_part(name, ' ', 1) FROM Artist
+                    UNION ALL SELECT split_part(name, ' ', 1) FROM Album
+                ) AS words
+                WHERE length(word) >= 3
+                ORDER BY 1
+                LIMIT 200;
+            """)
+            words = [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    return track_count, words or ['love']
+
+def start_server(kind, dsn, port, log_path):
+    """Starts the Flask (or ASGI) server on the benchmark database with the query counting turned on"""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    env = dict(os.environ)
+    env.update({
+        'DB_HOST': params.get('host', 'localhost'),
+        'DB_PORT': str(params.get('port', 5432)),
+        'DB_NAME': params['dbname'],
+        'DB_USER': params.get('user', 'postgres'),
+        'DB_PASSWORD': params.get('password') or 'bench',
+        'DB_SSLMODE': params.get('sslmode', 'disable'),
+        'QUERY_STATS': '1'
+    })
+    if kind == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads']
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    # Waits for /api/health
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'The server did not start, see {log_path}')
+
+class Worker:
+    """One client: its random numbers and the names it created (so that its deletes have something to delete)"""
+
+    def __init__(self, index, seed, run_id, track_count, words):
+        self.index = index
+        self.rng = random.Random(seed * 1000 + index)
+        self.prefix = f'bench {run_id} w{index:03d}'
+        self.track_count = track_count
+        self.words = words
+        self.counter = 0
+        self.genres = []    # name prefixes to delete with /api/delete
+        self.songs = []     # song name prefixes to delete with /api/delete/music
+
+    def unique(self, kind):
+        """Gets a name no other name contains (the deletes match with ILIKE '%value%')"""
+        self.counter += 1
+        return f'{self.prefix} {kind}{self.counter:08d}'
+
+    def song(self, name):
+        return {
+            'song_name': name,
+            'artist_name': f'{self.prefix} artist',
+            'album_name': f'{self.prefix} album',
+            'album_release_date': '2024-01-01',
+            'track_length': '00:03:00'
+        }
+
+    # Reads: endpoint -> (method, path, JSON body)
+    def read(self):
+        return self.rng.choice(READS)(self)
+
+    def write(self):
+        return self.rng.choice(WRITES)(self)
+
+def read_table_data(worker):
+    return 'table_data', 'GET', f"/api/tables/{worker.rng.choice(['Track', 'Album', 'Artist', 'Genre'])}", None
+
+def read_tracks_joined(worker):
+    offset = worker.rng.randrange(max(1, worker.track_count - 15))
+    return 'tracks_joined', 'GET', f'/api/tracks/joined?limit=15&offset={offset}', None
+
+def read_search(worker):
+    return 'search', 'POST', '/api/search', {'table': 'Track', 'column': 'name', 'value': worker.rng.choice(worker.words)}
+
+def read_search_music(worker):
+    return 'search_music', 'POST', '/api/search/music', {'query': worker.rng.choice(worker.words)}
+
+def read_delete_preview(worker):
+    body = {'type': worker.rng.choice(['song', 'artist', 'album']), 'value': worker.rng.choice(worker.words)}
+    return 'delete_preview', 'POST', '/api/delete/preview', body
+
+READS = [
+    lambda worker: ('health', 'GET', '/api/health', None),
+    lambda worker: ('tables', 'GET', '/api/tables', None),
+    read_table_data,
+    lambda worker: ('table_columns', 'GET', '/api/tables/Track/columns', None),
+    lambda worker: ('all_data', 'GET', '/api/all-data', None),
+    read_tracks_joined,
+    read_search,
+    read_search_music,
+    read_delete_preview,
+    lambda worker: ('admin_pool', 'GET', '/api/admin/pool', None),
+    lambda worker: ('admin_statements', 'GET', '/api/admin/statements', None),
+    lambda worker: ('admin_cache', 'GET', '/api/admin/cache', None),
+    lambda worker: ('search_index', 'GET', '/api/search/index', None),
+]
+
+def write_insert(worker):
+    name = worker.unique('genre')
+    worker.genres.append(name)
+    return 'insert', 'POST', '/api/insert', {'table': 'Genre', 'data': {'name': name, 'description': 'benchmark'}}
+
+def write_insert_bulk(worker):
+    prefix = worker.unique('genre')
+    worker.genres.append(prefix)
+    rows = [{'name': f'{prefix}-{i:02d}', 'description': 'benchmark'} for i in range(10)]
+    return 'insert_bulk', 'POST', '/api/insert/bulk', {'table': 'Genre', 'rows': rows}
+
+def write_delete(worker):
+    if not worker.genres:
+        return write_insert(worker)
+    return 'delete', 'DELETE', '/api/delete', {'table': 'Genre', 'column': 'name', 'value': worker.genres.pop()}
+
+def write_insert_music(worker):
+    name = worker.unique('song')
+    worker.songs.append(name)
+    return 'insert_music', 'POST', '/api/insert/music', worker.song(name)
+
+def write_insert_music_batch(worker):
+    prefix = worker.unique('song')
+    worker.songs.append(prefix)
+    songs = [worker.song(f'{prefix}-{i:02d}') for i in range(10)]
+    return 'insert_music_batch', 'POST', '/api/insert/music/batch', {'songs': songs}
+
+def write_delete_music(worker):
+    if not worker.songs:
+        return write_insert_music(worker)
+    return 'delete_music', 'DELETE', '/api/delete/music', {'type': 'song', 'value': worker.songs.pop()}
+
+WRITES = [write_insert, write_insert_bulk, write_delete, write_insert_music, write_insert_music_batch, write_delete_music]
+
+def drive(port, worker, read_ratio, deadline, samples):
+    """Sends requests one after another until the deadline and records (endpoint, seconds, status, queries, db ms)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while time.monotonic() < deadline:
+        endpoint, method, path, body = worker.read() if worker.rng.random() < read_ratio else worker.write()
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            samples.append((endpoint, time.perf_counter() - started, 0, None, None))
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        elapsed = time.perf_counter() - started
+        query_count = response.getheader('X-Query-Count')
+        db_ms = response.getheader('X-DB-Time-Ms')
+        samples.append((
+            endpoint, elapsed, response.status,
+            int(query_count) if query_count is not None else None,
+            float(db_ms) if db_ms is not None else None
+        ))
+    conn.close()
+
+def run_load(port, clients, duration, warmup, read_ratio, seed, track_count, words):
+    """Runs the clients (after a warm up that is not measured) and gets the samples and the measured seconds"""
+    run_id = f'{seed:x}{int(time.time()) % 100000:05d}'
+    workers = [Worker(i, seed, run_id, track_count, words) for i in range(clients)]
+
+    def run_phase(seconds, samples_by_worker):
+        deadline = time.monotonic() + seconds
+        threads = [
+            threading.Thread(target=drive, args=(port, worker, read_ratio, deadline, samples))
+            for worker, samples in zip(workers, samples_by_worker)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if warmup > 0:
+        run_phase(warmup, [[] for _ in workers])
+    samples_by_worker = [[] for _ in workers]
+    started = time.monotonic()
+    run_phase(duration, samples_by_worker)
+    elapsed = time.monotonic() - started
+    return [sample for samples in samples_by_worker for sample in samples], elapsed
+
+def percentile(sorted_values, pct):
+    """Gets a percentile of an already sorted list (nearest rank)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+def summarize(samples, elapsed):
+    """Gets the numbers of a group of samples"""
+    latencies = sorted(seconds * 1000 for _, seconds, _, _, _ in samples)
+    ok = [sample for sample in samples if 0 < sample[2] < 400]
+    query_counts = [sample[3] for sample in ok if sample[3] is not None]
+    db_times = [sample[4] for sample in ok if sample[4] is not None]
+    query_mean, db_mean = mean(query_counts), mean(db_times)
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(ok),
+        'rps': round(len(samples) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries_per_request': round(query_mean, 3) if query_mean is not None else None,
+        'db_ms_per_request': round(db_mean, 3) if db_mean is not None else None
+    }
+
+def summarize_endpoints(samples, elapsed):
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    return {endpoint: summarize(group, elapsed) for endpoint, group in sorted(by_endpoint.items())}
+
+def compare(results, baseline, tolerance):
+    """Gets a description of every endpoint that got slower, busier, or less reliable than in the baseline"""
+    regressions = []
+    for endpoint, before in baseline['endpoints'].items():
+        after = results['endpoints'].get(endpoint)
+        if after is None or before['requests'] < MIN_SAMPLES or after['requests'] < MIN_SAMPLES:
+            continue
+        if after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']:.1f} ms -> {after['p95_ms']:.1f} ms")
+        if after['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint}: {before['rps']:.1f} -> {after['rps']:.1f} req/s")
+        # Query counts barely vary between runs, so any real increase is a new query per request
+        if (before['queries_per_request'] is not None and after['queries_per_request'] is not None
+                and after['queries_per_request'] > before['queries_per_request'] * (1 + tolerance) + 0.5):
+            regressions.append(f"{endpoint}: {before['queries_per_request']} -> "
+                               f"{after['queries_per_request']} queries per request")
+        before_errors = before['errors'] / before['requests']
+        after_errors = after['errors'] / after['requests']
+        if after_errors > before_errors + 0.01:
+            regressions.append(f'{endpoint}: error rate {before_errors:.1%} -> {after_errors:.1%}')
+    return regressions
+
+def print_results(results):
+    print(f"{'endpoint':<20} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'queries':>8} {'db ms':>8}")
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+    for endpoint, numbers in rows:
+        queries = numbers['queries_per_request']
+        db_ms = numbers['db_ms_per_request']
+        print(f"{endpoint:<20} {numbers['requests']:>9} {numbers['errors']:>7} {numbers['rps']:>9.1f} "
+              f"{numbers['p50_ms']:>9.2f} {numbers['p95_ms']:>9.2f} {numbers['p99_ms']:>9.2f} "
+              f"{queries if queries is not None else '-':>8} {db_ms if db_ms is not None else '-':>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', help='Postgres server to use instead of starting one (needs CREATE DATABASE)')
+    parser.add_argument('--pg-bin', help='Directory with initdb and pg_ctl')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--read-ratio', type=float, default=0.9, help='Share of the requests that are reads')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tracks', type=int, default=0, help='Size of the synthetic catalog to add (see datagen.py)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes that load the catalog')
+    parser.add_argument('--output', help='Saves the results as JSON')
+    parser.add_argument('--baseline', help='Results to compare with (exits with 1 on a regression)')
+    parser.add_argument('--save-baseline', help='Saves the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before it is a regression')
+    args = parser.parse_args()
+
+    postgres = None
+    server = None
+    log_dir = Path(tempfile.mkdtemp(prefix='musedb-bench-logs-'))
+    try:
+        if args.dsn:
+            admin_dsn = args.dsn
+        else:
+            postgres = LocalPostgres(find_pg_bin(args.pg_bin), free_port())
+            postgres.start()
+            admin_dsn = postgres.dsn
+        dsn = create_database(admin_dsn)
+        if args.tracks:
+            datagen.generate(dsn, args.tracks, args.seed, args.workers)
+        track_count, words = catalog_facts(dsn)
+
+        port = free_port()
+        server = start_server(args.server, dsn, port, log_dir / 'server.log')
+        print(f'Benchmarking the {args.server} server with {args.clients} clients for {args.duration:g}s '
+              f'({args.read_ratio:.0%} reads, {track_count} tracks)')
+        samples, elapsed = run_load(
+            port, args.clients, args.duration, args.warmup, args.read_ratio, args.seed, track_count, words
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if args.dsn:
+            drop_database(args.dsn)
+        if postgres is not None:
+            postgres.stop()
+
+    results = {
+        'meta': {
+            'server': args.server,
+            'clients': args.clients,
+            'duration': args.duration,
+            'read_ratio': args.read_ratio,
+            'seed': args.seed,
+            'tracks': track_count,
+            'python': platform.python_version(),
+            'finished_at': datetime.now(timezone.utc).isoformat()
+        },
+        'endpoints': summarize_endpoints(samples, elapsed),
+        'total': summarize(samples, elapsed)
+    }
+    print_results(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(results, indent=2) + '\n')
+            print(f'Saved {path}')
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print(f'\nRegressions against {args.baseline}:')
+            for regression in regressions:
+                print(f'    {regression}')
+            return 1
+        print(f'\nNo regressions against {args.baseline}')
+    shutil.rmtree(log_dir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""The denormalized track catalog (migrations/005_track_catalog.sql): reads and the consistency check
+
+track_catalog has one row per track with its album and its artists, kept current by triggers on the base tables,
+so /api/tracks/joined and /api/search/music read it with one index scan. Until the migration is applied (or with
+TRACK_CATALOG=0) the endpoints keep joining the base tables.
+"""
+import time
+
+# How often to re-check whether the catalog exists (in seconds)
+CATALOG_CHECK_TTL = 300
+
+# Whether the catalog was found, and when it was last checked
+catalog_state = {'available': None, 'checked_at': 0.0}
+
+# Whether the catalog exists - SQL Query
+CATALOG_CHECK_QUERY = "SELECT to_regclass('track_catalog') IS NOT NULL AND to_regprocedure('refresh_track_catalog(integer[])') IS NOT NULL;"
+
+# Tracks with their albums and artists, one page at a time (by offset, or after a track_id) - SQL Queries
+CATALOG_TRACKS_COLUMNS = """
+        track_id,
+        track_name,
+        track_length,
+        album_id,
+        album_name,
+        album_release_date,
+        album_description,
+        artists"""
+CATALOG_TRACKS_QUERY = f"""
+    SELECT {CATALOG_TRACKS_COLUMNS}
+    FROM track_catalog
+    ORDER BY track_id
+    LIMIT %s OFFSET %s;
+"""
+CATALOG_TRACKS_AFTER_QUERY = f"""
+    SELECT {CATALOG_TRACKS_COLUMNS}
+    FROM track_catalog
+    WHERE track_id > %s
+    ORDER BY track_id
+    LIMIT %s;
+"""
+
+# Catalog rows that differ from what the base tables say they should be - SQL Query
+# missing: a track without a catalog row, extra: a catalog row without a track, stale: a row with old values
+CATALOG_DIFF = """
+    SELECT
+        COALESCE(s.track_id, c.track_id) AS track_id,
+        CASE WHEN c.track_id IS NULL THEN 'missing' WHEN s.track_id IS NULL THEN 'extra' ELSE 'stale' END AS problem
+    FROM track_catalog_source s
+    FULL OUTER JOIN track_catalog c ON c.track_id = s.track_id
+    WHERE c.track_id IS NULL
+    OR s.track_id IS NULL
+    OR (s.*) IS DISTINCT FROM (c.*)
+"""
+CATALOG_CHECK_DIFF_QUERY = f"""
+    WITH diff AS ({CATALOG_DIFF})
+    SELECT problem, COUNT(*), (ARRAY_AGG(track_id ORDER BY track_id))[1:%s]
+    FROM diff
+    GROUP BY problem;
+"""
+CATALOG_REPAIR_QUERY = f"""
+    WITH diff AS ({CATALOG_DIFF})
+    SELECT refresh_track_catalog(ARRAY(SELECT track_id FROM diff)), (SELECT COUNT(*) FROM diff);
+"""
+
+PROBLEMS = ['missing', 'extra', 'stale']
+
+def catalog_check_due():
+    """Whether the catalog has not been looked for yet (or was looked for too long ago)"""
+    return catalog_state['available'] is None or time.monotonic() - catalog_state['checked_at'] > CATALOG_CHECK_TTL
+
+def store_catalog(available):
+    """Remembers whether the catalog migration is applied"""
+    catalog_state['available'] = bool(available)
+    catalog_state['checked_at'] = time.monotonic()
+    return catalog_state['available']
+
+def has_catalog(cursor):
+    """Checks (and caches) whether the catalog migration is applied"""
+    if catalog_check_due():
+        cursor.execute(CATALOG_CHECK_QUERY)
+        store_catalog(cursor.fetchone()[0])
+    return catalog_state['available']
+
+def forget_catalog():
+    """Looks for the catalog again on the next request (e.g. after the schema changed)"""
+    catalog_state['available'] = None
+
+def check(cursor, sample=20):
+    """Compares every catalog row with the base tables and gets the number of missing, extra, and stale rows
+
+    This reads every track, so it is for admin use (and cron), not for requests.
+    """
+    cursor.execute(CATALOG_CHECK_DIFF_QUERY, (sample,))
+    found = {problem: (count, track_ids) for problem, count, track_ids in cursor.fetchall()}
+    result = {problem: found.get(problem, (0, []))[0] for problem in PROBLEMS}
+    result['consistent'] = not found
+    result['sample_track_ids'] = {problem: found[problem][1] for problem in PROBLEMS if problem in found}
+    return result
+
+def repair(cursor):
+    """Recomputes every catalog row that differs from the base tables and gets how many there were"""
+    cursor.execute(CATALOG_REPAIR_QUERY)
+    return cursor.fetchone()[1]
@@ -0,0 +1,231 @@
+import bisect
+import collections
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+# Upper bounds (in seconds) of the buckets in the wait time histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class PoolTimeout(ConnectionError):
+    """No connection became free before the timeout"""
+
+class ConnectionPool:
+    """Thread-safe connection pool that waits for a free connection instead of failing right away
+
+    Idle connections are handed out newest first. Connections that sat idle for longer than ping_after
+    seconds are checked with SELECT 1 first, and connections older than recycle seconds are replaced,
+    so connections dropped by the Supabase pooler are never handed to a request.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=20, timeout=10.0, recycle=1800.0, ping_after=30.0,
+                 connect=psycopg2.connect, on_open=None, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Invalid pool size')
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.connect = connect
+        self.on_open = on_open              # on_open(conn, info) sets up every new connection
+        self.connect_kwargs = connect_kwargs
+
+        self.cond = threading.Condition()
+        self.idle = collections.deque()    # (connection, time it was released)
+        self.in_use = set()
+        self.created_at = {}               # connection -> time it was opened
+        self.info = {}                     # connection -> metadata kept for as long as the connection is open
+        self.opening = 0                   # connections being opened right now (they count towards maxconn)
+        self.waiters = 0
+        self.closed = False
+
+        # Counters for stats()
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_total = 0.0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.opened = 0
+        self.discarded = 0
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def _open(self):
+        """Opens a new connection (the caller has already reserved a slot for it)"""
+        conn = None
+        info = {}
+        try:
+            conn = self.connect(self.dsn, **self.connect_kwargs)
+            if self.on_open is not None:
+                self.on_open(conn, info)
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            with self.cond:
+                self.opening -= 1
+                self.cond.notify()
+            raise ConnectionError(f'Failed to connect to the database: {str(e)}')
+        with self.cond:
+            self.opening -= 1
+            self.opened += 1
+            self.created_at[conn] = time.monotonic()
+            self.info[conn] = info
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot (the caller holds the lock)"""
+        self.created_at.pop(conn, None)
+        self.info.pop(conn, None)
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.cond.notify()
+
+    def _is_usable(self, conn, idle_since):
+        """Checks a connection taken from the idle list before handing it out"""
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.recycle and now - self.created_at.get(conn, now) > self.recycle:
+            return False
+        if self.ping_after is not None and now - idle_since > self.ping_after:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1;')
+                cursor.close()
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _record_wait(self, waited):
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_counts[bisect.bisect_left(WAIT_BUCKETS, waited)] += 1
+
+    def getconn(self, timeout=None):
+        """Gets a connection, waiting up to timeout seconds for one to be released"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            candidate = None
+            with self.cond:
+                while True:
+                    if self.closed:
+                        raise ConnectionError('Connection pool is closed')
+                    if self.idle:
+                        candidate = self.idle.pop()
+                        self.in_use.add(candidate[0])
+                        break
+                    if self.size < self.maxconn:
+                        self.opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f'No database connection available after {timeout:.1f}s')
+                    self.waiters += 1
+                    try:
+                        self.cond.wait(remaining)
+                    finally:
+                        self.waiters -= 1
+
+            if candidate is None:
+                conn = self._open()
+                with self.cond:
+                    self.in_use.add(conn)
+                    self._record_wait(time.monotonic() - started)
+                return conn
+
+            # Checked outside the lock since it can take a round trip
+            conn, idle_since = candidate
+            if self._is_usable(conn, idle_since):
+                with self.cond:
+                    self._record_wait(time.monotonic() - started)
+                return conn
+            with self.cond:
+                self.in_use.discard(conn)
+                self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        """Gives a connection back (any open transaction is rolled back first)"""
+        if not close and not conn.closed:
+            try:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self.cond:
+            if conn not in self.in_use:
+                return
+            self.in_use.discard(conn)
+            if close or conn.closed or self.closed:
+                self._discard(conn)
+            else:
+                self.idle.append((conn, time.monotonic()))
+                self.cond.notify()
+
+    def warm_up(self):
+        """Opens connections until there are at least minconn of them"""
+        opened = []
+        try:
+            while True:
+                with self.cond:
+                    if self.size >= self.minconn:
+                        break
+                    self.opening += 1
+                conn = self._open()
+                with self.cond:
+                    self.in_use.add(conn)
+                opened.append(conn)
+        finally:
+            for conn in opened:
+                self.putconn(conn)
+        return len(opened)
+
+    def closeall(self):
+        """Closes every idle connection (connections in use are closed when they are released)"""
+        with self.cond:
+            self.closed = True
+            while self.idle:
+                conn, _ = self.idle.pop()
+                self._discard(conn)
+            self.cond.notify_all()
+
+    def conn_info(self, conn):
+        """Gets the metadata of a connection from this pool (None if the pool did not open it)"""
+        return self.info.get(conn)
+
+    def stats(self):
+        """Gets the pool size, usage, and the wait time histogram"""
+        with self.cond:
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(list(WAIT_BUCKETS) + ['+Inf'], self.wait_counts):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            return {
+                'min': self.minconn,
+                'max': self.maxconn,
+                'size': self.size,
+                'in_use': len(self.in_use),
+                'idle': len(self.idle),
+                'waiters': self.waiters,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'opened': self.opened,
+                'discarded': self.discarded,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_histogram': histogram
+            }
@@ -0,0 +1,82 @@
+"""An artist's albums with their track count and total track length (for /api/artists/<id>/discography)
+
+The numbers come from album_stats (migrations/006_album_stats.sql), which triggers keep current on every track
+insert and delete. Until that migration is applied they are computed from Track like queries.txt does.
+An album whose stored length differs from the total of its tracks by more than the tolerance is flagged.
+"""
+import time
+
+# How often to re-check whether album_stats exists (in seconds)
+STATS_CHECK_TTL = 300
+
+# Whether album_stats was found, and when it was last checked
+stats_state = {'available': None, 'checked_at': 0.0}
+
+# Whether album_stats exists - SQL Query
+STATS_CHECK_QUERY = "SELECT to_regclass('album_stats') IS NOT NULL;"
+
+# The artist with each of their albums (one row with NULL album columns if there are none) - SQL Queries
+# computed_length is NULL when no track has a length, like SUM(t.length)
+DISCOGRAPHY_COLUMNS = """
+        ar.artist_id,
+        ar.name AS artist_name,
+        al.album_id,
+        al.name AS album_name,
+        al.release_date,
+        al.length AS album_length,
+        {track_count} AS track_count,
+        {computed_length} AS computed_length"""
+DISCOGRAPHY_QUERY = """
+    SELECT {columns}
+    FROM Artist ar
+    LEFT JOIN ArtistAlbum aa ON ar.artist_id = aa.artist_id
+    LEFT JOIN Album al ON aa.album_id = al.album_id
+    LEFT JOIN album_stats s ON al.album_id = s.album_id
+    WHERE ar.artist_id = %s
+    ORDER BY al.release_date, al.album_id;
+""".format(columns=DISCOGRAPHY_COLUMNS.format(
+    track_count='COALESCE(s.track_count, 0)',
+    computed_length='CASE WHEN s.length_count > 0 THEN s.total_length END'
+))
+DISCOGRAPHY_FALLBACK_QUERY = """
+    SELECT {columns}
+    FROM Artist ar
+    LEFT JOIN ArtistAlbum aa ON ar.artist_id = aa.artist_id
+    LEFT JOIN Album al ON aa.album_id = al.album_id
+    LEFT JOIN Track t ON al.album_id = t.album_id
+    WHERE ar.artist_id = %s
+    GROUP BY ar.artist_id, ar.name, al.album_id, al.name, al.release_date, al.length
+    ORDER BY al.release_date, al.album_id;
+""".format(columns=DISCOGRAPHY_COLUMNS.format(track_count='COUNT(t.track_id)', computed_length='SUM(t.length)'))
+
+def stats_check_due():
+    """Whether album_stats has not been looked for yet (or was looked for too long ago)"""
+    return stats_state['available'] is None or time.monotonic() - stats_state['checked_at'] > STATS_CHECK_TTL
+
+def has_album_stats(cursor):
+    """Checks (and caches) whether the album_stats migration is applied"""
+    if stats_check_due():
+        cursor.execute(STATS_CHECK_QUERY)
+        stats_state['available'] = bool(cursor.fetchone()[0])
+        stats_state['checked_at'] = time.monotonic()
+    return stats_state['available']
+
+def forget_album_stats():
+    """Looks for album_stats again on the next request (e.g. after the schema changed)"""
+    stats_state['available'] = None
+
+def get_discography(cursor, artist_id, use_stats=True):
+    """Gets the (artist_id, artist_name, album_id, album_name, release_date, album_length, track_count,
+    computed_length) rows of an artist (an empty list if the artist does not exist)"""
+    cursor.execute(DISCOGRAPHY_QUERY if use_stats else DISCOGRAPHY_FALLBACK_QUERY, (artist_id,))
+    return cursor.fetchall()
+
+def length_drift(album_length, computed_length):
+    """Gets how many seconds the stored album length is over (or under) the total of its tracks (None if unknown)"""
+    if album_length is None or computed_length is None:
+        return None
+    return (album_length - computed_length).total_seconds()
+
+def drifts(drift_seconds, tolerance):
+    """Whether the stored album length is off by more than the tolerance (in seconds)"""
+    return drift_seconds is not None and abs(drift_seconds) > tolerance
@@ -0,0 +1,616 @@
+"""Facet counts for /api/browse (genre, nation, artist type, and release year)
+
+A track belongs to the genres, nations, and types of its artists (the track artists and the album artists, like
+/api/tracks/joined lists them) and to the release year of its album. Every facet is counted with the filters of the
+other facets applied but not its own, so the counts say how many tracks each value would add or leave.
+
+The counts come from in-memory bitmaps (one bit per track for every facet value) while they are fresh, and
+from one query over the base tables otherwise. The page of tracks is always read from the database.
+"""
+import bisect
+import sys
+import threading
+import time
+from array import array
+
+from search_index import IndexManager
+
+# Facets in the order they are listed, the filter of each list of values, and the key of a value in the response
+FACETS = ('genre', 'nation', 'type', 'release_year')
+FACET_FILTERS = {'genre': 'genre_ids', 'nation': 'nation_ids', 'type': 'types'}
+FACET_KEYS = {'genre': 'genre_id', 'nation': 'nation_id', 'type': 'type', 'release_year': 'year'}
+
+# Writes to these tables (lower case) can change the facet counts
+FACET_TABLES = {'track', 'album', 'artist', 'artisttrack', 'artistalbum', 'artistgenre', 'genre', 'nation'}
+
+DEFAULT_LIMIT = 15
+MAX_LIMIT = 200
+
+# The artists of track t: its track artists and its album artists (one artist can be listed twice) - SQL Fragment
+TRACK_ARTIST_IDS = """(
+            SELECT at.artist_id FROM ArtistTrack at WHERE at.track_id = t.track_id
+            UNION ALL
+            SELECT aa.artist_id FROM ArtistAlbum aa WHERE aa.album_id = t.album_id
+        )"""
+
+# Whether the release date of album a is in the year range (a missing filter matches everything) - SQL Fragment
+YEAR_MATCH = """COALESCE(
+            (%(year_from)s::int IS NULL OR EXTRACT(YEAR FROM a.release_date) >= %(year_from)s)
+            AND (%(year_to)s::int IS NULL OR EXTRACT(YEAR FROM a.release_date) <= %(year_to)s),
+            false
+        )"""
+
+# The filters of a page of tracks (track t in album a) - SQL Fragment
+TRACK_FILTERS = f"""
+    AND (%(genre_ids)s::int[] IS NULL OR EXISTS (
+        SELECT 1 FROM ArtistGenre ag
+        WHERE ag.genre_id = ANY(%(genre_ids)s)
+        AND ag.artist_id IN {TRACK_ARTIST_IDS}
+    ))
+    AND (%(nation_ids)s::int[] IS NULL OR EXISTS (
+        SELECT 1 FROM Artist ar
+        WHERE ar.nation_id = ANY(%(nation_ids)s)
+        AND ar.artist_id IN {TRACK_ARTIST_IDS}
+    ))
+    AND (%(types)s::text[] IS NULL OR EXISTS (
+        SELECT 1 FROM Artist ar
+        WHERE ar.type = ANY(%(types)s)
+        AND ar.artist_id IN {TRACK_ARTIST_IDS}
+    ))
+    AND {YEAR_MATCH}"""
+
+# Every facet count (and the number of tracks that match every filter) in one statement - SQL Query
+# Tracks with the same artists in the same album are counted as one group (there are far fewer groups than tracks),
+# so each base table is read once: the artists get their filter matches, the groups get theirs from their artists,
+# and every facet is then a sum of group sizes over the groups that match the other facets
+FACET_COUNTS_QUERY = f"""
+    WITH artist_matches AS MATERIALIZED (
+        SELECT
+            ar.artist_id,
+            ar.nation_id,
+            ar.type,
+            (%(genre_ids)s::int[] IS NULL OR EXISTS (
+                SELECT 1 FROM ArtistGenre ag WHERE ag.artist_id = ar.artist_id AND ag.genre_id = ANY(%(genre_ids)s)
+            )) AS genre_ok,
+            (%(nation_ids)s::int[] IS NULL OR ar.nation_id = ANY(%(nation_ids)s)) AS nation_ok,
+            COALESCE(%(types)s::text[] IS NULL OR ar.type = ANY(%(types)s), false) AS type_ok
+        FROM Artist ar
+    ),
+    -- The track artists of every track (the album artists are added per group, they are the same for the album)
+    track_artist_sets AS (
+        SELECT t.track_id, t.album_id, array_agg(at.artist_id ORDER BY at.artist_id) AS artist_ids
+        FROM Track t
+        LEFT JOIN ArtistTrack at ON at.track_id = t.track_id
+        GROUP BY t.track_id
+    ),
+    groups AS MATERIALIZED (
+        SELECT
+            row_number() OVER () AS group_id,
+            s.artist_ids || COALESCE(album_artists.artist_ids, '{{}}') AS artist_ids,
+            EXTRACT(YEAR FROM a.release_date)::int AS release_year,
+            {YEAR_MATCH} AS year_ok,
+            s.tracks
+        FROM (
+            SELECT album_id, artist_ids, COUNT(*) AS tracks FROM track_artist_sets GROUP BY album_id, artist_ids
+        ) s
+        INNER JOIN Album a ON a.album_id = s.album_id
+        LEFT JOIN LATERAL (
+            SELECT array_agg(aa.artist_id) AS artist_ids FROM ArtistAlbum aa WHERE aa.album_id = s.album_id
+        ) album_artists ON true
+    ),
+    group_artists AS MATERIALIZED (
+        SELECT DISTINCT gr.group_id, artist_id
+        FROM groups gr, unnest(gr.artist_ids) artist_id
+        WHERE artist_id IS NOT NULL
+    ),
+    group_matches AS MATERIALIZED (
+        SELECT
+            gr.group_id, gr.release_year, gr.tracks, gr.year_ok,
+            COALESCE(bool_or(m.genre_ok), %(genre_ids)s::int[] IS NULL) AS genre_ok,
+            COALESCE(bool_or(m.nation_ok), %(nation_ids)s::int[] IS NULL) AS nation_ok,
+            COALESCE(bool_or(m.type_ok), %(types)s::text[] IS NULL) AS type_ok
+        FROM groups gr
+        LEFT JOIN group_artists ga ON ga.group_id = gr.group_id
+        LEFT JOIN artist_matches m ON m.artist_id = ga.artist_id
+        GROUP BY gr.group_id, gr.release_year, gr.tracks, gr.year_ok
+    )
+    SELECT 'genre' AS facet, v.value, g.name::text AS name, SUM(v.tracks)::bigint AS count
+    FROM (
+        SELECT DISTINCT gm.group_id, ag.genre_id AS value, gm.tracks
+        FROM group_matches gm
+        INNER JOIN group_artists ga ON ga.group_id = gm.group_id
+        INNER JOIN ArtistGenre ag ON ag.artist_id = ga.artist_id
+        WHERE gm.nation_ok AND gm.type_ok AND gm.year_ok
+    ) v
+    INNER JOIN Genre g ON g.genre_id = v.value
+    GROUP BY v.value, g.name
+    UNION ALL
+    SELECT 'nation', v.value, n.name::text, SUM(v.tracks)::bigint
+    FROM (
+        SELECT DISTINCT gm.group_id, m.nation_id AS value, gm.tracks
+        FROM group_matches gm
+        INNER JOIN group_artists ga ON ga.group_id = gm.group_id
+        INNER JOIN artist_matches m ON m.artist_id = ga.artist_id
+        WHERE gm.genre_ok AND gm.type_ok AND gm.year_ok
+    ) v
+    INNER JOIN Nation n ON n.nation_id = v.value
+    GROUP BY v.value, n.name
+    UNION ALL
+    SELECT 'type', NULL, v.value, SUM(v.tracks)::bigint
+    FROM (
+        SELECT DISTINCT gm.group_id, m.type::text AS value, gm.tracks
+        FROM group_matches gm
+        INNER JOIN group_artists ga ON ga.group_id = gm.group_id
+        INNER JOIN artist_matches m ON m.artist_id = ga.artist_id
+        WHERE m.type IS NOT NULL AND gm.genre_ok AND gm.nation_ok AND gm.year_ok
+    ) v
+    GROUP BY v.value
+    UNION ALL
+    SELECT 'release_year', gm.release_year, NULL, SUM(gm.tracks)::bigint
+    FROM group_matches gm
+    WHERE gm.release_year IS NOT NULL AND gm.genre_ok AND gm.nation_ok AND gm.type_ok
+    GROUP BY gm.release_year
+    UNION ALL
+    SELECT 'total', NULL, NULL, COALESCE(SUM(gm.tracks), 0)::bigint
+    FROM group_matches gm
+    WHERE gm.genre_ok AND gm.nation_ok AND gm.type_ok AND gm.year_ok;
+"""
+
+def facet_rows(key):
+    """The tracks of every facet value in the tracks CTE (each track as its tracks.<key>) - SQL Fragment
+
+    The 'tracks' row lists the track ids of every track in the CTE.
+    """
+    return f"""
+    track_artists AS MATERIALIZED (
+        SELECT tr.{key}, at.artist_id FROM tracks tr INNER JOIN ArtistTrack at ON at.track_id = tr.track_id
+        UNION
+        SELECT tr.{key}, aa.artist_id FROM tracks tr INNER JOIN ArtistAlbum aa ON aa.album_id = tr.album_id
+    )
+    SELECT 'tracks' AS facet, NULL::int AS value, NULL AS name, ARRAY_AGG(tr.track_id ORDER BY tr.track_id) AS tracks
+    FROM tracks tr
+    UNION ALL
+    SELECT 'genre', g.genre_id, g.name::text, ARRAY_AGG(ta.{key})
+    FROM Genre g
+    INNER JOIN ArtistGenre ag ON ag.genre_id = g.genre_id
+    INNER JOIN track_artists ta ON ta.artist_id = ag.artist_id
+    GROUP BY g.genre_id, g.name
+    UNION ALL
+    SELECT 'nation', n.nation_id, n.name::text, ARRAY_AGG(ta.{key})
+    FROM Nation n
+    INNER JOIN Artist ar ON ar.nation_id = n.nation_id
+    INNER JOIN track_artists ta ON ta.artist_id = ar.artist_id
+    GROUP BY n.nation_id, n.name
+    UNION ALL
+    SELECT 'type', NULL, ar.type::text, ARRAY_AGG(ta.{key})
+    FROM Artist ar
+    INNER JOIN track_artists ta ON ta.artist_id = ar.artist_id
+    WHERE ar.type IS NOT NULL
+    GROUP BY ar.type
+    UNION ALL
+    SELECT 'release_year', EXTRACT(YEAR FROM a.release_date)::int, NULL, ARRAY_AGG(tr.{key})
+    FROM tracks tr
+    INNER JOIN Album a ON a.album_id = tr.album_id
+    WHERE a.release_date IS NOT NULL
+    GROUP BY 1, 2;
+"""
+
+# The tracks (by their position in track_id order) of every facet value, for building the bitmaps - SQL Query
+FACET_INDEX_QUERY = """
+    WITH tracks AS MATERIALIZED (
+        SELECT t.track_id, t.album_id, (row_number() OVER (ORDER BY t.track_id) - 1)::int AS position
+        FROM Track t
+    ),""" + facet_rows('position')
+
+# The tracks (by track id) of every facet value, for the tracks that writes marked: the marked tracks, the tracks of
+# the marked albums, and the tracks the marked artists are on - SQL Query
+FACET_REFRESH_QUERY = """
+    WITH tracks AS MATERIALIZED (
+        SELECT t.track_id, t.album_id FROM Track t WHERE t.track_id = ANY(%(track_ids)s)
+        UNION
+        SELECT t.track_id, t.album_id FROM Track t WHERE t.album_id = ANY(%(album_ids)s)
+        UNION
+        SELECT t.track_id, t.album_id
+        FROM ArtistTrack at INNER JOIN Track t ON t.track_id = at.track_id
+        WHERE at.artist_id = ANY(%(artist_ids)s)
+        UNION
+        SELECT t.track_id, t.album_id
+        FROM ArtistAlbum aa INNER JOIN Track t ON t.album_id = aa.album_id
+        WHERE aa.artist_id = ANY(%(artist_ids)s)
+    ),""" + facet_rows('track_id')
+
+def parse_ids(values):
+    """Reads a list of ids from repeated and/or comma-separated parameters (raises ValueError if one is not a number)"""
+    ids = [int(value) for text in values for value in text.split(',') if value.strip()]
+    return sorted(set(ids)) or None
+
+def parse_filters(args):
+    """Reads the browse filters from the query parameters (raises ValueError if one is invalid)
+
+    ?genre= and ?nation= take ids, ?type= takes artist types (each can be repeated or comma-separated),
+    and ?year_from= and ?year_to= bound the album release year (both included).
+    """
+    types = sorted({value.strip() for text in args.getlist('type') for value in text.split(',') if value.strip()})
+    year_from = args.get('year_from', type=int)
+    year_to = args.get('year_to', type=int)
+    if (args.get('year_from') and year_from is None) or (args.get('year_to') and year_to is None):
+        raise ValueError('year_from and year_to must be years')
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise ValueError('year_from must not be after year_to')
+    return {
+        'genre_ids': parse_ids(args.getlist('genre')),
+        'nation_ids': parse_ids(args.getlist('nation')),
+        'types': types or None,
+        'year_from': year_from,
+        'year_to': year_to
+    }
+
+def year_selected(year, filters):
+    """Whether a release year is in the filtered range (every year is when there is no range)"""
+    return (filters['year_from'] is None or year >= filters['year_from']) and \
+        (filters['year_to'] is None or year <= filters['year_to'])
+
+def is_selected(facet, value, filters):
+    """Whether a facet value is one the filters ask for"""
+    if facet == 'release_year':
+        return (filters['year_from'] is not None or filters['year_to'] is not None) and year_selected(value, filters)
+    selected = filters[FACET_FILTERS[facet]]
+    return selected is not None and value in selected
+
+def query_counts(cursor, filters):
+    """Counts every facet with one query over the base tables
+
+    Gets (total, {facet: [(value, name, count)]}) with only the values that have tracks.
+    """
+    cursor.execute(FACET_COUNTS_QUERY, filters)
+    total, counts = 0, {facet: [] for facet in FACETS}
+    for facet, value, name, count in cursor.fetchall():
+        if facet == 'total':
+            total = count
+        elif facet == 'type':
+            counts[facet].append((name, None, count))
+        else:
+            counts[facet].append((value, name, count))
+    return total, counts
+
+def format_facets(counts, filters):
+    """Lists the values of every facet by count (the selected values are always listed, even without tracks)"""
+    facets = {}
+    for facet in FACETS:
+        values = [(value, name, count) for value, name, count in counts[facet] if count]
+        # A selected value without tracks (e.g. a genre id that does not exist) is still listed, so it can be cleared
+        listed = {value for value, _, _ in values}
+        if facet in FACET_FILTERS:
+            for value in filters[FACET_FILTERS[facet]] or []:
+                if value not in listed:
+                    values.append((value, None, 0))
+        values.sort(key=lambda item: (-item[2], item[0]))
+        facets[facet] = []
+        for value, name, count in values:
+            entry = {FACET_KEYS[facet]: value, 'count': count, 'selected': is_selected(facet, value, filters)}
+            if facet in ('genre', 'nation'):
+                entry['name'] = name
+            facets[facet].append(entry)
+    return facets
+
+def make_bitmap(positions):
+    """Makes a bitmap (an int with one bit per track position) out of a list of positions"""
+    bits = bytearray(max(positions, default=-1) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+class FacetIndex:
+    """The tracks of every facet value as bitmaps, so a count is one AND and one popcount per value
+
+    Bit i is the track with the i-th smallest id when the bitmaps were read, and tracks inserted since take the next
+    positions. A write marks the tracks, albums, or artists it changed, and refresh() sets the bits of their tracks
+    again from the database; a write whose tracks are not known (or a track inserted out of id order) makes the
+    bitmaps stale until the next build.
+    """
+
+    def __init__(self):
+        self.track_ids = array('i')     # position -> track_id (sorted)
+        self.all_tracks = 0             # the positions of the tracks that are still there
+        self.bitmaps = {facet: {} for facet in FACETS}     # facet -> value -> bitmap
+        self.names = {facet: {} for facet in FACETS}       # facet -> value -> name (genres and nations)
+        self.dirty_tracks = set()
+        self.dirty_albums = set()
+        self.dirty_artists = set()
+        self.stale = False
+
+    def set_tracks(self, track_ids):
+        self.track_ids = array('i', track_ids or [])
+        self.all_tracks = (1 << len(self.track_ids)) - 1
+
+    def add(self, facet, value, name, positions):
+        self.bitmaps[facet][value] = make_bitmap(positions)
+        self.names[facet][value] = name
+
+    @property
+    def dirty(self):
+        return bool(self.dirty_tracks or self.dirty_albums or self.dirty_artists)
+
+    def position(self, track_id):
+        position = bisect.bisect_left(self.track_ids, track_id)
+        if position < len(self.track_ids) and self.track_ids[position] == track_id:
+            return position
+        return None
+
+    def mask(self, track_ids):
+        """Gets the bitmap of the tracks (the ones without a position are left out)"""
+        return make_bitmap([
+            position for position in map(self.position, track_ids) if position is not None
+        ])
+
+    def clear(self, mask):
+        """Takes the tracks out of every bitmap"""
+        keep = ~mask
+        for bitmaps in self.bitmaps.values():
+            for value, bitmap in bitmaps.items():
+                if bitmap & mask:
+                    bitmaps[value] = bitmap & keep
+        self.all_tracks &= keep
+
+    def take_dirty(self):
+        """Gets the marked rows for FACET_REFRESH_QUERY and unmarks them"""
+        marked = {
+            'track_ids': sorted(self.dirty_tracks),
+            'album_ids': sorted(self.dirty_albums),
+            'artist_ids': sorted(self.dirty_artists)
+        }
+        self.dirty_tracks, self.dirty_albums, self.dirty_artists = set(), set(), set()
+        return marked
+
+    def refresh(self, track_ids, rows):
+        """Sets the bits of the tracks read by FACET_REFRESH_QUERY (the marked track_ids it did not find are gone)"""
+        found = next((tracks for facet, _, _, tracks in rows if facet == 'tracks'), None) or []
+        for track_id in found:
+            if self.position(track_id) is None:
+                if self.track_ids and track_id < self.track_ids[-1]:
+                    self.stale = True
+                    return
+                self.track_ids.append(track_id)
+
+        self.clear(self.mask(set(track_ids) | set(found)))
+        self.all_tracks |= self.mask(found)
+        for facet, value, name, tracks in rows:
+            if facet != 'tracks':
+                key = name if facet == 'type' else value
+                self.bitmaps[facet][key] = self.bitmaps[facet].get(key, 0) | self.mask(tracks)
+                self.names[facet][key] = name
+
+    # /api/insert/music can also link the artist to a genre and to the album, which changes all of their tracks
+    def add_artist(self, artist_id, name):
+        self.dirty_artists.add(artist_id)
+
+    def add_album(self, album_id, name):
+        self.dirty_albums.add(album_id)
+
+    def add_track(self, track_id, name, album_id):
+        self.dirty_tracks.add(track_id)
+
+    def link_artist_track(self, artist_id, track_id):
+        self.dirty_tracks.add(track_id)
+
+    def remove_tracks(self, track_ids):
+        self.clear(self.mask(track_ids))
+
+    def remove_albums(self, album_ids):
+        # /api/delete/music removes their tracks too
+        pass
+
+    def remove_artists(self, artist_ids):
+        # /api/delete/music removes every track they are on and every album they are an artist of
+        pass
+
+    def apply_insert(self, table, row):
+        """Marks the tracks a row inserted through /api/insert can change (row is a dict of column -> value)"""
+        table = table.lower()
+        if table in ('track', 'artisttrack'):
+            self.dirty_tracks.add(row['track_id'])
+        elif table == 'artistalbum':
+            self.dirty_albums.add(row['album_id'])
+        elif table == 'artistgenre':
+            self.dirty_artists.add(row['artist_id'])
+
+    def apply_delete(self, table, rows):
+        """Follows rows deleted through /api/delete (rows are dicts of column -> value)"""
+        table = table.lower()
+        if table == 'track':
+            self.remove_tracks([row['track_id'] for row in rows])
+        elif table == 'artisttrack':
+            self.dirty_tracks.update(row['track_id'] for row in rows)
+        elif table == 'artistalbum':
+            self.dirty_albums.update(row['album_id'] for row in rows)
+        elif table == 'artistgenre':
+            self.dirty_artists.update(row['artist_id'] for row in rows)
+        elif table in ('genre', 'nation'):
+            for row in rows:
+                self.bitmaps[table].pop(row[f'{table}_id'], None)
+                self.names[table].pop(row[f'{table}_id'], None)
+        elif table in ('album', 'artist') and rows:
+            # Their tracks and links go with them (ON DELETE CASCADE), and which tracks those were is not known here
+            self.stale = True
+
+    def matching(self, facet, filters):
+        """Gets the tracks that match the filter of one facet (every track if it is not filtered)"""
+        bitmaps = self.bitmaps[facet]
+        if facet == 'release_year':
+            if filters['year_from'] is None and filters['year_to'] is None:
+                return self.all_tracks
+            selected = [year for year in bitmaps if year_selected(year, filters)]
+        else:
+            selected = filters[FACET_FILTERS[facet]]
+            if selected is None:
+                return self.all_tracks
+        tracks = 0
+        for value in selected:
+            tracks |= bitmaps.get(value, 0)
+        return tracks
+
+    def counts(self, filters):
+        """Counts every facet like query_counts() does"""
+        matching = {facet: self.matching(facet, filters) for facet in FACETS}
+        total_tracks = self.all_tracks
+        for tracks in matching.values():
+            total_tracks &= tracks
+
+        counts = {}
+        for facet in FACETS:
+            # The tracks that match every other facet
+            others = self.all_tracks
+            for other, tracks in matching.items():
+                if other != facet:
+                    others &= tracks
+            names = self.names[facet]
+            counts[facet] = [
+                (value, names[value], (bitmap & others).bit_count()) for value, bitmap in self.bitmaps[facet].items()
+            ]
+        return total_tracks.bit_count(), counts
+
+    def nbytes(self):
+        """Estimates the memory used by the bitmaps and the track ids"""
+        bitmaps = sum(sys.getsizeof(bitmap) for bitmaps in self.bitmaps.values() for bitmap in bitmaps.values())
+        return bitmaps + self.track_ids.itemsize * len(self.track_ids)
+
+    def stats(self):
+        nbytes = self.nbytes()
+        tracks = self.all_tracks.bit_count()
+        return {
+            'tracks': tracks,
+            'values': {facet: len(self.bitmaps[facet]) for facet in FACETS},
+            'memory_bytes': nbytes,
+            'memory_bytes_per_million_tracks': int(nbytes / tracks * 1000000) if tracks else None
+        }
+
+class FacetIndexManager(IndexManager):
+    """Owns the bitmaps: builds them in the background and keeps them up to date with the writes of this process
+
+    Writes mark the tracks they change, and a background refresh reads those tracks again (the counts come from the
+    query until it is done). The bitmaps are rebuilt after a write they cannot follow, and at least every ttl seconds
+    to see the writes of other server processes.
+    """
+
+    thread_name = 'facet-index-build'
+    label = 'facet index'
+
+    def __init__(self, ttl=300):
+        super().__init__()
+        self.ttl = ttl
+        self.connection = None     # (get_connection, release_connection) of the last build, for the refreshes
+        self.refreshing = False
+
+    @property
+    def expired(self):
+        return self.index is not None and time.monotonic() - self.built_monotonic >= self.ttl
+
+    @property
+    def fresh(self):
+        return self.index is not None and not self.index.stale and not self.index.dirty and not self.expired
+
+    @property
+    def needs_build(self):
+        """Whether the bitmaps can only be made fresh by a build that is not running yet"""
+        return not self.building and (self.index is None or self.index.stale or self.expired)
+
+    def load(self, conn):
+        # A named (server-side) cursor streams one facet value at a time
+        cursor = conn.cursor(name='facet_index_build')
+        cursor.itersize = 100
+        cursor.execute(FACET_INDEX_QUERY)
+        index = FacetIndex()
+        for facet, value, name, tracks in cursor:
+            if facet == 'tracks':
+                index.set_tracks(tracks)
+            else:
+                index.add(facet, name if facet == 'type' else value, name, tracks)
+        cursor.close()
+        conn.commit()
+        return index
+
+    def build(self, get_connection, release_connection):
+        super().build(get_connection, release_connection)
+        # The writes replayed on the new bitmaps marked tracks of their own
+        with self.lock:
+            self.catch_up()
+
+    def start_build(self, get_connection, release_connection):
+        self.connection = (get_connection, release_connection)
+        return super().start_build(get_connection, release_connection)
+
+    def apply(self, method, *args):
+        with self.lock:
+            super().apply(method, *args)
+            self.catch_up()
+
+    def catch_up(self):
+        """Starts a build if the bitmaps are stale, or a refresh if a write marked tracks (called with the lock)"""
+        if self.connection is None or self.index is None:
+            return
+        if self.index.stale:
+            if not self.building:
+                self.start_build(*self.connection)
+        elif self.index.dirty and not self.refreshing:
+            self.refreshing = True
+            thread = threading.Thread(target=self.run_refreshes, name='facet-index-refresh', daemon=True)
+            thread.start()
+
+    def run_refreshes(self):
+        try:
+            while self.refresh(*self.connection):
+                pass
+        except Exception as e:
+            with self.lock:
+                self.refreshing = False
+                # The marks of the failed read are lost, so the bitmaps wait for a build
+                if self.index is not None:
+                    self.index.stale = True
+                    self.catch_up()
+            print(f'Error refreshing {self.label}: {e}')
+
+    def refresh(self, get_connection, release_connection):
+        """Reads the tracks that writes marked again (gets False once none are left)
+
+        One refresh runs at a time, so an older read is never set over a newer one.
+        """
+        with self.lock:
+            index = self.index
+            if index is None or index.stale or not index.dirty:
+                self.refreshing = False
+                return False
+            marked = index.take_dirty()
+
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute(FACET_REFRESH_QUERY, marked)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()
+        finally:
+            release_connection(conn)
+
+        with self.lock:
+            index.refresh(marked['track_ids'], rows)
+            if index.stale:
+                self.catch_up()
+        return True
+
+    def counts(self, filters):
+        """Counts every facet from the bitmaps (None unless they are fresh)"""
+        with self.lock:
+            if not self.fresh:
+                return None
+            return self.index.counts(filters)
+
+    def stats(self):
+        with self.lock:
+            stats = super().stats()
+            stats.update({
+                'fresh': self.fresh,
+                'stale': self.index is not None and self.index.stale,
+                'refreshing': self.refreshing,
+            })
+            return stats
@@ -0,0 +1,176 @@
+"""Request metrics in the Prometheus text format (served at /api/metrics)
+
+The counters only take a lock and a few additions per request, so they are always on unless METRICS=0.
+"""
+import bisect
+import threading
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Queries per request buckets
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# Response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+def escape(value):
+    """Escapes a label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A value per label set that only goes up"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, label_values=(), amount=1):
+        """Adds to the counter (the caller holds the registry lock)"""
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def lines(self):
+        for label_values, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_number(value)}'
+
+class Histogram:
+    """Counts of observations per bucket, with their sum, per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}    # label values -> [count per bucket (the last one is +Inf), sum]
+
+    def observe(self, label_values, value):
+        """Records a value (the caller holds the registry lock)"""
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def lines(self):
+        for label_values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{format_number(float(bound))}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {format_number(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+class Gauge:
+    """Values read when the metrics are rendered: collect() gets [(label values, value)]
+
+    kind='counter' exposes a total kept somewhere else (e.g. the cache hits) as a counter.
+    """
+
+    def __init__(self, name, help_text, labels, collect, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def lines(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f'Error collecting {self.name}: {e}')
+            return
+        for label_values, value in values:
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_number(value)}'
+
+class Registry:
+    """Every metric of the server, rendered together"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Gets every metric in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f'# HELP {metric.name} {metric.help_text}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+class RequestMetrics:
+    """Latency, queries, database vs Python time, rows, and response size of every route"""
+
+    def __init__(self, registry, n_plus_one_threshold=10):
+        self.registry = registry
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.flagged_routes = set()
+        labels = ('route', 'method', 'status')
+        self.requests = registry.add(Counter(
+            'musedb_http_requests_total', 'Requests by route, method, and status code', labels))
+        self.duration = registry.add(Histogram(
+            'musedb_http_request_duration_seconds', 'Time to build the response', ('route', 'method')))
+        self.queries = registry.add(Histogram(
+            'musedb_db_queries_per_request', 'Queries run by one request', ('route',), QUERY_BUCKETS))
+        self.n_plus_one = registry.add(Counter(
+            'musedb_db_n_plus_one_requests_total',
+            f'Requests that ran more than {n_plus_one_threshold} queries (a query per row?)', ('route',)))
+        self.db_seconds = registry.add(Counter(
+            'musedb_db_time_seconds_total', 'Time spent running queries', ('route',)))
+        self.pool_wait_seconds = registry.add(Counter(
+            'musedb_pool_wait_seconds_total', 'Time spent getting a connection from the pool', ('route',)))
+        self.python_seconds = registry.add(Counter(
+            'musedb_python_time_seconds_total', 'Time spent outside of queries and pool waits', ('route',)))
+        self.rows = registry.add(Counter(
+            'musedb_db_rows_fetched_total', 'Rows returned by the queries', ('route',)))
+        self.response_bytes = registry.add(Histogram(
+            'musedb_http_response_bytes', 'Size of the response bodies (streamed bodies are not counted)',
+            ('route',), SIZE_BUCKETS))
+
+    def observe(self, route, method, status, seconds, stats, response_bytes):
+        """Records a finished request (stats is the query_stats.RequestStats of the request)"""
+        route_label = (route,)
+        flagged = False
+        with self.registry.lock:
+            self.requests.inc((route, method, str(status)))
+            self.duration.observe((route, method), seconds)
+            self.queries.observe(route_label, stats.queries)
+            self.db_seconds.inc(route_label, stats.db_seconds)
+            self.pool_wait_seconds.inc(route_label, stats.pool_wait_seconds)
+            self.python_seconds.inc(route_label, max(seconds - stats.db_seconds - stats.pool_wait_seconds, 0.0))
+            self.rows.inc(route_label, stats.rows)
+            if response_bytes is not None:
+                self.response_bytes.observe(route_label, response_bytes)
+            if stats.queries > self.n_plus_one_threshold:
+                self.n_plus_one.inc(route_label)
+                flagged = route not in self.flagged_routes
+                self.flagged_routes.add(route)
+        # Logged once per route
+        if flagged:
+            print(f'Warning: {method} {route} ran {stats.queries} queries in one request (a query per row?)')
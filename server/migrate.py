@@ -0,0 +1,194 @@
+"""Versioned database migrations: the SQL files in migrations/ are applied in order and recorded in schema_migrations.
+
+    cd server
+    python migrate.py              # applies the migrations that have not been applied yet
+    python migrate.py --status     # lists every migration and when it was applied
+
+The server can also apply them when it starts (DB_MIGRATE=1), and it always warns about missing indexes.
+"""
+import argparse
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+import psycopg2
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / 'migrations'
+
+# 001_search_trgm.sql -> version 1, name search_trgm
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Held while migrating, so two servers starting at the same time do not apply the same file twice
+MIGRATE_LOCK_ID = 7261530
+
+# Where the applied migrations are recorded - SQL Queries
+MIGRATIONS_TABLE = 'schema_migrations'
+CREATE_MIGRATIONS_TABLE_QUERY = f"""
+    CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+        version    INT PRIMARY KEY,
+        name       TEXT NOT NULL,
+        checksum   TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+APPLIED_MIGRATIONS_QUERY = f"SELECT version, checksum, applied_at FROM {MIGRATIONS_TABLE} ORDER BY version;"
+RECORD_MIGRATION_QUERY = f"INSERT INTO {MIGRATIONS_TABLE} (version, name, checksum) VALUES (%s, %s, %s);"
+
+# Indexes the queries rely on: (table, leading index columns as pg_get_indexdef prints them, migration that adds it)
+EXPECTED_INDEXES = [
+    ('track', ['album_id'], '003_foreign_key_indexes.sql'),
+    ('artisttrack', ['track_id'], '003_foreign_key_indexes.sql'),
+    ('artistalbum', ['album_id'], '003_foreign_key_indexes.sql'),
+    ('artistgenre', ['genre_id'], '003_foreign_key_indexes.sql'),
+    ('artist', ['nation_id'], '003_foreign_key_indexes.sql'),
+    ('nation', ['lower(name::text)'], '004_name_indexes.sql'),
+    ('genre', ['lower(name::text)'], '004_name_indexes.sql'),
+    ('artist', ['lower(name::text)'], '004_name_indexes.sql'),
+    ('album', ['lower(name::text)'], '004_name_indexes.sql'),
+    ('track', ['album_id', 'lower(name::text)'], '004_name_indexes.sql')
+]
+
+# The key columns of every valid index in the public schema - SQL Query
+INDEX_COLUMNS_QUERY = """
+    SELECT
+        t.relname AS table_name,
+        ARRAY(
+            SELECT pg_get_indexdef(i.indexrelid, k, true) FROM generate_series(1, i.indnkeyatts) AS k ORDER BY k
+        ) AS columns
+    FROM pg_index i
+    INNER JOIN pg_class t ON t.oid = i.indrelid
+    INNER JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = 'public'
+    AND i.indisvalid;
+"""
+
+class Migration:
+    """One SQL file in migrations/"""
+
+    def __init__(self, path):
+        match = MIGRATION_FILE.match(path.name)
+        self.path = path
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.sql = path.read_text()
+        self.checksum = hashlib.sha256(self.sql.encode('utf-8')).hexdigest()
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Gets the migrations in version order (raises ValueError if two files have the same version)"""
+    migrations = sorted(
+        (Migration(path) for path in Path(directory).iterdir() if MIGRATION_FILE.match(path.name)),
+        key=lambda migration: migration.version
+    )
+    for previous, migration in zip(migrations, migrations[1:]):
+        if previous.version == migration.version:
+            raise ValueError(f'{previous.path.name} and {migration.path.name} have the same version')
+    return migrations
+
+def applied_migrations(cursor):
+    """Gets {version: (checksum, applied_at)} of the migrations that were applied"""
+    cursor.execute(APPLIED_MIGRATIONS_QUERY)
+    return {version: (checksum, applied_at) for version, checksum, applied_at in cursor.fetchall()}
+
+def migrate(conn, directory=MIGRATIONS_DIR):
+    """Applies every migration that has not been applied yet, each in its own transaction, and gets their names
+
+    A failing migration is rolled back and raised, and the ones after it are not applied.
+    """
+    migrations = load_migrations(directory)
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_advisory_lock(%s);', (MIGRATE_LOCK_ID,))
+    try:
+        cursor.execute(CREATE_MIGRATIONS_TABLE_QUERY)
+        conn.commit()
+        applied = applied_migrations(cursor)
+        conn.commit()
+
+        done = []
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version][0] != migration.checksum:
+                    print(f'Warning: {migration.path.name} changed after it was applied (it is not applied again)')
+                continue
+            del conn.notices[:]
+            try:
+                cursor.execute(migration.sql)
+                cursor.execute(RECORD_MIGRATION_QUERY, (migration.version, migration.name, migration.checksum))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f'Error applying {migration.path.name}!')
+                raise
+            # Warnings raised by the migration (e.g. an optional extension that is not available)
+            for notice in conn.notices:
+                if notice.startswith('WARNING'):
+                    print(f'{migration.path.name}: {notice.strip()}')
+            print(f'Applied {migration.path.name}')
+            done.append(migration.path.name)
+        return done
+    finally:
+        cursor.execute('SELECT pg_advisory_unlock(%s);', (MIGRATE_LOCK_ID,))
+        conn.commit()
+        cursor.close()
+
+def migration_status(conn, directory=MIGRATIONS_DIR):
+    """Gets (file name, applied_at or None) of every migration"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL;', (MIGRATIONS_TABLE,))
+    applied = applied_migrations(cursor) if cursor.fetchone()[0] else {}
+    conn.rollback()
+    cursor.close()
+    return [
+        (migration.path.name, applied[migration.version][1] if migration.version in applied else None)
+        for migration in load_migrations(directory)
+    ]
+
+def missing_indexes(cursor):
+    """Gets (table, columns, migration) of every expected index that no index starts with"""
+    cursor.execute(INDEX_COLUMNS_QUERY)
+    indexed = {}
+    for table_name, columns in cursor.fetchall():
+        indexed.setdefault(table_name, []).append([column.lower() for column in columns])
+    return [
+        (table_name, columns, migration)
+        for table_name, columns, migration in EXPECTED_INDEXES
+        if not any(index[:len(columns)] == columns for index in indexed.get(table_name, []))
+    ]
+
+def check_indexes(conn):
+    """Prints a warning for every missing index (called when the server starts) and gets how many are missing"""
+    cursor = conn.cursor()
+    try:
+        missing = missing_indexes(cursor)
+    finally:
+        conn.rollback()
+        cursor.close()
+    for table_name, columns, migration in missing:
+        print(f"Warning: no index on {table_name} ({', '.join(columns)}), apply {migration} (python migrate.py)")
+    return len(missing)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--status', action='store_true', help='List the migrations instead of applying them')
+    args = parser.parse_args()
+
+    # Uses the same .env and connection settings as the server
+    import app as server
+    conn = psycopg2.connect(server.get_connection_string())
+    try:
+        if args.status:
+            for file_name, applied_at in migration_status(conn):
+                print(f"{file_name:<40} {applied_at.isoformat() if applied_at else 'pending'}")
+            return 0
+        if not migrate(conn):
+            print('No pending migrations')
+        check_indexes(conn)
+        return 0
+    except Exception as e:
+        print(e)
+        return 1
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+-- Trigram indexes for /api/search/music
+-- GIN trigram indexes let "name ILIKE '%q%'" use an index scan and give word_similarity() for ranking.
+-- If pg_trgm cannot be installed the server falls back to plain ILIKE ranking (see server/search.py).
+
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION
+    WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+        RAISE WARNING 'pg_trgm is not available (%), music search will use the ILIKE fallback', SQLERRM;
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS track_name_trgm_idx ON Track USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS album_name_trgm_idx ON Album USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS artist_name_trgm_idx ON Artist USING gin (name gin_trgm_ops);
+    END IF;
+END
+$$;
+
+-- Used to go from a matching album or artist to its tracks
+CREATE INDEX IF NOT EXISTS track_album_id_idx ON Track (album_id);
+CREATE INDEX IF NOT EXISTS artisttrack_track_id_idx ON ArtistTrack (track_id);
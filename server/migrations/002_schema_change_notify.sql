@@ -0,0 +1,23 @@
+-- Notifies the server (channel "schema_changed") after any DDL so it can drop its cached schema
+-- Event triggers need superuser rights; without them the server still reloads the schema after SCHEMA_CACHE_TTL.
+
+CREATE OR REPLACE FUNCTION notify_schema_changed() RETURNS event_trigger AS $$
+BEGIN
+    PERFORM pg_notify('schema_changed', tg_tag);
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    DROP EVENT TRIGGER IF EXISTS schema_changed_ddl;
+    CREATE EVENT TRIGGER schema_changed_ddl ON ddl_command_end
+        EXECUTE FUNCTION notify_schema_changed();
+
+    DROP EVENT TRIGGER IF EXISTS schema_changed_drop;
+    CREATE EVENT TRIGGER schema_changed_drop ON sql_drop
+        EXECUTE FUNCTION notify_schema_changed();
+EXCEPTION
+    WHEN insufficient_privilege THEN
+        RAISE WARNING 'Cannot create event triggers (%), schema changes will be picked up after the cache TTL', SQLERRM;
+END
+$$;
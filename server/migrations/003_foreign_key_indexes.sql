@@ -0,0 +1,9 @@
+-- Indexes on the referencing side of every foreign key
+-- The composite primary keys of the link tables lead with artist_id, so lookups by the other id (and the
+-- ON DELETE CASCADE from Track, Album, and Genre) had to scan the whole table.
+
+CREATE INDEX IF NOT EXISTS track_album_id_idx ON Track (album_id);
+CREATE INDEX IF NOT EXISTS artisttrack_track_id_idx ON ArtistTrack (track_id);
+CREATE INDEX IF NOT EXISTS artistalbum_album_id_idx ON ArtistAlbum (album_id);
+CREATE INDEX IF NOT EXISTS artistgenre_genre_id_idx ON ArtistGenre (genre_id);
+CREATE INDEX IF NOT EXISTS artist_nation_id_idx ON Artist (nation_id);
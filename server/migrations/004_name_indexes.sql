@@ -0,0 +1,11 @@
+-- Case-insensitive name indexes for the get-or-create lookups in /api/insert/music ("lower(name) = lower(%s)")
+-- They are plain indexes: names are not unique in the catalog (two artists can each have an album called
+-- "Greatest Hits", and two artists can have the same name), so /api/insert and /api/insert/bulk can add such rows.
+-- When a name matches several rows, the lookups take one of them.
+
+CREATE INDEX IF NOT EXISTS nation_lower_name_idx ON Nation (lower(name));
+CREATE INDEX IF NOT EXISTS genre_lower_name_idx ON Genre (lower(name));
+CREATE INDEX IF NOT EXISTS artist_lower_name_idx ON Artist (lower(name));
+CREATE INDEX IF NOT EXISTS album_lower_name_idx ON Album (lower(name));
+-- Tracks are looked up by name within their album
+CREATE INDEX IF NOT EXISTS track_album_id_lower_name_idx ON Track (album_id, lower(name));
@@ -0,0 +1,281 @@
+-- Denormalized track catalog for /api/tracks/joined and /api/search/music
+-- One row per track with its album and its artists, so both endpoints read one table instead of joining five.
+-- Statement-level triggers on the base tables recompute only the tracks a statement touched (never a full refresh),
+-- and server/catalog.py checks the catalog against the base tables.
+
+-- Every catalog row as it should be, computed from the base tables
+-- artists are the track artists and then the other album artists (by name), artist_names only the track artists
+CREATE OR REPLACE VIEW track_catalog_source AS
+SELECT
+    t.track_id,
+    t.name AS track_name,
+    t.length AS track_length,
+    a.album_id,
+    a.name AS album_name,
+    a.release_date AS album_release_date,
+    a.description AS album_description,
+    ARRAY(
+        SELECT ar.name
+        FROM Artist ar
+        INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+        WHERE at.track_id = t.track_id
+        ORDER BY ar.name, ar.artist_id
+    )::TEXT[] AS artist_names,
+    COALESCE((
+        SELECT jsonb_agg(
+            jsonb_build_object('artist_id', m.artist_id, 'name', m.name, 'type', m.type, 'description', m.description)
+            ORDER BY m.album_only, m.name, m.artist_id
+        )
+        FROM (
+            SELECT ar.artist_id, ar.name, ar.type, ar.description, false AS album_only
+            FROM Artist ar
+            INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+            WHERE at.track_id = t.track_id
+            UNION ALL
+            SELECT ar.artist_id, ar.name, ar.type, ar.description, true AS album_only
+            FROM Artist ar
+            INNER JOIN ArtistAlbum aa ON ar.artist_id = aa.artist_id
+            WHERE aa.album_id = t.album_id
+            AND NOT EXISTS (
+                SELECT 1 FROM ArtistTrack at WHERE at.track_id = t.track_id AND at.artist_id = ar.artist_id
+            )
+        ) m
+    ), '[]'::JSONB) AS artists,
+    -- The track artist names in one string, so a trigram index can find the artist matches
+    array_to_string(ARRAY(
+        SELECT ar.name
+        FROM Artist ar
+        INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+        WHERE at.track_id = t.track_id
+        ORDER BY ar.name, ar.artist_id
+    ), E'\n') AS artist_text
+FROM Track t
+INNER JOIN Album a ON t.album_id = a.album_id;
+
+CREATE TABLE IF NOT EXISTS track_catalog (
+    track_id           INT PRIMARY KEY,
+    track_name         VARCHAR(150) NOT NULL,
+    track_length       INTERVAL,
+    album_id           INT NOT NULL,
+    album_name         VARCHAR(100) NOT NULL,
+    album_release_date DATE,
+    album_description  TEXT,
+    artist_names       TEXT[] NOT NULL,
+    artists            JSONB NOT NULL,
+    artist_text        TEXT NOT NULL
+);
+
+-- Recomputes the catalog rows of some tracks (the rows of deleted tracks are removed)
+CREATE OR REPLACE FUNCTION refresh_track_catalog(track_ids INT[]) RETURNS void AS $$
+BEGIN
+    IF track_ids IS NULL OR cardinality(track_ids) = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO track_catalog
+    SELECT * FROM track_catalog_source WHERE track_id = ANY(track_ids)
+    ON CONFLICT (track_id) DO UPDATE SET
+        track_name = EXCLUDED.track_name,
+        track_length = EXCLUDED.track_length,
+        album_id = EXCLUDED.album_id,
+        album_name = EXCLUDED.album_name,
+        album_release_date = EXCLUDED.album_release_date,
+        album_description = EXCLUDED.album_description,
+        artist_names = EXCLUDED.artist_names,
+        artists = EXCLUDED.artists,
+        artist_text = EXCLUDED.artist_text
+    WHERE (track_catalog.*) IS DISTINCT FROM (EXCLUDED.*);
+    DELETE FROM track_catalog c
+    WHERE c.track_id = ANY(track_ids)
+    AND NOT EXISTS (SELECT 1 FROM Track t WHERE t.track_id = c.track_id);
+END
+$$ LANGUAGE plpgsql;
+
+-- Bulk loads can turn the triggers off for their session (SET musedb.track_catalog = 'defer')
+-- and then call refresh_track_catalog() once for the tracks they added
+CREATE OR REPLACE FUNCTION track_catalog_deferred() RETURNS boolean AS $$
+    SELECT current_setting('musedb.track_catalog', true) IS NOT DISTINCT FROM 'defer';
+$$ LANGUAGE sql STABLE;
+
+-- One trigger function per base table; the transition tables are only read by the branch of the statement's event
+CREATE OR REPLACE FUNCTION track_catalog_track_changed() RETURNS trigger AS $$
+BEGIN
+    IF track_catalog_deferred() THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_track_catalog(ARRAY(SELECT track_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        DELETE FROM track_catalog WHERE track_id IN (SELECT track_id FROM old_rows);
+    ELSE
+        PERFORM refresh_track_catalog(ARRAY(SELECT track_id FROM new_rows UNION SELECT track_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_catalog_album_changed() RETURNS trigger AS $$
+BEGIN
+    IF track_catalog_deferred() THEN
+        RETURN NULL;
+    END IF;
+    -- Only the columns the catalog copies (deleting an album deletes its tracks, which the Track trigger handles)
+    PERFORM refresh_track_catalog(ARRAY(
+        SELECT t.track_id
+        FROM new_rows n
+        INNER JOIN old_rows o ON o.album_id = n.album_id
+        INNER JOIN Track t ON t.album_id = n.album_id
+        WHERE (n.name, n.release_date, n.description) IS DISTINCT FROM (o.name, o.release_date, o.description)
+    ));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_catalog_artist_changed() RETURNS trigger AS $$
+BEGIN
+    IF track_catalog_deferred() THEN
+        RETURN NULL;
+    END IF;
+    -- Deleting an artist deletes its links, which the ArtistTrack and ArtistAlbum triggers handle
+    PERFORM refresh_track_catalog(ARRAY(
+        WITH changed AS (
+            SELECT n.artist_id
+            FROM new_rows n
+            INNER JOIN old_rows o ON o.artist_id = n.artist_id
+            WHERE (n.name, n.type, n.description) IS DISTINCT FROM (o.name, o.type, o.description)
+        )
+        SELECT at.track_id FROM ArtistTrack at WHERE at.artist_id IN (SELECT artist_id FROM changed)
+        UNION
+        SELECT t.track_id
+        FROM ArtistAlbum aa
+        INNER JOIN Track t ON t.album_id = aa.album_id
+        WHERE aa.artist_id IN (SELECT artist_id FROM changed)
+    ));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_catalog_artisttrack_changed() RETURNS trigger AS $$
+BEGIN
+    IF track_catalog_deferred() THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_track_catalog(ARRAY(SELECT DISTINCT track_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_track_catalog(ARRAY(SELECT DISTINCT track_id FROM old_rows));
+    ELSE
+        PERFORM refresh_track_catalog(ARRAY(SELECT track_id FROM new_rows UNION SELECT track_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_catalog_artistalbum_changed() RETURNS trigger AS $$
+BEGIN
+    IF track_catalog_deferred() THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_track_catalog(ARRAY(
+            SELECT t.track_id FROM Track t WHERE t.album_id IN (SELECT album_id FROM new_rows)
+        ));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_track_catalog(ARRAY(
+            SELECT t.track_id FROM Track t WHERE t.album_id IN (SELECT album_id FROM old_rows)
+        ));
+    ELSE
+        PERFORM refresh_track_catalog(ARRAY(
+            SELECT t.track_id
+            FROM Track t
+            WHERE t.album_id IN (SELECT album_id FROM new_rows UNION SELECT album_id FROM old_rows)
+        ));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- TRUNCATE has no transition tables, so it rebuilds the whole catalog
+CREATE OR REPLACE FUNCTION track_catalog_truncated() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM track_catalog;
+    INSERT INTO track_catalog SELECT * FROM track_catalog_source;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- A trigger with transition tables can only have one event, so every event gets its own trigger
+DROP TRIGGER IF EXISTS track_catalog_track_insert ON Track;
+CREATE TRIGGER track_catalog_track_insert AFTER INSERT ON Track
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_track_changed();
+DROP TRIGGER IF EXISTS track_catalog_track_update ON Track;
+CREATE TRIGGER track_catalog_track_update AFTER UPDATE ON Track
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_track_changed();
+DROP TRIGGER IF EXISTS track_catalog_track_delete ON Track;
+CREATE TRIGGER track_catalog_track_delete AFTER DELETE ON Track
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_track_changed();
+
+DROP TRIGGER IF EXISTS track_catalog_album_update ON Album;
+CREATE TRIGGER track_catalog_album_update AFTER UPDATE ON Album
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_album_changed();
+
+DROP TRIGGER IF EXISTS track_catalog_artist_update ON Artist;
+CREATE TRIGGER track_catalog_artist_update AFTER UPDATE ON Artist
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artist_changed();
+
+DROP TRIGGER IF EXISTS track_catalog_artisttrack_insert ON ArtistTrack;
+CREATE TRIGGER track_catalog_artisttrack_insert AFTER INSERT ON ArtistTrack
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artisttrack_changed();
+DROP TRIGGER IF EXISTS track_catalog_artisttrack_update ON ArtistTrack;
+CREATE TRIGGER track_catalog_artisttrack_update AFTER UPDATE ON ArtistTrack
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artisttrack_changed();
+DROP TRIGGER IF EXISTS track_catalog_artisttrack_delete ON ArtistTrack;
+CREATE TRIGGER track_catalog_artisttrack_delete AFTER DELETE ON ArtistTrack
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artisttrack_changed();
+
+DROP TRIGGER IF EXISTS track_catalog_artistalbum_insert ON ArtistAlbum;
+CREATE TRIGGER track_catalog_artistalbum_insert AFTER INSERT ON ArtistAlbum
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artistalbum_changed();
+DROP TRIGGER IF EXISTS track_catalog_artistalbum_update ON ArtistAlbum;
+CREATE TRIGGER track_catalog_artistalbum_update AFTER UPDATE ON ArtistAlbum
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artistalbum_changed();
+DROP TRIGGER IF EXISTS track_catalog_artistalbum_delete ON ArtistAlbum;
+CREATE TRIGGER track_catalog_artistalbum_delete AFTER DELETE ON ArtistAlbum
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_artistalbum_changed();
+
+DROP TRIGGER IF EXISTS track_catalog_truncate ON Track;
+CREATE TRIGGER track_catalog_truncate AFTER TRUNCATE ON Track
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_truncated();
+DROP TRIGGER IF EXISTS track_catalog_truncate ON ArtistTrack;
+CREATE TRIGGER track_catalog_truncate AFTER TRUNCATE ON ArtistTrack
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_truncated();
+DROP TRIGGER IF EXISTS track_catalog_truncate ON ArtistAlbum;
+CREATE TRIGGER track_catalog_truncate AFTER TRUNCATE ON ArtistAlbum
+    FOR EACH STATEMENT EXECUTE FUNCTION track_catalog_truncated();
+
+-- Fills the catalog from what is already there
+DELETE FROM track_catalog;
+INSERT INTO track_catalog SELECT * FROM track_catalog_source;
+
+-- Trigram indexes for the catalog search (same fallback as 001_search_trgm.sql when pg_trgm is missing)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS track_catalog_track_name_trgm_idx ON track_catalog USING gin (track_name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS track_catalog_album_name_trgm_idx ON track_catalog USING gin (album_name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS track_catalog_artist_text_trgm_idx ON track_catalog USING gin (artist_text gin_trgm_ops);
+    END IF;
+END
+$$;
+
+ANALYZE track_catalog;
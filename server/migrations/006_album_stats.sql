@@ -0,0 +1,85 @@
+-- Per-album track count and total track length for /api/artists/<id>/discography
+-- Statement-level triggers on Track add or subtract only the rows a statement changed (grouped per album),
+-- so keeping the numbers current never scans Track. refresh_album_stats() recomputes albums from scratch.
+
+CREATE TABLE IF NOT EXISTS album_stats (
+    album_id     INT PRIMARY KEY REFERENCES Album(album_id) ON DELETE CASCADE,
+    track_count  INT NOT NULL DEFAULT 0,
+    -- SUM(length) of the tracks; length_count tracks have a length (none means the sum is NULL, like SUM())
+    total_length INTERVAL NOT NULL DEFAULT '0',
+    length_count INT NOT NULL DEFAULT 0
+);
+
+-- Recomputes the stats of some albums from their tracks
+CREATE OR REPLACE FUNCTION refresh_album_stats(album_ids INT[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO album_stats (album_id, track_count, total_length, length_count)
+    SELECT a.album_id, COUNT(t.track_id), COALESCE(SUM(t.length), '0'), COUNT(t.length)
+    FROM Album a
+    LEFT JOIN Track t ON t.album_id = a.album_id
+    WHERE a.album_id = ANY(album_ids)
+    GROUP BY a.album_id
+    ON CONFLICT (album_id) DO UPDATE SET
+        track_count = EXCLUDED.track_count,
+        total_length = EXCLUDED.total_length,
+        length_count = EXCLUDED.length_count;
+END
+$$ LANGUAGE plpgsql;
+
+-- Adds the new rows and subtracts the old rows of a statement (an UPDATE does both, so moving a track works)
+CREATE OR REPLACE FUNCTION album_stats_track_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE album_stats s SET
+            track_count = s.track_count - d.track_count,
+            total_length = s.total_length - d.total_length,
+            length_count = s.length_count - d.length_count
+        FROM (
+            SELECT album_id, COUNT(*) AS track_count, COALESCE(SUM(length), '0') AS total_length, COUNT(length) AS length_count
+            FROM old_rows
+            GROUP BY album_id
+        ) d
+        WHERE s.album_id = d.album_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO album_stats AS s (album_id, track_count, total_length, length_count)
+        SELECT album_id, COUNT(*), COALESCE(SUM(length), '0'), COUNT(length)
+        FROM new_rows
+        GROUP BY album_id
+        ON CONFLICT (album_id) DO UPDATE SET
+            track_count = s.track_count + EXCLUDED.track_count,
+            total_length = s.total_length + EXCLUDED.total_length,
+            length_count = s.length_count + EXCLUDED.length_count;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION album_stats_track_truncated() RETURNS trigger AS $$
+BEGIN
+    UPDATE album_stats SET track_count = 0, total_length = '0', length_count = 0;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- A trigger with transition tables can only have one event, so every event gets its own trigger
+DROP TRIGGER IF EXISTS album_stats_track_insert ON Track;
+CREATE TRIGGER album_stats_track_insert AFTER INSERT ON Track
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION album_stats_track_changed();
+DROP TRIGGER IF EXISTS album_stats_track_update ON Track;
+CREATE TRIGGER album_stats_track_update AFTER UPDATE ON Track
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION album_stats_track_changed();
+DROP TRIGGER IF EXISTS album_stats_track_delete ON Track;
+CREATE TRIGGER album_stats_track_delete AFTER DELETE ON Track
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION album_stats_track_changed();
+DROP TRIGGER IF EXISTS album_stats_track_truncate ON Track;
+CREATE TRIGGER album_stats_track_truncate AFTER TRUNCATE ON Track
+    FOR EACH STATEMENT EXECUTE FUNCTION album_stats_track_truncated();
+
+-- Fills the stats from the tracks that are already there
+SELECT refresh_album_stats(ARRAY(SELECT album_id FROM Album));
+
+ANALYZE album_stats;
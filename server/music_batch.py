@@ -0,0 +1,190 @@
+from psycopg2.extras import execute_values
+
+# Most songs accepted by one /api/insert/music/batch request
+MAX_BATCH_SONGS = 10000
+
+class MusicBatchError(Exception):
+    """A problem with the whole batch (returned as a 400)"""
+
+def clean(value):
+    """Treats empty strings the same as missing values"""
+    return value if value not in ('', None) else None
+
+# Fields of a song that name a row (matched case-insensitively)
+NAME_FIELDS = ('song_name', 'artist_name', 'album_name', 'nation_name', 'genre_name')
+
+def fold_names(cursor, names):
+    """Gets {name: key} for some names, lower-cased by the database
+
+    The keys are made with SQL lower() (which differs from str.lower() for some characters, like 'İ'), so they
+    match the lower(name) comparisons of the single-song path and the name indexes exactly.
+    """
+    names = list(set(names))
+    if not names:
+        return {}
+    cursor.execute("SELECT v.name, lower(v.name) FROM unnest(%s::text[]) AS v(name);", (names,))
+    return dict(cursor.fetchall())
+
+def find_by_name(cursor, table, id_column, names):
+    """Gets {name key: id} for the rows that already exist (the lowest id wins if a name is repeated)"""
+    if not names:
+        return {}
+    # The keys come back as they were sent, so they always match the keys from fold_names()
+    cursor.execute(
+        f"""SELECT v.name, MIN(x.{id_column})
+            FROM unnest(%s::text[]) AS v(name)
+            INNER JOIN {table} x ON lower(x.name) = v.name
+            GROUP BY v.name;""",
+        (list(names),)
+    )
+    return dict(cursor.fetchall())
+
+def create_named(cursor, table, id_column, columns, rows):
+    """Inserts new named rows in one statement and gets {name key: id}"""
+    if not rows:
+        return {}
+    created = execute_values(
+        cursor,
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s RETURNING lower(name), {id_column};",
+        rows, page_size=len(rows), fetch=True
+    )
+    return dict(created)
+
+def get_or_create(cursor, table, id_column, columns, first_rows):
+    """Resolves every name to an id, creating the missing ones (first_rows maps each name key to its row values)"""
+    ids = find_by_name(cursor, table, id_column, first_rows.keys())
+    missing = [row for name, row in first_rows.items() if name not in ids]
+    created = create_named(cursor, table, id_column, columns, missing)
+    ids.update(created)
+    return ids, set(created)
+
+def link(cursor, table, columns, pairs):
+    """Inserts link rows that are not there yet"""
+    if not pairs:
+        return
+    execute_values(
+        cursor,
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT DO NOTHING;",
+        sorted(pairs), page_size=len(pairs)
+    )
+
+def insert_songs(cursor, songs):
+    """Inserts a list of songs with a fixed number of queries (the same get-or-create rules as /api/insert/music)
+
+    Returns one result per song, in order: {'success', 'message', 'track_id'} or {'success': False, 'error'}.
+    """
+    results = [None] * len(songs)
+    valid = []
+    for index, song in enumerate(songs):
+        if not isinstance(song, dict) or not all(
+            isinstance(song.get(k), str) and clean(song.get(k)) for k in ('song_name', 'artist_name', 'album_name')
+        ):
+            results[index] = {'success': False, 'error': 'Song name, artist name, and album name are required'}
+        else:
+            valid.append((index, song))
+
+    # Every name is matched by its key (see fold_names)
+    keys = fold_names(cursor, [
+        song[field] for _, song in valid for field in NAME_FIELDS if isinstance(clean(song.get(field)), str)
+    ])
+    key = keys.__getitem__
+
+    # The first song that mentions a name decides the values a new row is created with
+    nations, artists, genres, albums = {}, {}, {}, {}
+    for _, song in valid:
+        if clean(song.get('nation_name')):
+            nations.setdefault(key(song['nation_name']), (song['nation_name'], clean(song.get('nation_comment'))))
+        if clean(song.get('genre_name')):
+            genres.setdefault(key(song['genre_name']), (song['genre_name'], clean(song.get('genre_description'))))
+        albums.setdefault(key(song['album_name']), (
+            song['album_name'], clean(song.get('album_release_date')), clean(song.get('album_description'))
+        ))
+
+    # Handles Nations (get or create)
+    nation_ids, _ = get_or_create(cursor, 'Nation', 'nation_id', ['name', 'comment'], nations)
+
+    # Handles Artists -- new artists take the nation of the first song that names them
+    existing_artists = find_by_name(cursor, 'Artist', 'artist_id', {key(song['artist_name']) for _, song in valid})
+    fallback_nation_id = None
+    for _, song in valid:
+        name = key(song['artist_name'])
+        if name in existing_artists or name in artists:
+            continue
+        nation_id = nation_ids.get(key(song['nation_name'])) if clean(song.get('nation_name')) else None
+        if nation_id is None:
+            if fallback_nation_id is None:
+                # If nation not provided in request, try to find one in DB
+                cursor.execute("SELECT nation_id FROM Nation LIMIT 1;")
+                nation_row = cursor.fetchone()
+                if not nation_row:
+                    raise MusicBatchError('No nation found in database and none provided. Please add a nation.')
+                fallback_nation_id = nation_row[0]
+            nation_id = fallback_nation_id
+        artists[name] = (song['artist_name'], clean(song.get('artist_description')), nation_id)
+    artist_ids = dict(existing_artists)
+    artist_ids.update(create_named(cursor, 'Artist', 'artist_id', ['name', 'description', 'nation_id'], list(artists.values())))
+
+    # Handles Genres and links them to the artists
+    genre_ids, _ = get_or_create(cursor, 'Genre', 'genre_id', ['name', 'description'], genres)
+    link(cursor, 'ArtistGenre', ['artist_id', 'genre_id'], {
+        (artist_ids[key(song['artist_name'])], genre_ids[key(song['genre_name'])])
+        for _, song in valid if clean(song.get('genre_name'))
+    })
+
+    # Handles Albums and links them to the artists
+    album_ids, _ = get_or_create(cursor, 'Album', 'album_id', ['name', 'release_date', 'description'], albums)
+    link(cursor, 'ArtistAlbum', ['artist_id', 'album_id'], {
+        (artist_ids[key(song['artist_name'])], album_ids[key(song['album_name'])]) for _, song in valid
+    })
+
+    # Handles Tracks -- a track is the same song if it has the same name in the same album
+    tracks = {}
+    for _, song in valid:
+        track_key = (album_ids[key(song['album_name'])], key(song['song_name']))
+        tracks.setdefault(track_key, (song['song_name'], clean(song.get('track_length')), track_key[0]))
+
+    track_ids = {}
+    if tracks:
+        existing = execute_values(
+            cursor,
+            """SELECT v.album_id, v.name, MIN(t.track_id)
+               FROM Track t
+               INNER JOIN (VALUES %s) AS v(album_id, name) ON t.album_id = v.album_id AND lower(t.name) = v.name
+               GROUP BY v.album_id, v.name;""",
+            list(tracks.keys()), page_size=len(tracks), fetch=True
+        )
+        track_ids = {(album_id, name): track_id for album_id, name, track_id in existing}
+    already_there = set(track_ids)
+
+    missing = [row for track_key, row in tracks.items() if track_key not in track_ids]
+    if missing:
+        created = execute_values(
+            cursor,
+            "INSERT INTO Track (name, length, album_id) VALUES %s RETURNING album_id, lower(name), track_id;",
+            missing, page_size=len(missing), fetch=True
+        )
+        track_ids.update({(album_id, name): track_id for album_id, name, track_id in created})
+
+    # Link artists to tracks
+    link(cursor, 'ArtistTrack', ['artist_id', 'track_id'], {
+        (artist_ids[key(song['artist_name'])], track_ids[(album_ids[key(song['album_name'])], key(song['song_name']))])
+        for _, song in valid
+    })
+
+    # Per-song results: only the first song to create a track gets "inserted", like running them one by one
+    reported = set()
+    for index, song in valid:
+        track_key = (album_ids[key(song['album_name'])], key(song['song_name']))
+        if track_key in already_there or track_key in reported:
+            message = 'Song already exists in album'
+        else:
+            message = 'Song inserted successfully'
+            reported.add(track_key)
+        results[index] = {
+            'success': True,
+            'message': message,
+            'track_id': track_ids[track_key],
+            'artist_id': artist_ids[key(song['artist_name'])],
+            'album_id': track_key[0]
+        }
+    return results
@@ -0,0 +1,130 @@
+"""Set-based delete of a song, artist, or album (and everything that goes with it) in one statement
+
+The preview and the delete share the same target CTEs, so the preview counts are exactly what the delete removes.
+"""
+
+# Every row a delete type removes, by table: target_tracks, target_albums, and target_artists - SQL Queries
+TARGETS = {
+    'song': """
+        target_tracks AS (SELECT track_id FROM Track WHERE name ILIKE %(pattern)s),
+        target_albums AS (SELECT NULL::int AS album_id WHERE false),
+        target_artists AS (SELECT NULL::int AS artist_id WHERE false)""",
+    # The album's tracks go with it (Track.album_id is ON DELETE CASCADE)
+    'album': """
+        target_albums AS (SELECT album_id FROM Album WHERE name ILIKE %(pattern)s),
+        target_tracks AS (SELECT track_id FROM Track WHERE album_id IN (SELECT album_id FROM target_albums)),
+        target_artists AS (SELECT NULL::int AS artist_id WHERE false)""",
+    # The artist's albums (with their tracks) and the artist's tracks on any other album
+    'artist': """
+        target_artists AS (SELECT artist_id FROM Artist WHERE name ILIKE %(pattern)s),
+        target_albums AS (
+            SELECT DISTINCT album_id FROM ArtistAlbum WHERE artist_id IN (SELECT artist_id FROM target_artists)
+        ),
+        target_tracks AS (
+            SELECT track_id FROM Track WHERE album_id IN (SELECT album_id FROM target_albums)
+            UNION
+            SELECT track_id FROM ArtistTrack WHERE artist_id IN (SELECT artist_id FROM target_artists)
+        )"""
+}
+
+# Link rows that go with the targets (the ones ON DELETE CASCADE would remove)
+ARTIST_TRACKS_WHERE = """artist_id IN (SELECT artist_id FROM target_artists)
+    OR track_id IN (SELECT track_id FROM target_tracks)"""
+ARTIST_ALBUMS_WHERE = """artist_id IN (SELECT artist_id FROM target_artists)
+    OR album_id IN (SELECT album_id FROM target_albums)"""
+ARTIST_GENRES_WHERE = "artist_id IN (SELECT artist_id FROM target_artists)"
+
+# Order of the counts in both results
+BREAKDOWN_KEYS = ['artists', 'albums', 'tracks', 'artist_tracks', 'artist_albums', 'artist_genres']
+
+# Table each count is for
+BREAKDOWN_TABLES = {
+    'artists': 'Artist', 'albums': 'Album', 'tracks': 'Track',
+    'artist_tracks': 'ArtistTrack', 'artist_albums': 'ArtistAlbum', 'artist_genres': 'ArtistGenre'
+}
+
+# Table whose matching rows the preview shows
+PREVIEW_TABLES = {
+    'song': ('Track', 'track_id', 'target_tracks'),
+    'artist': ('Artist', 'artist_id', 'target_artists'),
+    'album': ('Album', 'album_id', 'target_albums')
+}
+
+def build_preview_query(delete_type):
+    """Builds the preview: the breakdown counts followed by the matching rows (one row of NULLs if nothing matches)"""
+    table, id_column, target = PREVIEW_TABLES[delete_type]
+    return f"""WITH {TARGETS[delete_type]},
+        counts AS (
+            SELECT
+                (SELECT COUNT(*) FROM target_artists) AS delete_artists,
+                (SELECT COUNT(*) FROM target_albums) AS delete_albums,
+                (SELECT COUNT(*) FROM target_tracks) AS delete_tracks,
+                (SELECT COUNT(*) FROM ArtistTrack WHERE {ARTIST_TRACKS_WHERE}) AS delete_artist_tracks,
+                (SELECT COUNT(*) FROM ArtistAlbum WHERE {ARTIST_ALBUMS_WHERE}) AS delete_artist_albums,
+                (SELECT COUNT(*) FROM ArtistGenre WHERE {ARTIST_GENRES_WHERE}) AS delete_artist_genres
+        )
+        SELECT counts.*, x.*
+        FROM counts
+        LEFT JOIN {table} x ON x.{id_column} IN (SELECT {id_column} FROM {target})
+        ORDER BY x.{id_column};"""
+
+def build_delete_query(delete_type):
+    """Builds the delete: every table is deleted from exactly once, and the result has the deleted ids and counts
+
+    The link rows are deleted explicitly (instead of left to ON DELETE CASCADE) so that RETURNING counts them too.
+    """
+    return f"""WITH {TARGETS[delete_type]},
+        deleted_artist_tracks AS (DELETE FROM ArtistTrack WHERE {ARTIST_TRACKS_WHERE} RETURNING 1),
+        deleted_artist_albums AS (DELETE FROM ArtistAlbum WHERE {ARTIST_ALBUMS_WHERE} RETURNING 1),
+        deleted_artist_genres AS (DELETE FROM ArtistGenre WHERE {ARTIST_GENRES_WHERE} RETURNING 1),
+        deleted_tracks AS (
+            DELETE FROM Track WHERE track_id IN (SELECT track_id FROM target_tracks) RETURNING track_id
+        ),
+        deleted_albums AS (
+            DELETE FROM Album WHERE album_id IN (SELECT album_id FROM target_albums) RETURNING album_id
+        ),
+        deleted_artists AS (
+            DELETE FROM Artist WHERE artist_id IN (SELECT artist_id FROM target_artists) RETURNING artist_id
+        )
+        SELECT
+            ARRAY(SELECT artist_id FROM deleted_artists ORDER BY artist_id),
+            ARRAY(SELECT album_id FROM deleted_albums ORDER BY album_id),
+            ARRAY(SELECT track_id FROM deleted_tracks ORDER BY track_id),
+            (SELECT COUNT(*) FROM deleted_artist_tracks),
+            (SELECT COUNT(*) FROM deleted_artist_albums),
+            (SELECT COUNT(*) FROM deleted_artist_genres);"""
+
+PREVIEW_QUERIES = {delete_type: build_preview_query(delete_type) for delete_type in TARGETS}
+DELETE_QUERIES = {delete_type: build_delete_query(delete_type) for delete_type in TARGETS}
+
+def params(delete_value):
+    """Gets the query parameters (names are matched the same way as before, anywhere in the name)"""
+    return {'pattern': f'%{delete_value}%'}
+
+def deleted_count(breakdown):
+    """Gets the number of records (artists, albums, and tracks) a breakdown removes"""
+    return breakdown['artists'] + breakdown['albums'] + breakdown['tracks']
+
+def changed_tables(breakdown):
+    """Gets the tables a delete removed rows from"""
+    return [BREAKDOWN_TABLES[key] for key in BREAKDOWN_KEYS if breakdown[key]]
+
+def preview(cursor, delete_type, delete_value):
+    """Gets (columns, type OIDs, rows, breakdown) of what a delete would remove"""
+    cursor.execute(PREVIEW_QUERIES[delete_type], params(delete_value))
+    columns = [desc[0] for desc in cursor.description][len(BREAKDOWN_KEYS):]
+    type_oids = [desc[1] for desc in cursor.description][len(BREAKDOWN_KEYS):]
+    result = cursor.fetchall()
+    breakdown = dict(zip(BREAKDOWN_KEYS, result[0][:len(BREAKDOWN_KEYS)]))
+    # The id is the first column of every table, and it is only NULL on the row the LEFT JOIN adds when nothing matches
+    rows = [row[len(BREAKDOWN_KEYS):] for row in result if row[len(BREAKDOWN_KEYS)] is not None]
+    return columns, type_oids, rows, breakdown
+
+def delete(cursor, delete_type, delete_value):
+    """Deletes and gets (artist ids, album ids, track ids, breakdown) of what was removed"""
+    cursor.execute(DELETE_QUERIES[delete_type], params(delete_value))
+    artist_ids, album_ids, track_ids, artist_tracks, artist_albums, artist_genres = cursor.fetchone()
+    breakdown = dict(zip(BREAKDOWN_KEYS, [
+        len(artist_ids), len(album_ids), len(track_ids), artist_tracks, artist_albums, artist_genres
+    ]))
+    return artist_ids, album_ids, track_ids, breakdown
@@ -0,0 +1,93 @@
+"""Queries, database time, rows, and pool wait of each request (for /api/metrics, and the X-Query-Count and
+X-DB-Time-Ms headers when QUERY_STATS=1), and the hook of the slow query log
+
+Every execute() on a pooled connection's cursor counts as one query, and the rows it returned count as fetched.
+Rows fetched later from a server-side (named) cursor, like the table streams, are not counted.
+The async server counts its asyncpg queries with record() too. The counters are kept in a context variable,
+so every thread (Flask) and every task (asyncio) has the ones of its own request.
+"""
+import contextvars
+import time
+
+import psycopg2.extensions
+
+# Counters of the request running in this thread or task (None outside of a request)
+request_stats = contextvars.ContextVar('request_stats', default=None)
+
+# Gets every query that takes at least its threshold (see slow_queries.py, None when the log is off)
+slow_query_log = None
+
+class RequestStats:
+    """Counters of one request"""
+
+    __slots__ = ('started', 'route', 'queries', 'db_seconds', 'rows', 'pool_wait_seconds')
+
+    def __init__(self, route=None):
+        self.started = time.perf_counter()
+        self.route = route
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+
+def start(route=None):
+    """Starts counting for the request running in this thread or task"""
+    request_stats.set(RequestStats(route))
+
+def current():
+    """Gets the counters of the request running in this thread or task (None outside of a request)"""
+    return request_stats.get()
+
+def record(seconds, rows=0):
+    """Counts one query that took the given time and returned the given number of rows"""
+    stats = request_stats.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_seconds += seconds
+    stats.rows += rows
+
+def record_pool_wait(seconds):
+    """Counts the time spent getting a connection from the pool"""
+    stats = request_stats.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+def check_slow(query, vars, seconds):
+    """Hands a query to the slow query log if it took at least the threshold"""
+    log = slow_query_log
+    if log is not None and seconds >= log.threshold:
+        stats = request_stats.get()
+        try:
+            log.observe(query, vars, seconds, stats.route if stats else None)
+        except Exception as e:
+            print(f'Error logging a slow query: {e}')
+
+def finish():
+    """Stops counting and gets the counters of the request (None if counting never started)"""
+    stats = request_stats.get()
+    request_stats.set(None)
+    return stats
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts and times every query it runs"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - started
+            # rowcount is the number of rows a query returned (client-side cursors fetch them all at once)
+            returned = self.rowcount if self.name is None and self.description is not None else 0
+            record(seconds, max(returned, 0))
+            check_slow(query, vars, seconds)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            seconds = time.perf_counter() - started
+            record(seconds)
+            check_slow(query, None, seconds)
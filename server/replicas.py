@@ -0,0 +1,182 @@
+"""Read replicas: a connection pool per replica, health and lag checks on a schedule, and the choice of replica
+
+A replica that cannot be reached, is not streaming from the primary, or whose replication lag is over max_lag is
+skipped until a later check finds it healthy again, so reads fall back to the primary when no replica is usable.
+A server that is not in recovery (e.g. another copy of the database, used as a simulated replica when testing
+locally) always has a lag of 0.
+"""
+import itertools
+import re
+import threading
+import time
+
+import psycopg2
+
+import db_pool
+
+# Replication lag in seconds, NULL for a standby that is not streaming from the primary - SQL Query
+# A standby that is streaming and has replayed everything it received is caught up, even if the primary has not
+# written in a while. Without a streaming WAL receiver (disconnected, or restoring from an archive) it has replayed
+# everything it received too, but nothing says how far behind the primary it is. The receiver's status is only
+# shown to roles with pg_read_all_stats, so a running receiver with a hidden status counts as streaming.
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status IS NULL OR status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::float8;
+"""
+
+# Hides the password of a DSN in the stats
+PASSWORD = re.compile(r'(password=)\S+|(://[^:/@]+:)[^@]+(@)')
+
+def redact_dsn(dsn):
+    """Gets a DSN without its password"""
+    return PASSWORD.sub(lambda m: f'{m.group(1)}***' if m.group(1) else f'{m.group(2)}***{m.group(3)}', dsn)
+
+class Replica:
+    """One replica and its pool"""
+
+    def __init__(self, name, dsn, pool):
+        self.name = name
+        self.dsn = dsn
+        self.pool = pool
+        self.healthy = False        # unknown until the first check
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self.reads = 0
+        self.failures = 0
+
+class ReplicaSet:
+    """The replicas reads can go to, checked every check_interval seconds in a background thread"""
+
+    def __init__(self, dsns, max_lag=5.0, check_interval=2.0, pool_kwargs=None):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [
+            Replica(f'replica{i}', dsn, db_pool.ConnectionPool(dsn, **(pool_kwargs or {})))
+            for i, dsn in enumerate(dsns, 1)
+        ]
+        self.order = itertools.cycle(self.replicas) if self.replicas else None
+        self.lock = threading.Lock()
+        self.checker = None
+        self.fallbacks = 0
+        self.last_write = 0.0       # time of the last write through this server (set by the app)
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def start(self):
+        """Checks every replica now and then keeps checking them in a background thread"""
+        if not self.replicas or self.checker is not None:
+            return
+        self.check_all()
+        self.checker = threading.Thread(target=self.run_checker, name='replica-check', daemon=True)
+        self.checker.start()
+
+    def run_checker(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check_all()
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def check(self, replica):
+        """Measures the lag of a replica and marks it healthy or not"""
+        conn = None
+        try:
+            conn = replica.pool.getconn(timeout=self.check_interval)
+            cursor = conn.cursor()
+            cursor.execute(REPLICA_LAG_QUERY)
+            lag = cursor.fetchone()[0]
+            cursor.close()
+            conn.rollback()
+            if lag is None:
+                error = 'not streaming from the primary (its lag is unknown)'
+            else:
+                error = None if lag <= self.max_lag else f'replication lag {lag:.1f}s is over {self.max_lag:g}s'
+        except Exception as e:
+            lag, error = None, str(e).strip()
+            if conn is not None:
+                replica.pool.putconn(conn, close=True)
+                conn = None
+        finally:
+            if conn is not None:
+                replica.pool.putconn(conn)
+        with self.lock:
+            if replica.healthy and error:
+                print(f'Skipping {replica.name}: {error}')
+            elif not replica.healthy and not error and replica.checked_at is not None:
+                print(f'{replica.name} is healthy again')
+            replica.healthy = error is None
+            replica.lag = lag
+            replica.error = error
+            replica.checked_at = time.time()
+
+    def candidates(self):
+        """Gets the replicas in the order to try them (the next one in turn first)"""
+        with self.lock:
+            return [next(self.order) for _ in self.replicas]
+
+    def getconn(self):
+        """Gets a connection from the next healthy replica (None if there is none, then the caller uses the primary)"""
+        for replica in self.candidates():
+            if not replica.healthy:
+                continue
+            try:
+                conn = replica.pool.getconn()
+            except (ConnectionError, psycopg2.Error) as e:
+                self.mark_failed(replica, e)
+                continue
+            self.record_read(replica)
+            return conn
+        self.record_fallback()
+        return None
+
+    def mark_failed(self, replica, error):
+        """Skips a replica that could not give a connection until the next check finds it healthy"""
+        with self.lock:
+            replica.healthy = False
+            replica.error = str(error).strip()
+            replica.failures += 1
+        print(f'Skipping {replica.name}: {replica.error}')
+
+    def record_read(self, replica):
+        with self.lock:
+            replica.reads += 1
+
+    def record_fallback(self):
+        with self.lock:
+            self.fallbacks += 1
+
+    def pool_of(self, conn):
+        """Gets the replica pool a connection came from (None for the primary's connections)"""
+        for replica in self.replicas:
+            if replica.pool.conn_info(conn) is not None:
+                return replica.pool
+        return None
+
+    def stats(self):
+        """Gets the health, lag, and usage of every replica"""
+        with self.lock:
+            replicas = [
+                {
+                    'name': replica.name,
+                    'dsn': redact_dsn(replica.dsn),
+                    'healthy': replica.healthy,
+                    'lag_seconds': replica.lag,
+                    'error': replica.error,
+                    'checked_at': replica.checked_at,
+                    'reads': replica.reads,
+                    'failures': replica.failures
+                }
+                for replica in self.replicas
+            ]
+            fallbacks = self.fallbacks
+        for replica, stats in zip(self.replicas, replicas):
+            stats['pool'] = replica.pool.stats()
+        return {'max_lag_seconds': self.max_lag, 'primary_fallbacks': fallbacks, 'replicas': replicas}
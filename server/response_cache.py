@@ -0,0 +1,158 @@
+import collections
+import hashlib
+import threading
+import time
+
+# Tag for responses that read every table (any write drops them)
+ALL_TABLES = '*'
+
+def tags(tables):
+    """Gets the tags of an entry read from the tables (None means every table)"""
+    if tables is None:
+        return frozenset([ALL_TABLES])
+    return frozenset(table.lower() for table in tables)
+
+class CachedResponse:
+    """A response body with everything needed to send it again"""
+
+    def __init__(self, body, mimetype, tables, expires_at):
+        self.body = body
+        self.mimetype = mimetype
+        self.tables = tables
+        self.expires_at = expires_at
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+class ResponseCache:
+    """Thread-safe LRU cache of response bodies, bounded by their total size in bytes
+
+    Every entry is tagged with the (lowercase) tables it was read from, so a write only drops the
+    responses that could have changed.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()    # key -> CachedResponse (least recently used first)
+        self.keys_by_table = {}                      # table -> keys of the entries that read it
+        self.nbytes = 0
+
+        # Bumped by every invalidation, so a response that was computed while a write committed is not stored
+        self.versions = {}
+        self.write_count = 0
+        self.clear_count = 0
+
+        # Counters for stats()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_skips = 0
+
+    def _remove(self, key):
+        """Removes an entry (the caller holds the lock)"""
+        entry = self.entries.pop(key)
+        self.nbytes -= len(entry.body)
+        for table in entry.tables:
+            keys = self.keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_table[table]
+        return entry
+
+    def get(self, key):
+        """Gets a fresh entry (or None) and marks it as recently used"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() >= entry.expires_at:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _version(self, tables):
+        """Gets the version of a set of tags (the caller holds the lock)"""
+        if ALL_TABLES in tables:
+            return (self.clear_count, self.write_count)
+        return (self.clear_count, tuple(self.versions.get(table, 0) for table in sorted(tables)))
+
+    def snapshot(self, tables):
+        """Gets the version of the tables (None means every table), taken before a response is computed from them"""
+        with self.lock:
+            return self._version(tags(tables))
+
+    def put(self, key, body, mimetype, tables, ttl, snapshot):
+        """Stores a response read from the tables (None means every table), unless one of them changed since the snapshot"""
+        tables = tags(tables)
+        entry = CachedResponse(body, mimetype, tables, time.monotonic() + ttl)
+        if len(body) > self.max_bytes:
+            return entry
+        with self.lock:
+            if self._version(tables) != snapshot:
+                self.stale_skips += 1
+                return entry
+
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.nbytes += len(body)
+            for table in tables:
+                self.keys_by_table.setdefault(table, set()).add(key)
+            self.stores += 1
+
+            # Evicts the least recently used entries until it fits
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, tables):
+        """Drops every entry that read one of the tables (and every entry that read all of them)"""
+        tables = {table.lower() for table in tables}
+        with self.lock:
+            self.write_count += 1
+            for table in tables:
+                self.versions[table] = self.versions.get(table, 0) + 1
+            keys = set(self.keys_by_table.get(ALL_TABLES, ()))
+            for table in tables:
+                keys.update(self.keys_by_table.get(table, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """Drops every entry (used when the schema changes)"""
+        with self.lock:
+            self.clear_count += 1
+            removed = len(self.entries)
+            self.entries.clear()
+            self.keys_by_table.clear()
+            self.nbytes = 0
+            self.invalidations += removed
+            return removed
+
+    def stats(self):
+        """Gets the size of the cache, its hit ratio, and how entries left it"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'stale_skips': self.stale_skips
+            }
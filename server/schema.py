@@ -0,0 +1,187 @@
+import select
+import threading
+import time
+
+# Notification channel the DDL event trigger sends on (see migrations/002_schema_change_notify.sql)
+SCHEMA_CHANNEL = 'schema_changed'
+
+# Every table in the public schema with its columns, in one catalog query - SQL Query
+# data_type is reported the same way information_schema.columns reports it
+SCHEMA_QUERY = """
+    SELECT
+        c.relname AS table_name,
+        a.attname AS column_name,
+        CASE
+            WHEN t.typcategory = 'A' THEN 'ARRAY'
+            WHEN t.typtype IN ('c', 'e', 'r', 'm') THEN 'USER-DEFINED'
+            ELSE format_type(COALESCE(NULLIF(t.typbasetype, 0), a.atttypid), NULL)
+        END AS data_type,
+        NOT a.attnotnull AS is_nullable,
+        a.attidentity <> '' AS is_identity
+    FROM pg_class c
+    INNER JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN pg_type t ON t.oid = a.atttypid
+    WHERE n.nspname = 'public'
+    AND c.relkind IN ('r', 'p')
+    AND c.relname NOT IN ('schema_migrations', 'track_catalog', 'album_stats')  -- bookkeeping and derived rows
+    ORDER BY c.relname, a.attnum;
+"""
+
+# Foreign keys whose ON DELETE action changes the referencing table (CASCADE, SET NULL, SET DEFAULT) - SQL Query
+CASCADE_QUERY = """
+    SELECT parent.relname AS parent_table, child.relname AS child_table
+    FROM pg_constraint con
+    INNER JOIN pg_class child ON child.oid = con.conrelid
+    INNER JOIN pg_class parent ON parent.oid = con.confrelid
+    INNER JOIN pg_namespace n ON n.oid = child.relnamespace
+    WHERE con.contype = 'f'
+    AND con.confdeltype IN ('c', 'n', 'd')
+    AND n.nspname = 'public';
+"""
+
+def quote_ident(name):
+    """Quotes a table or column name for use in SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+class TableInfo:
+    """A table's name and its columns (in table order)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = []
+        self.columns_by_name = {}
+
+    def add_column(self, column_name, data_type, is_nullable, is_identity):
+        column = {
+            'column_name': column_name,
+            'data_type': data_type,
+            'is_nullable': is_nullable,
+            'is_identity': is_identity
+        }
+        self.columns.append(column)
+        self.columns_by_name[column_name.lower()] = column
+
+    def resolve_column(self, column_name):
+        """Gets the real name of a column (case-insensitive), or None if the table does not have it"""
+        column = self.columns_by_name.get(column_name.lower()) if column_name else None
+        return column['column_name'] if column else None
+
+    @property
+    def column_types(self):
+        return {col['column_name']: col['data_type'] for col in self.columns}
+
+    @property
+    def identity_columns(self):
+        return {col['column_name'] for col in self.columns if col['is_identity']}
+
+class SchemaRegistry:
+    """Process-wide cache of the table and column names (reloaded after the TTL, on request, or on DDL)"""
+
+    def __init__(self, get_connection, release_connection, ttl=300, on_invalidate=None):
+        self.get_connection = get_connection
+        self.release_connection = release_connection
+        self.ttl = ttl
+        self.on_invalidate = on_invalidate
+        self.tables = None
+        self.dependents = {}    # table -> tables that a delete from it cascades to
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def load(self):
+        """Reads every table and column, and the foreign keys that cascade deletes"""
+        conn = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute(SCHEMA_QUERY)
+            tables = {}
+            for table_name, column_name, data_type, is_nullable, is_identity in cursor.fetchall():
+                table = tables.get(table_name.lower())
+                if table is None:
+                    table = tables[table_name.lower()] = TableInfo(table_name)
+                if column_name is not None:
+                    table.add_column(column_name, data_type, is_nullable, is_identity)
+            cursor.execute(CASCADE_QUERY)
+            dependents = {}
+            for parent_table, child_table in cursor.fetchall():
+                dependents.setdefault(parent_table.lower(), set()).add(child_table.lower())
+            cursor.close()
+            conn.commit()
+        finally:
+            self.release_connection(conn)
+
+        with self.lock:
+            self.tables = tables
+            self.dependents = dependents
+            self.loaded_at = time.monotonic()
+        return tables
+
+    def get_tables(self):
+        """Gets the cached tables, reloading them if they have expired"""
+        tables = self.tables
+        if tables is None or time.monotonic() - self.loaded_at > self.ttl:
+            tables = self.load()
+        return tables
+
+    def invalidate(self):
+        """Forgets the cached tables (the next lookup reloads them)"""
+        with self.lock:
+            self.tables = None
+        if self.on_invalidate:
+            self.on_invalidate()
+
+    def table_names(self):
+        """Gets every table name in alphabetical order"""
+        return sorted(table.name for table in self.get_tables().values())
+
+    def get_table(self, table_name):
+        """Gets a table by name (case-insensitive), or None if there is no such table"""
+        if not table_name:
+            return None
+        return self.get_tables().get(table_name.lower())
+
+    def with_dependents(self, table_names):
+        """Gets the (lowercase) tables plus every table that deleting from them can change through ON DELETE actions"""
+        self.get_tables()
+        dependents = self.dependents
+        found = set()
+        pending = [name.lower() for name in table_names]
+        while pending:
+            table = pending.pop()
+            if table not in found:
+                found.add(table)
+                pending.extend(dependents.get(table, ()))
+        return found
+
+    def start_listener(self, connect, reconnect_delay=5):
+        """Listens for DDL notifications on a dedicated connection and invalidates the cache when one arrives"""
+        def run():
+            while True:
+                conn = None
+                try:
+                    conn = connect()
+                    conn.autocommit = True
+                    conn.cursor().execute(f'LISTEN {SCHEMA_CHANNEL};')
+                    while True:
+                        # Wait for a notification (the timeout just keeps the connection checked)
+                        if select.select([conn], [], [], 60) == ([], [], []):
+                            conn.cursor().execute('SELECT 1;')
+                            continue
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self.invalidate()
+                except Exception as e:
+                    print(f'Error listening for schema changes: {e}')
+                finally:
+                    if conn is not None:
+                        conn.close()
+                # Anything could have changed while the listener was down
+                self.invalidate()
+                time.sleep(reconnect_delay)
+
+        self.listener = threading.Thread(target=run, name='schema-listener', daemon=True)
+        self.listener.start()
+        return self.listener
@@ -0,0 +1,189 @@
+import time
+
+# Default and max number of results for /api/search/music
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# How often to re-check whether pg_trgm is installed (in seconds)
+TRGM_CHECK_TTL = 300
+
+# Whether pg_trgm was found, and when it was last checked
+trgm_state = {'available': None, 'checked_at': 0.0}
+
+# Relevance of a match (trigram word similarity when pg_trgm is installed) -- track names rank above artists and albums
+TRGM_SCORE = "word_similarity(%(query)s, {column}) * {weight}"
+
+# Relevance without pg_trgm: exact name match, then prefix match, then any substring match
+FALLBACK_SCORE = (
+    "(CASE WHEN lower({column}) = lower(%(query)s) THEN 1.0 "
+    "WHEN {column} ILIKE %(prefix)s THEN 0.75 ELSE 0.5 END) * {weight}"
+)
+
+# Columns of a search result (the artist names are aggregated per track)
+TRACK_COLUMNS = """
+        t.track_id,
+        t.name AS track_name,
+        t.length AS track_length,
+        a.album_id,
+        a.name AS album_name,
+        a.release_date AS album_release_date,
+        ARRAY(
+            SELECT ar.name
+            FROM Artist ar
+            INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+            WHERE at.track_id = t.track_id
+            ORDER BY ar.name
+        ) AS artists"""
+
+# Search across tracks, artists, and albums - SQL Query
+# Each branch can use the trigram index on its name column, and the artist names are aggregated per track
+SEARCH_QUERY = """
+    WITH matches AS (
+        SELECT t.track_id, {track_score} AS score
+        FROM Track t
+        WHERE t.name ILIKE %(pattern)s
+        UNION ALL
+        SELECT t.track_id, {album_score} AS score
+        FROM Album a
+        INNER JOIN Track t ON t.album_id = a.album_id
+        WHERE a.name ILIKE %(pattern)s
+        UNION ALL
+        SELECT at.track_id, {artist_score} AS score
+        FROM Artist ar
+        INNER JOIN ArtistTrack at ON ar.artist_id = at.artist_id
+        WHERE ar.name ILIKE %(pattern)s
+    ),
+    ranked AS (
+        SELECT track_id, MAX(score) AS score
+        FROM matches
+        GROUP BY track_id
+        ORDER BY score DESC, track_id
+        LIMIT %(limit)s
+    )
+    SELECT {track_columns}
+    FROM ranked r
+    INNER JOIN Track t ON t.track_id = r.track_id
+    INNER JOIN Album a ON t.album_id = a.album_id
+    ORDER BY r.score DESC, t.name, a.name;
+"""
+
+# Search the denormalized catalog (migrations/005_track_catalog.sql) - SQL Query
+# Same matches, scores, and order as SEARCH_QUERY, but from one table (artist_text finds the artist matches with its
+# index, then one of the artist names has to match too, so every row that is kept has a score before the limit)
+CATALOG_SEARCH_QUERY = """
+    WITH ranked AS (
+        SELECT c.*, GREATEST(
+            CASE WHEN c.track_name ILIKE %(pattern)s THEN {track_score} END,
+            CASE WHEN c.album_name ILIKE %(pattern)s THEN {album_score} END,
+            (SELECT MAX({artist_score}) FROM unnest(c.artist_names) AS n(name) WHERE n.name ILIKE %(pattern)s)
+        ) AS score
+        FROM track_catalog c
+        WHERE c.track_name ILIKE %(pattern)s
+        OR c.album_name ILIKE %(pattern)s
+        OR (
+            c.artist_text ILIKE %(pattern)s
+            AND EXISTS (SELECT 1 FROM unnest(c.artist_names) AS n(name) WHERE n.name ILIKE %(pattern)s)
+        )
+        ORDER BY score DESC, track_id
+        LIMIT %(limit)s
+    )
+    SELECT {catalog_columns}
+    FROM ranked
+    ORDER BY score DESC, track_name, album_name;
+"""
+
+# Columns of a search result from the catalog
+CATALOG_COLUMNS = "track_id, track_name, track_length, album_id, album_name, album_release_date, artist_names"
+
+# Get the result rows for tracks already matched by the in-memory index - SQL Query
+HYDRATE_QUERY = """
+    SELECT {track_columns}
+    FROM Track t
+    INNER JOIN Album a ON t.album_id = a.album_id
+    WHERE t.track_id = ANY(%s);
+""".format(track_columns=TRACK_COLUMNS)
+CATALOG_HYDRATE_QUERY = f"""
+    SELECT {CATALOG_COLUMNS}
+    FROM track_catalog
+    WHERE track_id = ANY(%s);
+"""
+
+def build_search_query(use_trigram):
+    """Builds the search query with either the trigram or the fallback relevance scores"""
+    score = TRGM_SCORE if use_trigram else FALLBACK_SCORE
+    return SEARCH_QUERY.format(
+        track_columns=TRACK_COLUMNS,
+        track_score=score.format(column='t.name', weight='1.0'),
+        album_score=score.format(column='a.name', weight='0.8'),
+        artist_score=score.format(column='ar.name', weight='0.9'),
+    )
+
+def build_catalog_search_query(use_trigram):
+    """Builds the catalog search query with either the trigram or the fallback relevance scores"""
+    score = TRGM_SCORE if use_trigram else FALLBACK_SCORE
+    return CATALOG_SEARCH_QUERY.format(
+        catalog_columns=CATALOG_COLUMNS,
+        track_score=score.format(column='c.track_name', weight='1.0'),
+        album_score=score.format(column='c.album_name', weight='0.8'),
+        artist_score=score.format(column='n.name', weight='0.9'),
+    )
+
+# Both versions of the search queries, built once (so they can be prepared)
+SEARCH_QUERIES = {True: build_search_query(True), False: build_search_query(False)}
+CATALOG_SEARCH_QUERIES = {True: build_catalog_search_query(True), False: build_catalog_search_query(False)}
+
+# Whether pg_trgm is installed - SQL Query
+TRGM_CHECK_QUERY = "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');"
+
+def trigram_check_due():
+    """Whether pg_trgm has not been checked for yet (or was checked too long ago)"""
+    return trgm_state['available'] is None or time.monotonic() - trgm_state['checked_at'] > TRGM_CHECK_TTL
+
+def store_trigram_support(available):
+    """Remembers whether pg_trgm is installed"""
+    trgm_state['available'] = bool(available)
+    trgm_state['checked_at'] = time.monotonic()
+    return trgm_state['available']
+
+def has_trigram_support(cursor):
+    """Checks (and caches) whether the pg_trgm extension is installed"""
+    if trigram_check_due():
+        cursor.execute(TRGM_CHECK_QUERY)
+        store_trigram_support(cursor.fetchone()[0])
+    return trgm_state['available']
+
+def parse_limit(value):
+    """Reads the result limit from the request (raises ValueError if it is not a positive number)"""
+    if value is None:
+        return DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be a positive number')
+    return min(limit, MAX_LIMIT)
+
+def search_params(search_query, limit):
+    """Gets the parameters of the search query"""
+    return {
+        'query': search_query,
+        'pattern': f'%{search_query}%',
+        'prefix': f'{search_query}%',
+        'limit': limit,
+    }
+
+def search_tracks(cursor, search_query, limit=DEFAULT_LIMIT, use_catalog=False):
+    """Runs the music search and returns the rows ranked by relevance"""
+    queries = CATALOG_SEARCH_QUERIES if use_catalog else SEARCH_QUERIES
+    cursor.execute(queries[has_trigram_support(cursor)], search_params(search_query, limit))
+    return cursor.fetchall()
+
+def hydrate_tracks(cursor, ranked, use_catalog=False):
+    """Gets the result rows for (track_id, score) matches from the in-memory index, ordered like search_tracks"""
+    if not ranked:
+        return []
+    cursor.execute(CATALOG_HYDRATE_QUERY if use_catalog else HYDRATE_QUERY, ([track_id for track_id, _ in ranked],))
+    return order_hydrated(cursor.fetchall(), ranked)
+
+def order_hydrated(rows, ranked):
+    """Orders hydrated rows by score, then track name and album name (the same order as the database search)"""
+    scores = dict(ranked)
+    return sorted(rows, key=lambda row: (-scores[row[0]], row[1], row[4]))
@@ -0,0 +1,391 @@
+from array import array
+import bisect
+import heapq
+import sys
+import threading
+import time
+
+# Length of the n-grams in the postings lists
+NGRAM = 3
+
+# Relevance of a name match -- same scale as the ILIKE fallback in search.py
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.75
+SUBSTRING_SCORE = 0.5
+
+# Weights for each kind of name -- same as the database search
+TRACK_WEIGHT = 1.0
+ARTIST_WEIGHT = 0.9
+ALBUM_WEIGHT = 0.8
+
+# Tables whose rows are kept in the index
+INDEXED_TABLES = {'track', 'album', 'artist', 'artisttrack'}
+
+# One bulk read of every name and artist/track link - SQL Query
+BULK_QUERY = """
+    SELECT 'track', track_id, name, album_id FROM Track
+    UNION ALL
+    SELECT 'album', album_id, name, NULL FROM Album
+    UNION ALL
+    SELECT 'artist', artist_id, name, NULL FROM Artist
+    UNION ALL
+    SELECT 'artisttrack', artist_id, NULL, track_id FROM ArtistTrack;
+"""
+
+def normalize(name):
+    """Lower-cases a name the same way ILIKE compares it"""
+    return name.lower() if name else ''
+
+def ngrams(text):
+    """Gets the distinct n-grams of some (normalized) text"""
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+def score_match(name, needle):
+    """Scores a name against the search text (None if the text is not in the name)"""
+    if needle not in name:
+        return None
+    if name == needle:
+        return EXACT_SCORE
+    if name.startswith(needle):
+        return PREFIX_SCORE
+    return SUBSTRING_SCORE
+
+def insort_unique(values, value):
+    """Adds a value to a sorted array (False if it is already there)"""
+    index = bisect.bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        return False
+    values.insert(index, value)
+    return True
+
+def remove_sorted(values, value):
+    """Removes a value from a sorted array (False if it is not there)"""
+    index = bisect.bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
+        return True
+    return False
+
+def _array_bytes(arrays):
+    """Gets the memory used by some arrays (including the array objects themselves)"""
+    return sum(sys.getsizeof(a) for a in arrays)
+
+class NameTable:
+    """N-gram postings over the names of one kind of row (tracks, albums, or artists)"""
+
+    def __init__(self):
+        self.ids = array('i')      # slot -> row id
+        self.names = []            # slot -> normalized name (None once the row is removed)
+        self.slots = {}            # row id -> slot
+        self.postings = {}         # n-gram -> array of slots (always ascending, slots are only appended)
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, row_id):
+        return row_id in self.slots
+
+    def add(self, row_id, name):
+        """Adds a row (does nothing if the row is already there)"""
+        if row_id in self.slots:
+            return
+        slot = len(self.ids)
+        normalized = normalize(name)
+        self.ids.append(row_id)
+        self.names.append(normalized)
+        self.slots[row_id] = slot
+        for gram in ngrams(normalized):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('I')
+            postings.append(slot)
+
+    def remove(self, row_id):
+        """Removes a row (its slot is left behind until the table is compacted)"""
+        slot = self.slots.pop(row_id, None)
+        if slot is None:
+            return
+        self.names[slot] = None
+        self.removed += 1
+        if self.removed > len(self.slots):
+            self.compact()
+
+    def compact(self):
+        """Rebuilds the postings without the removed slots"""
+        rows = [(self.ids[slot], name) for slot, name in enumerate(self.names) if name is not None]
+        self.__init__()
+        for row_id, name in rows:
+            self.add(row_id, name)
+
+    def lookup(self, needle):
+        """Yields (row id, score) for every row whose name contains the (normalized) search text"""
+        if len(needle) >= NGRAM:
+            # Only the rows in the rarest n-gram's postings can match, and each one is checked directly
+            candidates = None
+            for gram in ngrams(needle):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    return
+                if candidates is None or len(postings) < len(candidates):
+                    candidates = postings
+        else:
+            # Search text too short to have an n-gram, so every name is checked
+            candidates = range(len(self.names))
+
+        for slot in candidates:
+            name = self.names[slot]
+            if name is None:
+                continue
+            score = score_match(name, needle)
+            if score is not None:
+                yield self.ids[slot], score
+
+    def nbytes(self):
+        """Estimates the memory used by the table"""
+        total = sys.getsizeof(self.ids) + sys.getsizeof(self.names) + sys.getsizeof(self.slots)
+        total += sum(sys.getsizeof(name) for name in self.names if name is not None)
+        total += sys.getsizeof(self.postings) + sum(sys.getsizeof(gram) for gram in self.postings)
+        total += _array_bytes(self.postings.values())
+        return total
+
+class MusicSearchIndex:
+    """In-memory search over track, album, and artist names (answers the same question as search.py)"""
+
+    def __init__(self):
+        self.tracks = NameTable()
+        self.albums = NameTable()
+        self.artists = NameTable()
+        self.album_tracks = {}     # album_id -> array of track ids
+        self.artist_tracks = {}    # artist_id -> sorted array of track ids
+
+    def add_track(self, track_id, name, album_id):
+        if track_id in self.tracks:
+            return
+        self.tracks.add(track_id, name)
+        self.album_tracks.setdefault(album_id, array('i')).append(track_id)
+
+    def add_album(self, album_id, name):
+        self.albums.add(album_id, name)
+
+    def add_artist(self, artist_id, name):
+        self.artists.add(artist_id, name)
+
+    def link_artist_track(self, artist_id, track_id):
+        insort_unique(self.artist_tracks.setdefault(artist_id, array('i')), track_id)
+
+    def unlink_artist_track(self, artist_id, track_id):
+        track_ids = self.artist_tracks.get(artist_id)
+        if track_ids is not None:
+            remove_sorted(track_ids, track_id)
+
+    def load_artist_tracks(self, links):
+        """Adds the (artist_id, track_id) links of a bulk read (each link once, like ArtistTrack's primary key)"""
+        links.sort()
+        for artist_id, track_id in links:
+            self.artist_tracks.setdefault(artist_id, array('i')).append(track_id)
+
+    def remove_tracks(self, track_ids):
+        # Album and artist links to removed tracks are skipped when searching, and dropped when the album/artist goes
+        for track_id in track_ids:
+            self.tracks.remove(track_id)
+
+    def remove_albums(self, album_ids):
+        # Deleting an album cascades to its tracks
+        for album_id in album_ids:
+            self.albums.remove(album_id)
+            self.remove_tracks(self.album_tracks.pop(album_id, ()))
+
+    def remove_artists(self, artist_ids):
+        # Deleting an artist cascades to its ArtistTrack links (but not the tracks)
+        for artist_id in artist_ids:
+            self.artists.remove(artist_id)
+            self.artist_tracks.pop(artist_id, None)
+
+    def apply_insert(self, table, row):
+        """Adds a row inserted through /api/insert (row is a dict of column -> value)"""
+        table = table.lower()
+        if table == 'track':
+            self.add_track(row['track_id'], row['name'], row['album_id'])
+        elif table == 'album':
+            self.add_album(row['album_id'], row['name'])
+        elif table == 'artist':
+            self.add_artist(row['artist_id'], row['name'])
+        elif table == 'artisttrack':
+            self.link_artist_track(row['artist_id'], row['track_id'])
+
+    def apply_delete(self, table, rows):
+        """Removes rows deleted through /api/delete (rows are dicts of column -> value)"""
+        table = table.lower()
+        if table == 'track':
+            self.remove_tracks([row['track_id'] for row in rows])
+        elif table == 'album':
+            self.remove_albums([row['album_id'] for row in rows])
+        elif table == 'artist':
+            self.remove_artists([row['artist_id'] for row in rows])
+        elif table == 'artisttrack':
+            for row in rows:
+                self.unlink_artist_track(row['artist_id'], row['track_id'])
+
+    def search(self, text, limit):
+        """Gets the best (track_id, score) matches for the search text, best first"""
+        needle = normalize(text)
+        scores = {}
+
+        def offer(track_id, score):
+            if track_id in self.tracks and score > scores.get(track_id, 0.0):
+                scores[track_id] = score
+
+        for track_id, score in self.tracks.lookup(needle):
+            offer(track_id, score * TRACK_WEIGHT)
+        for artist_id, score in self.artists.lookup(needle):
+            for track_id in self.artist_tracks.get(artist_id, ()):
+                offer(track_id, score * ARTIST_WEIGHT)
+        for album_id, score in self.albums.lookup(needle):
+            for track_id in self.album_tracks.get(album_id, ()):
+                offer(track_id, score * ALBUM_WEIGHT)
+
+        # Best score first, then lowest track_id (same tie-break as the database search)
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def nbytes(self):
+        """Estimates the memory used by the index"""
+        total = self.tracks.nbytes() + self.albums.nbytes() + self.artists.nbytes()
+        for links in (self.album_tracks, self.artist_tracks):
+            total += sys.getsizeof(links) + _array_bytes(links.values())
+        return total
+
+    def stats(self):
+        """Gets the size of the index and its memory use (also scaled to a million tracks)"""
+        nbytes = self.nbytes()
+        track_count = len(self.tracks)
+        return {
+            'tracks': track_count,
+            'albums': len(self.albums),
+            'artists': len(self.artists),
+            'ngrams': len(self.tracks.postings) + len(self.albums.postings) + len(self.artists.postings),
+            'memory_bytes': nbytes,
+            'memory_bytes_per_million_tracks': int(nbytes / track_count * 1000000) if track_count else None,
+        }
+
+class IndexManager:
+    """Owns a live in-memory index: builds it in the background and applies writes to it once they commit
+
+    Subclasses read a new index in load(). Writes that commit while a build is running are kept and replayed on the
+    new index when it is swapped in (every update is idempotent).
+    """
+
+    # Name of the build thread, and what the build errors call the index
+    thread_name = 'index-build'
+    label = 'index'
+
+    def __init__(self):
+        self.index = None
+        self.lock = threading.RLock()
+        self.building = False
+        self.pending = None        # writes that commit while a build is running (replayed on the new index)
+        self.built_at = None
+        self.built_monotonic = None
+        self.build_seconds = None
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def load(self, conn):
+        """Reads a new index from the database"""
+        raise NotImplementedError
+
+    def build(self, get_connection, release_connection):
+        """Builds a new index from one bulk read and swaps it in"""
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+            self.pending = []
+
+        started = time.monotonic()
+        conn = None
+        try:
+            conn = get_connection()
+            index = self.load(conn)
+        except Exception:
+            with self.lock:
+                self.pending = None
+                self.building = False
+            raise
+        finally:
+            release_connection(conn)
+
+        with self.lock:
+            # Writes that committed during the bulk read are applied again, in the same critical section that
+            # swaps the index in, so a write is either replayed or applied to it
+            for method, args in self.pending:
+                getattr(index, method)(*args)
+            self.pending = None
+            self.building = False
+            self.index = index
+            self.built_at = time.time()
+            self.built_monotonic = time.monotonic()
+            self.build_seconds = self.built_monotonic - started
+
+    def start_build(self, get_connection, release_connection):
+        """Builds the index on a background thread"""
+        def run():
+            try:
+                self.build(get_connection, release_connection)
+            except Exception as e:
+                print(f'Error building {self.label}: {e}')
+        thread = threading.Thread(target=run, name=self.thread_name, daemon=True)
+        thread.start()
+        return thread
+
+    def apply(self, method, *args):
+        """Applies a committed write to the index (and remembers it if a build is running)"""
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((method, args))
+            if self.index is not None:
+                getattr(self.index, method)(*args)
+
+    def stats(self):
+        with self.lock:
+            stats = self.index.stats() if self.index is not None else {}
+            stats.update({
+                'ready': self.index is not None,
+                'building': self.building,
+                'built_at': self.built_at,
+                'build_seconds': self.build_seconds,
+            })
+            return stats
+
+class SearchIndexManager(IndexManager):
+    """Owns the live search index"""
+
+    thread_name = 'search-index-build'
+    label = 'search index'
+
+    def load(self, conn):
+        index = MusicSearchIndex()
+        # Server-side cursor so the rows are streamed instead of loaded all at once
+        cursor = conn.cursor(name='search_index_build')
+        cursor.itersize = 10000
+        cursor.execute(BULK_QUERY)
+        links = []
+        for kind, row_id, name, other_id in cursor:
+            if kind == 'track':
+                index.add_track(row_id, name, other_id)
+            elif kind == 'album':
+                index.add_album(row_id, name)
+            elif kind == 'artist':
+                index.add_artist(row_id, name)
+            else:
+                links.append((row_id, other_id))
+        cursor.close()
+        conn.commit()
+        index.load_artist_tracks(links)
+        return index
+
+    def search(self, text, limit):
+        with self.lock:
+            return self.index.search(text, limit)
@@ -0,0 +1,248 @@
+"""Row to JSON conversion with the converters picked once per result (from the column type OIDs) instead of per cell"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# Postgres type OIDs (from pg_type)
+BOOL_OID = 16
+BYTEA_OID = 17
+NAME_OID = 19
+INT8_OID = 20
+INT2_OID = 21
+INT4_OID = 23
+TEXT_OID = 25
+OID_OID = 26
+JSON_OID = 114
+FLOAT4_OID = 700
+FLOAT8_OID = 701
+BPCHAR_OID = 1042
+VARCHAR_OID = 1043
+DATE_OID = 1082
+TIME_OID = 1083
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+INTERVAL_OID = 1186
+TIMETZ_OID = 1266
+NUMERIC_OID = 1700
+UUID_OID = 2950
+JSONB_OID = 3802
+
+# Type names sent with columnar responses (other types are sent as their OID)
+TYPE_NAMES = {
+    BOOL_OID: 'boolean', BYTEA_OID: 'bytea', NAME_OID: 'name', INT8_OID: 'bigint', INT2_OID: 'smallint',
+    INT4_OID: 'integer', TEXT_OID: 'text', OID_OID: 'oid', JSON_OID: 'json', FLOAT4_OID: 'real',
+    FLOAT8_OID: 'double precision', BPCHAR_OID: 'character', VARCHAR_OID: 'character varying',
+    DATE_OID: 'date', TIME_OID: 'time', TIMESTAMP_OID: 'timestamp', TIMESTAMPTZ_OID: 'timestamptz',
+    INTERVAL_OID: 'interval', TIMETZ_OID: 'timetz', NUMERIC_OID: 'numeric', UUID_OID: 'uuid', JSONB_OID: 'jsonb'
+}
+
+# Response encodings and their media types
+MIMETYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+# Accept header media types -> (layout, encoding)
+ACCEPTED_TYPES = {
+    'application/json': ('rows', 'json'),
+    'application/vnd.musedb.columnar+json': ('columnar', 'json'),
+    'application/msgpack': ('columnar', 'msgpack'),
+    'application/x-msgpack': ('columnar', 'msgpack'),
+    'application/vnd.apache.arrow.stream': ('columnar', 'arrow')
+}
+
+class NotAcceptable(ValueError):
+    """The requested encoding needs a library that is not installed (returned as a 406)"""
+
+# Types the drivers already return as JSON values (they are passed through untouched)
+PASSTHROUGH_OIDS = frozenset({
+    BOOL_OID, NAME_OID, INT8_OID, INT2_OID, INT4_OID, TEXT_OID, OID_OID, JSON_OID,
+    FLOAT4_OID, FLOAT8_OID, BPCHAR_OID, VARCHAR_OID, JSONB_OID
+})
+
+# Uses orjson when it is installed, unless JSON_BACKEND=json
+USE_ORJSON = orjson is not None and os.getenv('JSON_BACKEND', 'orjson') != 'json'
+
+def format_interval(value):
+    """Converts the time to HH:MM:SS format"""
+    total_seconds = int(value.total_seconds())
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+def to_isoformat(value):
+    """Converts to ISO format string"""
+    return value.isoformat()
+
+def decode_bytes(value):
+    """Decodes bytes (bytea comes back as a memoryview from psycopg2 and as bytes from asyncpg)"""
+    return bytes(value).decode('utf-8', errors='ignore')
+
+def convert_any(value):
+    """Converts a value of a type without its own converter (checks the Python type, like serialize_value)"""
+    if hasattr(value, 'total_seconds'):
+        return format_interval(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_bytes(value)
+    return value
+
+CONVERTERS = {
+    INTERVAL_OID: format_interval,
+    DATE_OID: to_isoformat,
+    TIME_OID: to_isoformat,
+    TIMETZ_OID: to_isoformat,
+    TIMESTAMP_OID: to_isoformat,
+    TIMESTAMPTZ_OID: to_isoformat,
+    BYTEA_OID: decode_bytes,
+    NUMERIC_OID: str,
+    UUID_OID: str
+}
+
+def describe(description):
+    """Gets the column names and type OIDs from a psycopg2 cursor.description"""
+    return [col[0] for col in description], [col[1] for col in description]
+
+def column_converters(type_oids):
+    """Gets (column index, converter) for every column that needs converting"""
+    return [
+        (index, CONVERTERS.get(oid, convert_any))
+        for index, oid in enumerate(type_oids) if oid not in PASSTHROUGH_OIDS
+    ]
+
+def convert_columns(type_oids, rows):
+    """Converts the rows to one list of JSON values per column
+
+    The rows are converted a column at a time, so each converter is looked up once and runs in a list comprehension.
+    """
+    if not rows:
+        return [[] for _ in type_oids]
+    columns = [list(values) for values in zip(*rows)]
+    for index, converter in column_converters(type_oids):
+        columns[index] = [None if value is None else converter(value) for value in columns[index]]
+    return columns
+
+def convert_rows(type_oids, rows):
+    """Converts every row to a tuple of JSON values"""
+    if not rows or not column_converters(type_oids):
+        return rows
+    return list(zip(*convert_columns(type_oids, rows)))
+
+def rows_to_dicts(columns, type_oids, rows):
+    """Converts every row to a {column: JSON value} dictionary"""
+    return [dict(zip(columns, row)) for row in convert_rows(type_oids, rows)]
+
+def type_names(type_oids):
+    """Gets the name of each column type"""
+    return [TYPE_NAMES.get(oid, str(oid)) for oid in type_oids]
+
+def table_result(columns, type_oids, rows, layout='rows'):
+    """Builds a table response: {columns, rows, count}, or {columns, types, data, count} with one list per column"""
+    if layout == 'columnar':
+        return {
+            'columns': columns,
+            'types': type_names(type_oids),
+            'data': convert_columns(type_oids, rows),
+            'count': len(rows)
+        }
+    data = rows_to_dicts(columns, type_oids, rows)
+    return {
+        'columns': columns,
+        'rows': data,
+        'count': len(data)
+    }
+
+def parse_accept(accept):
+    """Gets the media types of an Accept header, best first"""
+    ranked = []
+    for position, part in enumerate((accept or '').split(',')):
+        media_type, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.strip() and quality > 0:
+            ranked.append((-quality, position, media_type.strip().lower()))
+    return [media_type for _, _, media_type in sorted(ranked)]
+
+def negotiate(layout=None, encoding=None, accept=None):
+    """Gets the (layout, encoding) of a table response from ?layout=, ?encoding= and the Accept header
+
+    Raises ValueError for unknown values, and NotAcceptable if the encoding's library is not installed.
+    """
+    accepted = next((ACCEPTED_TYPES[media_type] for media_type in parse_accept(accept) if media_type in ACCEPTED_TYPES), None)
+    if encoding is None:
+        encoding = accepted[1] if accepted else 'json'
+    if encoding not in MIMETYPES:
+        raise ValueError('Invalid encoding, must be json, msgpack, or arrow')
+    if layout is None:
+        if encoding == 'json':
+            layout = accepted[0] if accepted and accepted[1] == 'json' else 'rows'
+        else:
+            # Binary encodings are for machine readers, so they default to columns
+            layout = 'columnar'
+    if layout not in ('rows', 'columnar'):
+        raise ValueError('Invalid layout, must be rows or columnar')
+    if encoding == 'arrow' and layout != 'columnar':
+        raise ValueError('Arrow responses are always columnar')
+
+    if encoding == 'msgpack' and msgpack is None:
+        raise NotAcceptable('MessagePack responses need the msgpack package')
+    if encoding == 'arrow' and pyarrow is None:
+        raise NotAcceptable('Arrow responses need the pyarrow package')
+    return layout, encoding
+
+def encode(data, encoding='json'):
+    """Encodes already converted data as JSON or MessagePack bytes"""
+    if encoding == 'msgpack':
+        return msgpack.packb(data, default=str, use_bin_type=True)
+    return dumps(data)
+
+def arrow_array(oid, values):
+    """Builds an Arrow array from a column of database values (keeping dates, numbers, and intervals native)"""
+    if oid == BYTEA_OID:
+        values = [None if value is None else bytes(value) for value in values]
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # Values Arrow cannot type are sent as their JSON values
+        converter = CONVERTERS.get(oid, convert_any)
+        return pyarrow.array([None if value is None else str(converter(value)) for value in values])
+
+def encode_arrow(columns, type_oids, rows):
+    """Encodes one table as an Arrow IPC stream"""
+    values = list(zip(*rows)) if rows else [[] for _ in columns]
+    arrays = [arrow_array(oid, column) for oid, column in zip(type_oids, values)]
+    table = pyarrow.Table.from_arrays(arrays, names=columns)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def dumps(data):
+    """Encodes already converted data straight to JSON bytes"""
+    if USE_ORJSON:
+        return orjson.dumps(data, default=str)
+    return json.dumps(data, default=str, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
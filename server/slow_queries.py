@@ -0,0 +1,271 @@
+"""Slow query log: every query over a threshold is logged with its normalized SQL, redacted parameters, duration,
+and route, and a sampled fraction of them get their plan captured (listed at /api/admin/slow-queries)
+
+Plans come from re-running the query under EXPLAIN on a separate connection, in a background thread, inside a
+READ ONLY transaction that is rolled back. Only reads are re-run with ANALYZE (and BUFFERS); writes get a plain
+EXPLAIN, so a slow DELETE is never run twice. The plans are kept in a fixed number of files that are reused
+oldest first, so the log never grows past SLOW_QUERY_PLANS plans.
+"""
+import datetime
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from pathlib import Path
+
+import psycopg2
+
+# Normalizing SQL: comments, string and number literals, placeholders, and lists of them
+COMMENT = re.compile(r'--[^\n]*')
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+# Queries that can be explained, and the ones safe to re-run with ANALYZE (reads that do not write anything)
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES)\b', re.IGNORECASE)
+READ_ONLY = re.compile(r'^\s*(SELECT|WITH|VALUES)\b', re.IGNORECASE)
+WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+# Distinct queries kept in the offenders list (the ones with the least total time are dropped first)
+MAX_OFFENDERS = 500
+
+# Plan sequence numbers remembered per query
+PLANS_PER_QUERY = 5
+
+def normalize(sql):
+    """Gets the SQL with its literals and placeholders replaced by ? (queries that only differ in values match)"""
+    sql = COMMENT.sub(' ', sql)
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER.sub('?', sql)
+    sql = VALUE_LIST.sub('(?, ...)', sql)
+    return WHITESPACE.sub(' ', sql).strip().rstrip(';').strip()
+
+def fingerprint(normalized):
+    """Gets a short id of a normalized query"""
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+def redact(value):
+    """Gets the shape of a parameter without its value (e.g. '<str:12>')"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10:
+            return f'<{type(value).__name__}:{len(value)}>'
+        return [redact(item) for item in value]
+    if isinstance(value, (str, bytes)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+def explain_query(sql):
+    """Gets the EXPLAIN of a query and whether it runs the query (ANALYZE)"""
+    analyze = bool(READ_ONLY.match(sql)) and not WRITES.search(normalize(sql))
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    return f'EXPLAIN ({options}) {sql.strip()}', analyze
+
+class PlanRing:
+    """Plans on disk in a fixed number of files (plan-0000.json, ...), the oldest one overwritten first"""
+
+    def __init__(self, directory, size):
+        self.directory = Path(directory)
+        self.size = size
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        # Continues after the plans a previous run left behind
+        for path in self.directory.glob('plan-*.json') if self.directory.is_dir() else []:
+            try:
+                self.next_seq = max(self.next_seq, json.loads(path.read_text())['seq'] + 1)
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def path(self, seq):
+        return self.directory / f'plan-{seq % self.size:04d}.json'
+
+    def add(self, record):
+        """Stores a plan record and gets its sequence number"""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        record = dict(record, seq=seq)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(seq)
+        temp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        temp_path.write_text(json.dumps(record, default=str))
+        os.replace(temp_path, path)
+        return seq
+
+    def get(self, seq):
+        """Gets a stored plan record (None if it was overwritten or never stored)"""
+        try:
+            record = json.loads(self.path(seq).read_text())
+        except (OSError, ValueError):
+            return None
+        return record if record.get('seq') == seq else None
+
+class SlowQueryLog:
+    """Slow queries grouped by normalized SQL, and the worker that captures their plans"""
+
+    def __init__(self, connect, threshold_ms=250, sample_rate=0.1, plans_dir=None, max_plans=200,
+                 explain_timeout_ms=30000, resolve=None):
+        self.connect = connect              # () -> a new psycopg2 connection for EXPLAIN
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain_timeout_ms = explain_timeout_ms
+        self.resolve = resolve              # (query, vars) -> (the SQL to explain, its vars)
+        self.plans = PlanRing(plans_dir, max_plans) if plans_dir and max_plans > 0 else None
+        self.lock = threading.Lock()
+        self.offenders = {}                 # fingerprint -> counters of one normalized query
+        self.explain_queue = queue.Queue(maxsize=8)
+        self.worker = None
+        self.explains = 0
+        self.explain_failures = 0
+        self.explains_dropped = 0
+
+    def observe(self, query, vars, seconds, route):
+        """Records a query that took at least the threshold (called by the counting cursor)"""
+        if self.resolve:
+            query, vars = self.resolve(query, vars)
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        elif not isinstance(query, str):
+            # A psycopg2.sql.Composed query (cannot be turned into a string without a connection)
+            query = repr(query)
+        normalized = normalize(query)
+        key = fingerprint(normalized)
+        route = route or 'background'
+        params = redact(vars)
+        now = time.time()
+        with self.lock:
+            entry = self.offenders.get(key)
+            if entry is None:
+                if len(self.offenders) >= MAX_OFFENDERS:
+                    del self.offenders[min(self.offenders, key=lambda k: self.offenders[k]['total_seconds'])]
+                entry = self.offenders[key] = {
+                    'fingerprint': key,
+                    'query': normalized,
+                    'calls': 0,
+                    'total_seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'routes': {},
+                    'last_params': None,
+                    'last_seen': None,
+                    'plans': []
+                }
+            entry['calls'] += 1
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+            entry['last_params'] = params
+            entry['last_seen'] = now
+        print(f'Slow query ({seconds * 1000:.1f} ms) on {route}: {normalized} {json.dumps(params, default=str)}')
+
+        if self.plans and EXPLAINABLE.match(query) and random.random() < self.sample_rate:
+            self.start_worker()
+            try:
+                self.explain_queue.put_nowait((key, query, vars, seconds, route, params))
+            except queue.Full:
+                with self.lock:
+                    self.explains_dropped += 1
+
+    def start_worker(self):
+        if self.worker is None:
+            with self.lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self.run_worker, name='slow-query-explain', daemon=True)
+                    self.worker.start()
+
+    def run_worker(self):
+        """Captures the plans of the sampled queries, one at a time, on its own connection"""
+        conn = None
+        while True:
+            key, query, vars, seconds, route, params = self.explain_queue.get()
+            try:
+                if conn is None or conn.closed:
+                    conn = self.connect()
+                plan, analyzed = self.explain(conn, query, vars)
+                seq = self.plans.add({
+                    'fingerprint': key,
+                    'captured_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'route': route,
+                    'duration_ms': round(seconds * 1000, 3),
+                    'query': normalize(query),
+                    'params': params,
+                    'analyzed': analyzed,
+                    'plan': plan
+                })
+                with self.lock:
+                    self.explains += 1
+                    entry = self.offenders.get(key)
+                    if entry is not None:
+                        entry['plans'] = (entry['plans'] + [seq])[-PLANS_PER_QUERY:]
+            except Exception as e:
+                print(f'Error capturing the plan of a slow query: {e}')
+                with self.lock:
+                    self.explain_failures += 1
+                if conn is not None and not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        conn.close()
+
+    def explain(self, conn, query, vars):
+        """Gets the JSON plan of a query and whether it was run with ANALYZE (nothing it does is kept)"""
+        sql, analyzed = explain_query(query)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SET TRANSACTION READ ONLY;')
+            cursor.execute('SET LOCAL statement_timeout = %s;', (self.explain_timeout_ms,))
+            cursor.execute(sql, vars)
+            return cursor.fetchone()[0], analyzed
+        finally:
+            cursor.close()
+            conn.rollback()
+
+    def top(self, limit=20):
+        """Gets the queries with the most total time over the threshold, slowest first"""
+        with self.lock:
+            entries = sorted(self.offenders.values(), key=lambda entry: entry['total_seconds'], reverse=True)
+            return [
+                {
+                    'fingerprint': entry['fingerprint'],
+                    'query': entry['query'],
+                    'calls': entry['calls'],
+                    'total_ms': round(entry['total_seconds'] * 1000, 3),
+                    'mean_ms': round(entry['total_seconds'] * 1000 / entry['calls'], 3),
+                    'max_ms': round(entry['max_seconds'] * 1000, 3),
+                    'routes': dict(entry['routes']),
+                    'last_params': entry['last_params'],
+                    'last_seen': datetime.datetime.fromtimestamp(entry['last_seen'], datetime.timezone.utc).isoformat(),
+                    'plans': list(entry['plans'])
+                }
+                for entry in entries[:limit]
+            ]
+
+    def stats(self):
+        """Gets the settings and the plan capture counters"""
+        with self.lock:
+            return {
+                'threshold_ms': self.threshold * 1000,
+                'sample_rate': self.sample_rate,
+                'queries': len(self.offenders),
+                'plans_dir': str(self.plans.directory) if self.plans else None,
+                'max_plans': self.plans.size if self.plans else 0,
+                'explains': self.explains,
+                'explain_failures': self.explain_failures,
+                'explains_dropped': self.explains_dropped
+            }
+
+    def clear(self):
+        """Forgets the offenders (the stored plans stay until they are overwritten)"""
+        with self.lock:
+            removed = len(self.offenders)
+            self.offenders.clear()
+            return removed
@@ -0,0 +1,221 @@
+import itertools
+import re
+import threading
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+# Matches psycopg2 placeholders (%s and %(name)s)
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s')
+
+# Supabase's transaction pooler (prepared statements do not survive between transactions there)
+TRANSACTION_POOLER_PORT = 6543
+
+class Statement:
+    """A registered query with its PREPARE and EXECUTE forms"""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+
+        # PREPARE needs $1, $2, ... -- a name used more than once is one parameter
+        self.param_names = []
+        positions = itertools.count()
+
+        def replace(match):
+            key = match.group(1) if match.group(1) is not None else next(positions)
+            if key not in self.param_names:
+                self.param_names.append(key)
+            return f'${self.param_names.index(key) + 1}'
+
+        self.prepare_sql = f'PREPARE {name} AS {PLACEHOLDER.sub(replace, sql).strip().rstrip(";")};'
+        placeholders = ', '.join(['%s'] * len(self.param_names))
+        self.execute_sql = f'EXECUTE {name} ({placeholders});' if placeholders else f'EXECUTE {name};'
+
+        # Counters for stats()
+        self.executions = 0
+        self.fallbacks = 0
+        self.prepares = 0
+        self.prepare_failures = 0
+
+    def params(self, args):
+        """Gets the parameters of the plain SQL back from the EXECUTE arguments"""
+        if all(isinstance(name, int) for name in self.param_names):
+            return list(args)
+        return dict(zip(self.param_names, args))
+
+    def args(self, params):
+        """Gets the EXECUTE arguments in parameter order"""
+        if params is None:
+            return []
+        return [params[name] for name in self.param_names]
+
+class StatementRegistry:
+    """Hot, fixed queries that are PREPAREd once on every pooled connection and then run with EXECUTE
+
+    Connections get the statements when they are opened (see db_pool.ConnectionPool on_open) and a cursor
+    factory that swaps a registered query for its EXECUTE. Queries that are not registered, connections without
+    the statements, and a disabled registry all run the plain SQL, so callers never have to know.
+    """
+
+    def __init__(self, get_info, enabled=True, disabled_reason=None, cursor_base=psycopg2.extensions.cursor):
+        self.get_info = get_info    # connection -> its pool metadata dict (or None)
+        self.enabled = enabled
+        self.disabled_reason = disabled_reason
+        self.cursor_base = cursor_base  # cursor class the prepared cursor builds on
+        self.statements = {}        # SQL -> Statement
+        self.by_execute = {}        # EXECUTE SQL -> Statement
+        self.failed = set()         # names of the statements that did not prepare (left out until forget_failures)
+        self.lock = threading.Lock()
+        self.cursor_class = self.make_cursor_class()
+
+    def register(self, name, sql):
+        """Registers a query (the same string object is looked up on every execute)"""
+        statement = Statement(name, sql)
+        self.statements[sql] = statement
+        self.by_execute[statement.execute_sql] = statement
+        return sql
+
+    def original(self, query, vars):
+        """Gets the plain SQL and parameters of an EXECUTE (other queries are returned as they are)"""
+        statement = self.by_execute.get(query) if isinstance(query, str) else None
+        if statement is None:
+            return query, vars
+        return statement.sql, statement.params(vars or [])
+
+    def disable(self, reason):
+        """Stops using prepared statements (every query falls back to plain SQL)"""
+        if self.enabled:
+            print(f'Prepared statements disabled: {reason}')
+        self.enabled = False
+        self.disabled_reason = reason
+
+    def forget_failures(self):
+        """Tries the statements that did not prepare again on the next connections (e.g. after the schema changed)"""
+        with self.lock:
+            self.failed.clear()
+
+    def prepare_each(self, conn, cursor, statements):
+        """PREPAREs statements one at a time and gets the ones that worked (the others are left out from now on)"""
+        prepared = []
+        for statement in statements:
+            try:
+                cursor.execute(statement.prepare_sql)
+                conn.commit()
+                prepared.append(statement)
+            except psycopg2.Error as e:
+                conn.rollback()
+                with self.lock:
+                    statement.prepare_failures += 1
+                    self.failed.add(statement.name)
+                print(f'Error preparing {statement.name}: {e}')
+        return prepared
+
+    def prepare(self, conn, info):
+        """PREPAREs every registered query on a new connection (called once per connection by the pool)
+
+        Every PREPARE goes in one round trip and one commit. If one of them fails, they are prepared one by one
+        to find it, and it is left out of the batch for the next connections.
+        """
+        if not self.enabled:
+            return
+        prepared = info.setdefault('prepared', set())
+        with self.lock:
+            statements = [statement for statement in self.statements.values() if statement.name not in self.failed]
+        cursor = psycopg2.extensions.cursor(conn)
+        probe = 'SELECT pg_backend_pid();'
+        try:
+            cursor.execute(''.join(statement.prepare_sql for statement in statements) + probe)
+        except psycopg2.Error:
+            # The statements before the one that failed stay prepared (PREPARE is not undone by a rollback)
+            conn.rollback()
+            cursor.execute('DEALLOCATE ALL;')
+            conn.commit()
+            statements = self.prepare_each(conn, cursor, statements)
+            cursor.execute(probe)
+        first_pid = cursor.fetchone()[0]
+        conn.commit()
+        with self.lock:
+            for statement in statements:
+                statement.prepares += 1
+        prepared.update(statement.name for statement in statements)
+
+        # A transaction pooler hands out a different backend for each transaction, which loses the statements
+        cursor.execute(probe)
+        second_pid = cursor.fetchone()[0]
+        conn.commit()
+        cursor.close()
+        if first_pid != second_pid:
+            prepared.clear()
+            self.disable('the connection goes through a transaction pooler')
+            return
+        conn.cursor_factory = self.cursor_class
+
+    def lookup(self, cursor, query):
+        """Gets the statement to EXECUTE for a query (None if the plain SQL should run)"""
+        statement = self.statements.get(query) if isinstance(query, str) else None
+        if statement is None:
+            return None
+        info = self.get_info(cursor.connection) if self.enabled else None
+        if info is None or statement.name not in info.get('prepared', ()):
+            with self.lock:
+                statement.fallbacks += 1
+            return None
+        with self.lock:
+            statement.executions += 1
+        return statement
+
+    def make_cursor_class(self):
+        registry = self
+
+        class PreparedCursor(self.cursor_base):
+            """Cursor that runs registered queries with EXECUTE"""
+
+            def execute(self, query, vars=None):
+                # Named (server-side) cursors DECLARE their query, which cannot be an EXECUTE
+                statement = registry.lookup(self, query) if self.name is None else None
+                if statement is None:
+                    return super().execute(query, vars)
+                # Nothing is lost by rolling back a transaction that this EXECUTE would start
+                starts_transaction = (
+                    self.connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                )
+                try:
+                    return super().execute(statement.execute_sql, statement.args(vars))
+                except psycopg2.errors.InvalidSqlStatementName:
+                    # The statement is gone, so the connection is not the session it was prepared on
+                    registry.disable('a prepared statement disappeared (is there a transaction pooler?)')
+                    if not starts_transaction:
+                        raise
+                # Runs the plain SQL instead (the EXECUTE failed before the transaction did anything else)
+                self.connection.rollback()
+                with registry.lock:
+                    statement.fallbacks += 1
+                return super().execute(query, vars)
+
+        return PreparedCursor
+
+    def stats(self, plans=None):
+        """Gets how often each statement ran by name (skipping the parse and plan) or fell back to plain SQL
+
+        plans is {name: (generic_plans, custom_plans)} from pg_prepared_statements on one connection.
+        """
+        plans = plans or {}
+        with self.lock:
+            statements = {}
+            for statement in self.statements.values():
+                generic_plans, custom_plans = plans.get(statement.name, (None, None))
+                statements[statement.name] = {
+                    'executions': statement.executions,
+                    'fallbacks': statement.fallbacks,
+                    'prepares': statement.prepares,
+                    'prepare_failures': statement.prepare_failures,
+                    'generic_plans': generic_plans,
+                    'custom_plans': custom_plans
+                }
+            return {
+                'enabled': self.enabled,
+                'disabled_reason': self.disabled_reason,
+                'statements': statements
+            }
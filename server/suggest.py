@@ -0,0 +1,414 @@
+"""Typeahead suggestions for artist, album, and track names (for /api/suggest)
+
+Every kind of name is one sorted list of keys: the normalized name, and the rest of it from each of its next few
+words (so "The Dark Side" is found by "dark" too), each followed by the row id. The keys that start with what was
+typed are one bisect away, and are ranked by popularity: the number of tracks of an artist or an album, and for a
+track the number of tracks of its most popular artist. Short prefixes match many keys, so the build ranks each of
+them once and remembers its best rows (more than a request can ask for), which the writes then patch instead of
+ranking them again.
+
+Inserts add their names and raise the counts right away. Deletes remove their names right away, but the counts
+they lower are only read again by the next build (every SUGGEST_INDEX_TTL seconds, or sooner when the deletes
+leave a prefix with fewer remembered rows than a request can ask for).
+"""
+from array import array
+import bisect
+import heapq
+import sys
+import time
+import unicodedata
+
+from search_index import IndexManager, insort_unique, remove_sorted
+
+KINDS = ('artist', 'album', 'track')
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 50
+
+# Keys per name: the whole name and the rest of it from up to 3 later words
+MAX_WORD_KEYS = 4
+
+# Prefixes that match more keys than this have their best MEMO_DEPTH rows remembered
+MEMO_MIN_KEYS = 256
+
+# Rows remembered per prefix: deletes take rows out of them without ranking the prefix again, so there are spare ones
+MEMO_DEPTH = 2 * MAX_LIMIT
+
+# Goes between a key's text and its row id; it sorts before every other character, so the id never splits a prefix
+SEPARATOR = '\x00'
+# Sorts after every other character (the end of a prefix range)
+LAST_CHARACTER = '\U0010ffff'
+
+# Tables whose rows are kept in the index
+INDEXED_TABLES = {'track', 'album', 'artist', 'artisttrack'}
+
+# One bulk read of every name with its popularity, and every artist/track link - SQL Query
+BULK_QUERY = """
+    WITH artist_counts AS (
+        SELECT artist_id, COUNT(*)::int AS tracks FROM ArtistTrack GROUP BY artist_id
+    ),
+    album_counts AS (
+        SELECT album_id, COUNT(*)::int AS tracks FROM Track GROUP BY album_id
+    )
+    SELECT 'artist', ar.artist_id, ar.name, NULL::int, COALESCE(c.tracks, 0)
+    FROM Artist ar
+    LEFT JOIN artist_counts c ON c.artist_id = ar.artist_id
+    UNION ALL
+    SELECT 'album', al.album_id, al.name, NULL, COALESCE(c.tracks, 0)
+    FROM Album al
+    LEFT JOIN album_counts c ON c.album_id = al.album_id
+    UNION ALL
+    SELECT 'track', t.track_id, t.name, t.album_id, COALESCE(MAX(c.tracks), 0)
+    FROM Track t
+    LEFT JOIN ArtistTrack at ON at.track_id = t.track_id
+    LEFT JOIN artist_counts c ON c.artist_id = at.artist_id
+    GROUP BY t.track_id
+    UNION ALL
+    SELECT 'artisttrack', artist_id, NULL, track_id, NULL FROM ArtistTrack;
+"""
+
+def normalize(name):
+    """Lower-cases a name, drops its accents, and collapses its whitespace (keys and prefixes are compared this way)"""
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name)
+    text = ''.join(char for char in decomposed if not unicodedata.combining(char) and char != SEPARATOR)
+    return ' '.join(text.casefold().split())
+
+def name_keys(name, row_id):
+    """Gets the keys of a row: its normalized name from the start and from each of its next few words"""
+    words = normalize(name).split(' ')
+    tails = (' '.join(words[start:]) for start in range(min(len(words), MAX_WORD_KEYS)))
+    return list(dict.fromkeys(f'{tail}{SEPARATOR}{row_id}' for tail in tails if tail))
+
+def key_text(key):
+    return key[:key.index(SEPARATOR)]
+
+def key_id(key):
+    return int(key[key.index(SEPARATOR) + 1:])
+
+class NameKeys:
+    """The sorted keys of one kind of row, with each row's name and popularity"""
+
+    def __init__(self):
+        self.keys = []             # sorted
+        self.names = {}            # row id -> name
+        self.popularity = {}       # row id -> popularity
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, row_id):
+        return row_id in self.names
+
+    def append(self, row_id, name, popularity):
+        """Adds a row without keeping the keys sorted (for bulk loads, sort() has to be called at the end)"""
+        self.names[row_id] = name
+        self.popularity[row_id] = popularity
+        self.keys.extend(name_keys(name, row_id))
+
+    def sort(self):
+        self.keys.sort()
+
+    def add(self, row_id, name, popularity=0):
+        """Adds a row (does nothing if the row is already there)"""
+        if row_id in self.names:
+            return
+        self.names[row_id] = name
+        self.popularity[row_id] = popularity
+        for key in name_keys(name, row_id):
+            bisect.insort(self.keys, key)
+
+    def remove(self, row_id):
+        """Removes a row and its keys"""
+        name = self.names.pop(row_id, None)
+        if name is None:
+            return
+        del self.popularity[row_id]
+        for key in name_keys(name, row_id):
+            index = bisect.bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+
+    def key_range(self, prefix):
+        """Gets the (start, end) of the keys that start with the prefix"""
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + LAST_CHARACTER)
+
+    def rank(self, row_id):
+        """Sort key of a row: most popular first, then by name and id"""
+        return -self.popularity[row_id], self.names[row_id], row_id
+
+    def best(self, start, end, limit):
+        """Gets the best ids among the keys in [start, end) (a row with several matching keys is listed once)"""
+        row_ids = {key_id(key) for key in self.keys[start:end]}
+        return heapq.nsmallest(limit, row_ids, key=self.rank)
+
+    def nbytes(self):
+        """Estimates the memory used by the keys and names"""
+        total = sys.getsizeof(self.keys) + sum(sys.getsizeof(key) for key in self.keys)
+        total += sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names.values())
+        return total + sys.getsizeof(self.popularity)
+
+class RankedPrefix:
+    """The remembered best rows of a prefix
+
+    Every row of the prefix that ranks before cutoff is in best (cutoff is None when best has all of its rows), so
+    removing a row from best, or adding one that ranks before cutoff, keeps best exact without ranking again.
+    """
+    __slots__ = ('best', 'cutoff')
+
+    def __init__(self, names, best):
+        self.best = best
+        self.cutoff = names.rank(best[-1]) if len(best) >= MEMO_DEPTH else None
+
+class SuggestIndex:
+    """In-memory prefix lookup over artist, album, and track names, ranked by popularity"""
+
+    def __init__(self):
+        self.names = {kind: NameKeys() for kind in KINDS}
+        self.album_tracks = {}     # album_id -> array of track ids
+        self.artist_tracks = {}    # artist_id -> sorted array of track ids
+        self.memo = {}             # (kind, prefix) -> RankedPrefix
+        self.stale = False         # deletes left a prefix with fewer than MAX_LIMIT remembered rows
+
+    def remembered(self, kind, row_id):
+        """Gets the memo keys of every prefix of a row's keys that has remembered rows (each one once)"""
+        memo_keys = {}
+        for key in name_keys(self.names[kind].names[row_id], row_id):
+            text = key_text(key)
+            for end in range(1, len(text) + 1):
+                memo_key = (kind, text[:end])
+                if memo_key in self.memo:
+                    memo_keys[memo_key] = True
+        return list(memo_keys)
+
+    def rank_prefix(self, kind, start, end):
+        """Ranks the keys in [start, end) and gets their best rows to remember"""
+        names = self.names[kind]
+        return RankedPrefix(names, names.best(start, end, MEMO_DEPTH))
+
+    def rerank(self, kind, row_id):
+        """Puts a new (or more popular) row in its place among the remembered rows of its prefixes"""
+        names = self.names[kind]
+        rank = names.rank(row_id)
+        for memo_key in self.remembered(kind, row_id):
+            ranked = self.memo[memo_key]
+            best = ranked.best
+            if row_id in best:
+                position = best.index(row_id)
+                # Rows only become more popular, so it stays where it is unless it passed the row before it
+                if position == 0 or names.rank(best[position - 1]) < rank:
+                    continue
+                del best[position]
+            elif ranked.cutoff is not None and rank > ranked.cutoff:
+                # Rows that are not remembered rank before it
+                continue
+            # The other rows keep their ranks, so the list is still sorted without this one
+            bisect.insort(best, row_id, key=names.rank)
+            if len(best) > MEMO_DEPTH:
+                del best[MEMO_DEPTH:]
+                ranked.cutoff = names.rank(best[-1])
+
+    def forget(self, kind, row_id):
+        """Takes a removed row out of the remembered rows of its prefixes (the rows after it move up)"""
+        if row_id not in self.names[kind]:
+            return
+        for memo_key in self.remembered(kind, row_id):
+            ranked = self.memo[memo_key]
+            if row_id in ranked.best:
+                ranked.best.remove(row_id)
+                # Ranking the prefix again would read all of its keys, so the next build does it instead
+                if len(ranked.best) < MAX_LIMIT and ranked.cutoff is not None:
+                    self.stale = True
+
+    def raise_popularity(self, kind, row_id, popularity):
+        names = self.names[kind]
+        if row_id in names and popularity > names.popularity[row_id]:
+            names.popularity[row_id] = popularity
+            self.rerank(kind, row_id)
+
+    def add_row(self, kind, row_id, name):
+        names = self.names[kind]
+        if row_id in names:
+            return False
+        names.add(row_id, name)
+        self.rerank(kind, row_id)
+        return True
+
+    def add_artist(self, artist_id, name):
+        self.add_row('artist', artist_id, name)
+
+    def add_album(self, album_id, name):
+        self.add_row('album', album_id, name)
+
+    def add_track(self, track_id, name, album_id):
+        if not self.add_row('track', track_id, name):
+            return
+        track_ids = self.album_tracks.setdefault(album_id, array('i'))
+        track_ids.append(track_id)
+        self.raise_popularity('album', album_id, len(track_ids))
+
+    def link_artist_track(self, artist_id, track_id):
+        track_ids = self.artist_tracks.setdefault(artist_id, array('i'))
+        if not insort_unique(track_ids, track_id):
+            return
+        self.raise_popularity('artist', artist_id, len(track_ids))
+        # A track is as popular as its most popular artist, so every track of the artist can move up
+        if artist_id in self.names['artist']:
+            popularity = self.names['artist'].popularity[artist_id]
+            for artist_track_id in track_ids:
+                self.raise_popularity('track', artist_track_id, popularity)
+
+    def remove_rows(self, kind, row_ids):
+        for row_id in row_ids:
+            self.forget(kind, row_id)
+            self.names[kind].remove(row_id)
+
+    def remove_tracks(self, track_ids):
+        self.remove_rows('track', track_ids)
+
+    def remove_albums(self, album_ids):
+        # Deleting an album cascades to its tracks
+        for album_id in album_ids:
+            self.remove_rows('album', [album_id])
+            self.remove_tracks(self.album_tracks.pop(album_id, ()))
+
+    def remove_artists(self, artist_ids):
+        # Deleting an artist cascades to its ArtistTrack links (but not the tracks)
+        for artist_id in artist_ids:
+            self.remove_rows('artist', [artist_id])
+            self.artist_tracks.pop(artist_id, None)
+
+    def apply_insert(self, table, row):
+        """Adds a row inserted through /api/insert (row is a dict of column -> value)"""
+        table = table.lower()
+        if table == 'track':
+            self.add_track(row['track_id'], row['name'], row['album_id'])
+        elif table == 'album':
+            self.add_album(row['album_id'], row['name'])
+        elif table == 'artist':
+            self.add_artist(row['artist_id'], row['name'])
+        elif table == 'artisttrack':
+            self.link_artist_track(row['artist_id'], row['track_id'])
+
+    def apply_delete(self, table, rows):
+        """Removes rows deleted through /api/delete (rows are dicts of column -> value)"""
+        table = table.lower()
+        if table == 'track':
+            self.remove_tracks([row['track_id'] for row in rows])
+        elif table == 'album':
+            self.remove_albums([row['album_id'] for row in rows])
+        elif table == 'artist':
+            self.remove_artists([row['artist_id'] for row in rows])
+        elif table == 'artisttrack':
+            for row in rows:
+                track_ids = self.artist_tracks.get(row['artist_id'])
+                if track_ids is not None:
+                    remove_sorted(track_ids, row['track_id'])
+
+    def load_artist_tracks(self, links):
+        """Adds the (artist_id, track_id) links of a bulk read (each link once, like ArtistTrack's primary key)"""
+        links.sort()
+        for artist_id, track_id in links:
+            self.artist_tracks.setdefault(artist_id, array('i')).append(track_id)
+
+    def remember_prefixes(self, kind, prefix='', start=0, end=None):
+        """Ranks every prefix (from this one down) that matches more than MEMO_MIN_KEYS keys ahead of time"""
+        names = self.names[kind]
+        keys = names.keys
+        if end is None:
+            end = len(keys)
+        if end - start <= MEMO_MIN_KEYS:
+            return
+        if prefix:
+            self.memo[(kind, prefix)] = self.rank_prefix(kind, start, end)
+        # Skip the keys that are the whole prefix, then walk the keys one next character at a time
+        index = bisect.bisect_left(keys, prefix + SEPARATOR + LAST_CHARACTER, start, end)
+        while index < end:
+            child = prefix + keys[index][len(prefix)]
+            child_end = bisect.bisect_left(keys, child + LAST_CHARACTER, index, end)
+            self.remember_prefixes(kind, child, index, child_end)
+            index = child_end
+
+    def best(self, kind, prefix, limit):
+        """Gets the best row ids of one kind whose keys start with the (normalized) prefix"""
+        names = self.names[kind]
+        start, end = names.key_range(prefix)
+        if end - start <= MEMO_MIN_KEYS:
+            return names.best(start, end, limit)
+        ranked = self.memo.get((kind, prefix))
+        if ranked is None:
+            # A prefix that grew past MEMO_MIN_KEYS since the build
+            ranked = self.memo[(kind, prefix)] = self.rank_prefix(kind, start, end)
+        return ranked.best[:limit]
+
+    def suggest(self, text, kinds=KINDS, limit=DEFAULT_LIMIT):
+        """Gets {kind: [(row id, name, popularity)]} for the names that start with the text (or one of its words)"""
+        prefix = normalize(text)
+        suggestions = {}
+        for kind in kinds:
+            names = self.names[kind]
+            row_ids = self.best(kind, prefix, limit) if prefix else []
+            suggestions[kind] = [(row_id, names.names[row_id], names.popularity[row_id]) for row_id in row_ids]
+        return suggestions
+
+    def nbytes(self):
+        """Estimates the memory used by the index"""
+        total = sum(names.nbytes() for names in self.names.values())
+        for links in (self.album_tracks, self.artist_tracks):
+            total += sys.getsizeof(links) + sum(sys.getsizeof(track_ids) for track_ids in links.values())
+        return total + sys.getsizeof(self.memo) + sum(sys.getsizeof(ranked.best) for ranked in self.memo.values())
+
+    def stats(self):
+        """Gets the size of the index and its memory use (also scaled to a million tracks)"""
+        nbytes = self.nbytes()
+        track_count = len(self.names['track'])
+        return {
+            'artists': len(self.names['artist']),
+            'albums': len(self.names['album']),
+            'tracks': track_count,
+            'keys': sum(len(names.keys) for names in self.names.values()),
+            'remembered_prefixes': len(self.memo),
+            'memory_bytes': nbytes,
+            'memory_bytes_per_million_tracks': int(nbytes / track_count * 1000000) if track_count else None,
+        }
+
+class SuggestIndexManager(IndexManager):
+    """Owns the live suggestion index (built again every ttl seconds)"""
+
+    thread_name = 'suggest-index-build'
+    label = 'suggestion index'
+
+    def __init__(self, ttl=3600):
+        super().__init__()
+        self.ttl = ttl
+
+    @property
+    def expired(self):
+        return self.index is None or self.index.stale or time.monotonic() - self.built_monotonic > self.ttl
+
+    def load(self, conn):
+        index = SuggestIndex()
+        # Server-side cursor so the rows are streamed instead of loaded all at once
+        cursor = conn.cursor(name='suggest_index_build')
+        cursor.itersize = 10000
+        cursor.execute(BULK_QUERY)
+        links = []
+        for kind, row_id, name, other_id, popularity in cursor:
+            if kind == 'artisttrack':
+                links.append((row_id, other_id))
+                continue
+            index.names[kind].append(row_id, name, popularity)
+            if kind == 'track':
+                index.album_tracks.setdefault(other_id, array('i')).append(row_id)
+        cursor.close()
+        conn.commit()
+        index.load_artist_tracks(links)
+        for kind, names in index.names.items():
+            names.sort()
+            index.remember_prefixes(kind)
+        return index
+
+    def suggest(self, text, kinds=KINDS, limit=DEFAULT_LIMIT):
+        with self.lock:
+            return self.index.suggest(text, kinds, limit)
@@ -0,0 +1,98 @@
+"""Fixtures for the tests that need a database
+
+MUSEDB_TEST_DSN points at a Postgres server the tests can create a throwaway musedb_test database on (the same
+kind of connection string as benchmarks/run.py --dsn). The tests that need it are skipped when it is not set.
+
+    MUSEDB_TEST_DSN="host=localhost port=5432 dbname=postgres user=postgres" python -m pytest server/tests
+"""
+import os
+import sys
+from pathlib import Path
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVER_DIR))
+sys.path.insert(0, str(SERVER_DIR / 'benchmarks'))
+
+TEST_DATABASE = 'musedb_test'
+
+# Synthetic tracks added to the sample data (see benchmarks/datagen.py), enough for a few pages of every size
+TEST_TRACKS = 300
+
+def run_admin(admin_dsn, query):
+    """Runs a statement that cannot run in a transaction (CREATE/DROP DATABASE) on the admin connection"""
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+    finally:
+        conn.close()
+
+def create_database(admin_dsn):
+    """Creates the test database with the schema, the migrations, and the sample data (like benchmarks/run.py)"""
+    import migrate
+    import run
+    run_admin(admin_dsn, f'DROP DATABASE IF EXISTS {TEST_DATABASE};')
+    # UTF8 like the real database, whatever the server's default is
+    run_admin(admin_dsn, f"CREATE DATABASE {TEST_DATABASE} ENCODING 'UTF8' TEMPLATE template0;")
+    dsn = run.with_database(admin_dsn, TEST_DATABASE)
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(run.SCHEMA_FILE.read_text())
+            conn.commit()
+        migrate.migrate(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(run.SAMPLE_DATA_FILE.read_text())
+            cursor.execute('ANALYZE;')
+        conn.commit()
+    finally:
+        conn.close()
+    return dsn
+
+@pytest.fixture(scope='session')
+def database_dsn():
+    """Creates the test database with the schema, the migrations, the sample data, and a small synthetic catalog"""
+    admin_dsn = os.getenv('MUSEDB_TEST_DSN')
+    if not admin_dsn:
+        pytest.skip('MUSEDB_TEST_DSN is not set')
+
+    import datagen
+    dsn = create_database(admin_dsn)
+    datagen.generate(dsn, TEST_TRACKS, workers=1, log=lambda *args: None)
+    yield dsn
+    run_admin(admin_dsn, f'DROP DATABASE IF EXISTS {TEST_DATABASE} WITH (FORCE);')
+
+@pytest.fixture(scope='session')
+def app_module(database_dsn):
+    """Imports the Flask app on the test database, with the query counting on and the response cache off"""
+    params = psycopg2.extensions.parse_dsn(database_dsn)
+    os.environ.update({
+        'DB_HOST': params.get('host', 'localhost'),
+        'DB_PORT': str(params.get('port', 5432)),
+        'DB_NAME': params['dbname'],
+        'DB_USER': params.get('user', 'postgres'),
+        'DB_PASSWORD': params.get('password') or 'test',
+        'DB_SSLMODE': params.get('sslmode', 'disable'),
+        'QUERY_STATS': '1',
+        'RESPONSE_CACHE': '0',
+        'SLOW_QUERY_LOG': '0'
+    })
+    import app
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def db(database_dsn):
+    """A connection to the test database that commits every statement (for setting up rows and checking them)"""
+    conn = psycopg2.connect(database_dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
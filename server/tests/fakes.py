@@ -0,0 +1,87 @@
+"""Stand-ins for connections and locks, for the tests that do not need a database"""
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+class FakeCursor:
+    """Streams the bulk rows, and runs a callback halfway through (a write that commits during the build)"""
+
+    def __init__(self, rows, during_read):
+        self.rows = rows
+        self.during_read = during_read
+
+    def execute(self, query):
+        pass
+
+    def __iter__(self):
+        for position, row in enumerate(self.rows):
+            if position == len(self.rows) // 2:
+                self.during_read()
+            yield row
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.fake_cursor = cursor
+
+    def cursor(self, name=None):
+        return self.fake_cursor
+
+    def commit(self):
+        pass
+
+class HookedLock:
+    """The manager's lock, running a callback once right after it is next released"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.after_release = None
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        callback, self.after_release = self.after_release, None
+        if callback is not None:
+            callback()
+
+class FakePgCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.conn.queries.append(query)
+
+    def close(self):
+        pass
+
+class FakePgInfo:
+    def __init__(self):
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class FakePgConnection:
+    """A psycopg2 connection as far as the pool is concerned (set broken to make its next query fail)"""
+
+    def __init__(self, dsn, **kwargs):
+        self.dsn = dsn
+        self.closed = 0
+        self.broken = False
+        self.queries = []
+        self.rollbacks = 0
+        self.info = FakePgInfo()
+
+    def cursor(self):
+        return FakePgCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
@@ -0,0 +1,118 @@
+"""The async server: its read endpoints return what the Flask app returns (from the base tables and from track_catalog),
+and they read from the replicas like the Flask app"""
+import time
+
+import pytest
+
+pytest.importorskip('asyncpg')
+pytest.importorskip('starlette')
+
+from starlette.testclient import TestClient
+
+@pytest.fixture
+def asgi_client(app_module):
+    import asgi
+    with TestClient(asgi.app) as asgi_client:
+        yield asgi_client
+
+@pytest.fixture(params=[False, True], ids=['base-tables', 'track-catalog'])
+def track_catalog(request, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'TRACK_CATALOG_ENABLED', request.param)
+    return request.param
+
+@pytest.mark.parametrize('path', ['/api/tracks/joined?limit=20', '/api/tracks/joined?limit=5&offset=40'])
+def test_tracks_joined_matches_flask(client, asgi_client, track_catalog, path):
+    expected = client.get(path)
+    response = asgi_client.get(path)
+    assert response.status_code == expected.status_code == 200
+    assert response.json() == expected.get_json()
+    assert response.json()['results']
+
+    next_page = f'/api/tracks/joined?limit=5&after={response.json()["next_cursor"]}'
+    assert asgi_client.get(next_page).json() == client.get(next_page).get_json()
+
+@pytest.mark.parametrize('search_index', [False, True], ids=['query', 'index'])
+def test_search_music_matches_flask(app_module, client, asgi_client, track_catalog, search_index, monkeypatch):
+    monkeypatch.setattr(app_module, 'SEARCH_INDEX_ENABLED', search_index)
+    if search_index and not app_module.music_index.ready:
+        app_module.music_index.build(app_module.get_db_connection, app_module.release_db_connection)
+
+    body = {'query': 'love', 'limit': 10}
+    expected = client.post('/api/search/music', json=body)
+    response = asgi_client.post('/api/search/music', json=body)
+    assert response.status_code == expected.status_code == 200
+    assert response.json() == expected.get_json()
+    assert response.json()
+
+@pytest.fixture
+def replica_client(app_module, database_dsn, monkeypatch):
+    """An async server whose replica set has one replica (the test database itself) and one that cannot be reached"""
+    import asgi
+    import replicas
+    replica_set = replicas.ReplicaSet(
+        [database_dsn, 'host=127.0.0.1 port=1 dbname=nowhere user=nobody connect_timeout=1'], check_interval=3600
+    )
+    monkeypatch.setattr(app_module, 'replica_set', replica_set)
+    with TestClient(asgi.app) as replica_client:
+        yield replica_client, replica_set
+
+def test_reads_go_to_a_healthy_replica(replica_client):
+    asgi_client, replica_set = replica_client
+    working, unreachable = replica_set.replicas
+    assert working.healthy and not unreachable.healthy
+
+    for _ in range(3):
+        assert asgi_client.get('/api/tracks/joined?limit=5').status_code == 200
+    assert working.reads == 3 and replica_set.fallbacks == 0
+
+def test_an_unreachable_replica_is_skipped(replica_client):
+    asgi_client, replica_set = replica_client
+    working, unreachable = replica_set.replicas
+    working.healthy = False
+    unreachable.healthy = True
+
+    assert asgi_client.get('/api/tracks/joined?limit=5').status_code == 200
+    assert not unreachable.healthy and unreachable.failures == 1
+    assert replica_set.fallbacks == 1
+
+def test_a_client_that_wrote_reads_from_the_primary(app_module, replica_client):
+    asgi_client, replica_set = replica_client
+    asgi_client.cookies.set(app_module.WROTE_AT_COOKIE, str(time.time()))
+    assert asgi_client.get('/api/tracks/joined?limit=5').status_code == 200
+    assert replica_set.replicas[0].reads == 0 and replica_set.fallbacks == 0
+
+def test_responses_are_cached_until_a_write(app_module, asgi_client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'RESPONSE_CACHE_ENABLED', True)
+    app_module.api_cache.clear()
+    path = '/api/tracks/joined?limit=3'
+
+    first = asgi_client.get(path)
+    assert first.headers['X-Cache'] == 'MISS'
+    second = asgi_client.get(path)
+    assert second.headers['X-Cache'] == 'HIT' and second.content == first.content
+    assert asgi_client.get(path, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    # The write goes through the Flask app and drops the cached page
+    with db.cursor() as cursor:
+        cursor.execute('SELECT album_id FROM Album LIMIT 1;')
+        album_id = cursor.fetchone()[0]
+    track = {'name': 'Cached', 'album_id': album_id}
+    inserted = asgi_client.post('/api/insert', json={'table': 'Track', 'data': track})
+    assert inserted.status_code in (200, 201), inserted.json()
+    assert asgi_client.get(path).headers['X-Cache'] == 'MISS'
+
+def request_count(asgi_client, route):
+    line = f'musedb_http_requests_total{{route="{route}",method="GET",status="200"}} '
+    metrics = asgi_client.get('/api/metrics').text.splitlines()
+    return next((int(row[len(line):]) for row in metrics if row.startswith(line)), 0)
+
+def test_requests_are_counted_like_flask(client, asgi_client, track_catalog):
+    path = '/api/tracks/joined?limit=10'
+    # The first request also counts the tracks and looks for track_catalog (both are cached)
+    asgi_client.get(path)
+
+    expected = client.get(path)
+    before = request_count(asgi_client, '/api/tracks/joined')
+    response = asgi_client.get(path)
+    assert int(response.headers['X-Query-Count']) == int(expected.headers['X-Query-Count']) > 0
+    assert request_count(asgi_client, '/api/tracks/joined') == before + 1
@@ -0,0 +1,159 @@
+"""The connection pool: timeouts, waiters, recycling, pings, and on_open"""
+import threading
+import time
+
+import psycopg2.extensions
+import pytest
+
+import db_pool
+from fakes import FakePgConnection
+
+class FakeClock:
+    """Stands in for the time module in db_pool (only monotonic() moves, and only when told to)"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(dsn, **connect_kwargs):
+        conn = FakePgConnection(dsn, **connect_kwargs)
+        opened.append(conn)
+        return conn
+
+    pool = db_pool.ConnectionPool('dbname=test', connect=connect, **kwargs)
+    pool.opened_connections = opened
+    return pool
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(db_pool, 'time', clock)
+    return clock
+
+def test_a_full_pool_times_out():
+    pool = make_pool(maxconn=1)
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(db_pool.PoolTimeout):
+        pool.getconn(timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats()['timeouts'] == 1
+    assert len(pool.opened_connections) == 1
+
+def test_a_released_connection_goes_to_the_waiter():
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn(timeout=5)))
+    waiter.start()
+    for _ in range(500):
+        if pool.stats()['waiters'] == 1:
+            break
+        time.sleep(0.01)
+    assert pool.stats()['waiters'] == 1
+
+    pool.putconn(conn)
+    waiter.join(5)
+    assert got == [conn]
+    assert pool.stats()['waiters'] == 0
+    assert len(pool.opened_connections) == 1
+
+def test_closing_a_connection_frees_its_slot_for_a_waiter():
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    pool.putconn(conn, close=True)
+    waiter.join(5)
+    assert conn.closed
+    assert got == [pool.opened_connections[1]]
+
+def test_idle_connections_are_handed_out_newest_first():
+    pool = make_pool(maxconn=2)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    assert pool.getconn() is second
+
+def test_old_connections_are_recycled(clock):
+    pool = make_pool(recycle=60, ping_after=None)
+    old = pool.getconn()
+    pool.putconn(old)
+    clock.now += 61
+    conn = pool.getconn()
+    assert conn is not old and old.closed
+    assert pool.stats()['discarded'] == 1
+
+def test_connections_idle_for_a_while_are_pinged(clock):
+    pool = make_pool(ping_after=30, recycle=None)
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    # Not idle long enough to be pinged
+    clock.now += 10
+    assert pool.getconn() is conn and conn.queries == []
+    pool.putconn(conn)
+
+    clock.now += 31
+    assert pool.getconn() is conn and conn.queries == ['SELECT 1;']
+    pool.putconn(conn)
+
+    # A connection the server dropped fails its ping and is replaced
+    conn.broken = True
+    clock.now += 31
+    replacement = pool.getconn()
+    assert replacement is not conn and conn.closed
+
+def test_putconn_rolls_back_or_closes():
+    pool = make_pool(maxconn=2)
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1 and not conn.closed
+
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+    pool.putconn(conn)
+    assert conn.closed
+    assert pool.stats()['size'] == 0
+
+def test_on_open_sets_up_every_new_connection():
+    calls = []
+
+    def on_open(conn, info):
+        calls.append(conn)
+        info['ready'] = True
+
+    pool = make_pool(maxconn=2, on_open=on_open)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    assert pool.getconn() is first
+    assert calls == [first, second]
+    assert pool.conn_info(first) == {'ready': True}
+    assert pool.conn_info(FakePgConnection('other')) is None
+
+def test_a_failing_on_open_frees_its_slot():
+    def on_open(conn, info):
+        raise RuntimeError('prepare failed')
+
+    pool = make_pool(maxconn=1, on_open=on_open)
+    with pytest.raises(ConnectionError, match='prepare failed'):
+        pool.getconn()
+    assert pool.opened_connections[0].closed
+    assert pool.stats()['size'] == 0
+
+def test_warm_up_and_closeall():
+    pool = make_pool(minconn=3, maxconn=5)
+    assert pool.warm_up() == 3
+    assert pool.stats()['idle'] == 3
+    pool.closeall()
+    assert all(conn.closed for conn in pool.opened_connections)
+    with pytest.raises(ConnectionError):
+        pool.getconn()
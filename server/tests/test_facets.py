@@ -0,0 +1,123 @@
+"""The /api/browse facet bitmaps: writes through the API update them in place, and they count what the query counts"""
+import time
+import uuid
+
+import pytest
+
+import facets
+
+def make_filters(**filters):
+    return dict({'genre_ids': None, 'nation_ids': None, 'types': None, 'year_from': None, 'year_to': None}, **filters)
+
+def wait_until_fresh(manager):
+    for _ in range(500):
+        if manager.fresh:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'the bitmaps did not catch up: {manager.stats()}')
+
+def assert_counts_match(db, manager, filters):
+    wait_until_fresh(manager)
+    total, counts = manager.counts(filters)
+    with db.cursor() as cursor:
+        expected_total, expected = facets.query_counts(cursor, filters)
+    assert total == expected_total
+    assert facets.format_facets(counts, filters) == facets.format_facets(expected, filters)
+
+@pytest.fixture
+def facet_index(app_module, monkeypatch):
+    """A freshly built facet index in place of the app's"""
+    manager = facets.FacetIndexManager()
+    monkeypatch.setattr(app_module, 'facet_index', manager)
+    monkeypatch.setattr(app_module, 'FACET_INDEX_ENABLED', True)
+    manager.start_build(app_module.get_db_connection, app_module.release_db_connection).join()
+    assert manager.fresh
+    return manager
+
+@pytest.fixture
+def genre(db):
+    """A new genre (no track has it yet), as (genre_id, name)"""
+    name = f'{uuid.uuid4().hex[:8]} Genre'
+    with db.cursor() as cursor:
+        cursor.execute('INSERT INTO Genre (name) VALUES (%s) RETURNING genre_id;', (name,))
+        return cursor.fetchone()[0], name
+
+def insert_song(client, token):
+    """Inserts a song with a new artist on a new album"""
+    return insert_music(client, {
+        'song_name': f'{token} one', 'artist_name': f'{token} Artist', 'album_name': f'{token} Album'
+    })
+
+def insert_music(client, song):
+    response = client.post('/api/insert/music', json=song)
+    assert response.status_code in (200, 201), response.get_json()
+    return response.get_json()
+
+def test_the_built_bitmaps_count_what_the_query_counts(db, facet_index):
+    with db.cursor() as cursor:
+        cursor.execute('SELECT genre_id FROM Genre ORDER BY genre_id LIMIT 2;')
+        genre_ids = [row[0] for row in cursor.fetchall()]
+    assert_counts_match(db, facet_index, make_filters())
+    assert_counts_match(db, facet_index, make_filters(genre_ids=genre_ids, year_from=1990))
+
+def test_writes_update_the_bitmaps_in_place(client, db, facet_index, genre):
+    token = uuid.uuid4().hex[:8]
+    genre_id, genre_name = genre
+    by_genre = make_filters(genre_ids=[genre_id])
+    builds = facet_index.built_at
+
+    # A new artist in the new genre, on a new album
+    insert_music(client, {
+        'song_name': f'{token} one', 'artist_name': f'{token} Artist', 'album_name': f'{token} Album',
+        'album_release_date': '1999-05-01'
+    })
+    with db.cursor() as cursor:
+        cursor.execute('SELECT artist_id FROM Artist WHERE name = %s;', (f'{token} Artist',))
+        artist_id = cursor.fetchone()[0]
+    link = {'artist_id': artist_id, 'genre_id': genre_id}
+    linked = client.post('/api/insert', json={'table': 'ArtistGenre', 'data': link})
+    assert linked.status_code in (200, 201), linked.get_json()
+    assert_counts_match(db, facet_index, by_genre)
+    assert facet_index.counts(by_genre)[0] == 1
+
+    # A second song on the album (the album artist puts it in the genre too)
+    insert_music(client, {'song_name': f'{token} two', 'artist_name': f'{token} Other', 'album_name': f'{token} Album'})
+    assert_counts_match(db, facet_index, by_genre)
+    assert facet_index.counts(by_genre)[0] == 2
+    assert_counts_match(db, facet_index, make_filters(year_from=1999, year_to=1999))
+
+    # Deleting a song, and then the genre (through /api/delete)
+    deleted = client.delete('/api/delete/music', json={'type': 'song', 'value': f'{token} one'})
+    assert deleted.status_code == 200, deleted.get_json()
+    assert_counts_match(db, facet_index, by_genre)
+    assert facet_index.counts(by_genre)[0] == 1
+    removed = client.delete('/api/delete', json={'table': 'Genre', 'column': 'name', 'value': genre_name})
+    assert removed.status_code == 200, removed.get_json()
+    assert_counts_match(db, facet_index, make_filters())
+    assert facet_index.counts(by_genre)[0] == 0
+
+    # None of it needed a build
+    assert facet_index.built_at == builds
+
+def test_a_write_the_bitmaps_cannot_follow_rebuilds_them(client, db, facet_index):
+    token = uuid.uuid4().hex[:8]
+    insert_song(client, token)
+    wait_until_fresh(facet_index)
+    builds = facet_index.built_at
+
+    # Deleting the album through /api/delete takes its tracks with it (which ones is not known to the bitmaps)
+    deleted = client.delete('/api/delete', json={'table': 'Album', 'column': 'name', 'value': f'{token} Album'})
+    assert deleted.status_code == 200, deleted.get_json()
+    assert_counts_match(db, facet_index, make_filters())
+    assert facet_index.built_at != builds
+
+def test_browse_uses_the_bitmaps_once_they_caught_up(app_module, client, db, facet_index, monkeypatch):
+    token = uuid.uuid4().hex[:8]
+    insert_song(client, token)
+    wait_until_fresh(facet_index)
+    indexed = client.get('/api/browse?limit=5').get_json()
+    assert indexed['facet_source'] == 'index'
+    monkeypatch.setattr(app_module, 'FACET_INDEX_ENABLED', False)
+    queried = client.get('/api/browse?limit=5').get_json()
+    assert queried['facet_source'] == 'query'
+    assert indexed['facets'] == queried['facets'] and indexed['total_count'] == queried['total_count']
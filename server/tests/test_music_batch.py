@@ -0,0 +1,39 @@
+"""/api/insert/music/batch matches names the same way /api/insert/music does"""
+import uuid
+
+def swap_ascii_case(name):
+    return ''.join(char.swapcase() if char.isascii() else char for char in name)
+
+def count_artists(app_module, name):
+    conn = app_module.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM Artist WHERE name = %s;', (name,))
+        return cursor.fetchone()[0]
+    finally:
+        app_module.release_db_connection(conn)
+
+def test_batch_finds_the_rows_of_the_single_song_path(app_module, client):
+    suffix = uuid.uuid4().hex[:8]
+    song = {
+        'song_name': f'İyi Geceler {suffix}',
+        'artist_name': f'Ärzte İstanbul {suffix}',
+        'album_name': f'ÇOK İYİ {suffix}',
+        'nation_name': f'Türkiye {suffix}',
+        'genre_name': f'Öztürk Pop {suffix}',
+    }
+    single = client.post('/api/insert/music', json=song)
+    assert single.status_code == 200, single.get_json()
+
+    # Same names with the ASCII letters in another case (lower() folds those in every locale)
+    other_case = {field: swap_ascii_case(name) if field == 'song_name' else name for field, name in song.items()}
+    batch = client.post('/api/insert/music/batch', json={'songs': [song, other_case]})
+    assert batch.status_code == 200, batch.get_json()
+    results = batch.get_json()['results']
+
+    # The same track (so the same album), and no second artist
+    track_id = single.get_json()['track_id']
+    assert [result['track_id'] for result in results] == [track_id, track_id]
+    assert [result['message'] for result in results] == ['Song already exists in album'] * 2
+    assert results[0]['artist_id'] == results[1]['artist_id']
+    assert count_artists(app_module, song['artist_name']) == 1
@@ -0,0 +1,122 @@
+"""/api/delete/music: the preview counts what the delete removes, the link rows go with it, and shared rows stay"""
+import uuid
+
+import pytest
+
+LINK_TABLES = ('ArtistTrack', 'ArtistAlbum', 'ArtistGenre')
+
+def fetch_ids(db, query, params):
+    with db.cursor() as cursor:
+        cursor.execute(query, params)
+        return sorted(row[0] for row in cursor.fetchall())
+
+@pytest.fixture
+def catalog(db):
+    """Two artists (the first also plays on one track of the second's album), each with an album and a genre
+
+        artist  (token Alpha): album  (token Solo), tracks solo-1 and solo-2
+        partner (token Beta):  album  (token Duets), tracks duet-1 and duet-2 (duet-2 with the artist too)
+    """
+    token = uuid.uuid4().hex[:8]
+    with db.cursor() as cursor:
+        cursor.execute('SELECT nation_id FROM Nation LIMIT 1;')
+        nation_id = cursor.fetchone()[0]
+        cursor.execute('SELECT genre_id FROM Genre LIMIT 1;')
+        genre_id = cursor.fetchone()[0]
+
+        ids = {}
+        for key, name in (('artist', f'{token} Alpha'), ('partner', f'{token} Beta')):
+            cursor.execute(
+                'INSERT INTO Artist (name, nation_id) VALUES (%s, %s) RETURNING artist_id;', (name, nation_id)
+            )
+            ids[key] = cursor.fetchone()[0]
+            cursor.execute('INSERT INTO ArtistGenre (artist_id, genre_id) VALUES (%s, %s);', (ids[key], genre_id))
+        for key, name, artist in (('solo', f'{token} Solo', 'artist'), ('duets', f'{token} Duets', 'partner')):
+            cursor.execute('INSERT INTO Album (name) VALUES (%s) RETURNING album_id;', (name,))
+            ids[key] = cursor.fetchone()[0]
+            cursor.execute('INSERT INTO ArtistAlbum (artist_id, album_id) VALUES (%s, %s);', (ids[artist], ids[key]))
+        for key, album, artists in (
+            ('solo-1', 'solo', ['artist']), ('solo-2', 'solo', ['artist']),
+            ('duet-1', 'duets', ['partner']), ('duet-2', 'duets', ['partner', 'artist'])
+        ):
+            cursor.execute(
+                'INSERT INTO Track (name, album_id) VALUES (%s, %s) RETURNING track_id;', (f'{token} {key}', ids[album])
+            )
+            ids[key] = cursor.fetchone()[0]
+            for artist in artists:
+                cursor.execute('INSERT INTO ArtistTrack (artist_id, track_id) VALUES (%s, %s);', (ids[artist], ids[key]))
+    ids['token'] = token
+    return ids
+
+def preview_and_delete(client, delete_type, value):
+    preview = client.post('/api/delete/preview', json={'type': delete_type, 'value': value})
+    assert preview.status_code == 200, preview.get_json()
+    deleted = client.delete('/api/delete/music', json={'type': delete_type, 'value': value})
+    assert deleted.status_code == 200, deleted.get_json()
+    preview, deleted = preview.get_json(), deleted.get_json()
+    assert preview['breakdown'] == deleted['breakdown']
+    assert preview['affected_count'] == deleted['deleted_count']
+    return deleted['breakdown']
+
+def remaining(db, catalog):
+    """Gets the ids of the fixture's rows that are still there"""
+    token = f'{catalog["token"]}%'
+    return {
+        'artists': fetch_ids(db, 'SELECT artist_id FROM Artist WHERE name LIKE %s;', (token,)),
+        'albums': fetch_ids(db, 'SELECT album_id FROM Album WHERE name LIKE %s;', (token,)),
+        'tracks': fetch_ids(db, 'SELECT track_id FROM Track WHERE name LIKE %s;', (token,)),
+    }
+
+def link_count(db, table, column, row_ids):
+    with db.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE {column} = ANY(%s);', (row_ids,))
+        return cursor.fetchone()[0]
+
+def test_deleting_a_song(client, db, catalog):
+    breakdown = preview_and_delete(client, 'song', f'{catalog["token"]} duet-2')
+    assert breakdown == {
+        'artists': 0, 'albums': 0, 'tracks': 1, 'artist_tracks': 2, 'artist_albums': 0, 'artist_genres': 0
+    }
+    assert link_count(db, 'ArtistTrack', 'track_id', [catalog['duet-2']]) == 0
+    # Both of its artists and its album stay
+    assert remaining(db, catalog) == {
+        'artists': sorted([catalog['artist'], catalog['partner']]),
+        'albums': sorted([catalog['solo'], catalog['duets']]),
+        'tracks': sorted([catalog['solo-1'], catalog['solo-2'], catalog['duet-1']]),
+    }
+
+def test_deleting_an_album(client, db, catalog):
+    breakdown = preview_and_delete(client, 'album', f'{catalog["token"]} Solo')
+    assert breakdown == {
+        'artists': 0, 'albums': 1, 'tracks': 2, 'artist_tracks': 2, 'artist_albums': 1, 'artist_genres': 0
+    }
+    assert link_count(db, 'ArtistAlbum', 'album_id', [catalog['solo']]) == 0
+    assert link_count(db, 'ArtistTrack', 'track_id', [catalog['solo-1'], catalog['solo-2']]) == 0
+    # Its artist stays, with the track on the other album
+    assert remaining(db, catalog) == {
+        'artists': sorted([catalog['artist'], catalog['partner']]),
+        'albums': [catalog['duets']],
+        'tracks': sorted([catalog['duet-1'], catalog['duet-2']]),
+    }
+    assert link_count(db, 'ArtistTrack', 'artist_id', [catalog['artist']]) == 1
+
+def test_deleting_an_artist(client, db, catalog):
+    breakdown = preview_and_delete(client, 'artist', f'{catalog["token"]} Alpha')
+    # Its album with both tracks, and its track on the partner's album (with the partner's link to it)
+    assert breakdown == {
+        'artists': 1, 'albums': 1, 'tracks': 3, 'artist_tracks': 4, 'artist_albums': 1, 'artist_genres': 1
+    }
+    for table in LINK_TABLES:
+        assert link_count(db, table, 'artist_id', [catalog['artist']]) == 0
+    # The partner, its album, and its own track stay, with their links
+    assert remaining(db, catalog) == {
+        'artists': [catalog['partner']],
+        'albums': [catalog['duets']],
+        'tracks': [catalog['duet-1']],
+    }
+    for table in LINK_TABLES:
+        assert link_count(db, table, 'artist_id', [catalog['partner']]) == 1
+
+def test_a_delete_that_matches_nothing(client, catalog):
+    breakdown = preview_and_delete(client, 'artist', f'{catalog["token"]} nobody')
+    assert set(breakdown.values()) == {0}
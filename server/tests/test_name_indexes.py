@@ -0,0 +1,28 @@
+"""Names are not unique: the generic inserts can add rows whose names are already in the catalog"""
+import uuid
+
+def test_two_albums_can_have_the_same_name(client):
+    name = f'Greatest Hits {uuid.uuid4().hex[:8]}'
+    for _ in range(2):
+        response = client.post('/api/insert', json={'table': 'Album', 'data': {'name': name}})
+        assert response.status_code == 200, response.get_json()
+
+    # And again with the other case, in one bulk insert
+    response = client.post('/api/insert/bulk', json={'table': 'Album', 'rows': [{'name': name.upper()}, {'name': name}]})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['inserted'] == 2
+
+def test_two_artists_can_have_the_same_name(app_module, client):
+    conn = app_module.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT nation_id FROM Nation LIMIT 1;')
+        nation_id = cursor.fetchone()[0]
+    finally:
+        app_module.release_db_connection(conn)
+
+    name = f'Nirvana {uuid.uuid4().hex[:8]}'
+    rows = [{'name': name, 'nation_id': nation_id}, {'name': name, 'nation_id': nation_id}]
+    response = client.post('/api/insert/bulk', json={'table': 'Artist', 'rows': rows})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['inserted'] == 2
@@ -0,0 +1,95 @@
+"""The in-memory indexes' manager (writes that commit during a build) and the search index's artist/track links"""
+import pytest
+
+import search_index
+from fakes import FakeConnection, FakeCursor, HookedLock
+
+BULK_ROWS = [
+    ('track', 1, 'Falling Behind', 10),
+    ('track', 2, 'From The Start', 10),
+    ('album', 10, 'Everything I Know About Love', None),
+    ('artist', 100, 'Laufey', None),
+    ('artisttrack', 100, None, 2),
+    ('artisttrack', 100, None, 1),
+]
+
+def build(manager, during_read=lambda: None, rows=BULK_ROWS):
+    connection = FakeConnection(FakeCursor(rows, during_read))
+    manager.build(lambda: connection, lambda conn: None)
+
+class NameSet:
+    """The smallest index there is: a set of names"""
+
+    def __init__(self):
+        self.names = set()
+
+    def add(self, name):
+        self.names.add(name)
+
+    def remove(self, name):
+        self.names.discard(name)
+
+    def stats(self):
+        return {'names': len(self.names)}
+
+class NameSetManager(search_index.IndexManager):
+    """Builds a NameSet out of the names of the bulk rows (the replay is the same for every index)"""
+
+    def load(self, conn):
+        index = NameSet()
+        cursor = conn.cursor(name='names')
+        cursor.execute('SELECT name FROM names;')
+        for row in cursor:
+            index.add(row[2])
+        cursor.close()
+        return index
+
+class FailingCursor(FakeCursor):
+    def __iter__(self):
+        yield from super().__iter__()
+        raise RuntimeError('connection lost')
+
+def test_writes_during_a_build_reach_the_new_index():
+    manager = NameSetManager()
+    build(manager)
+
+    def write():
+        manager.apply('add', 'Bewitched')
+        manager.apply('remove', 'Falling Behind')
+
+    build(manager, write)
+    assert 'Bewitched' in manager.index.names and 'Falling Behind' not in manager.index.names
+    assert manager.pending is None and not manager.building
+
+def test_a_write_right_after_the_read_reaches_the_new_index():
+    manager = NameSetManager()
+    build(manager)
+    manager.lock = HookedLock()
+
+    # The write runs the first time the build lets go of the lock after the bulk read
+    build(manager, lambda: setattr(manager.lock, 'after_release', lambda: manager.apply('add', 'Dreamer')))
+    assert 'Dreamer' in manager.index.names
+
+def test_a_failed_build_keeps_the_old_index():
+    manager = NameSetManager()
+    build(manager)
+    index = manager.index
+
+    connection = FakeConnection(FailingCursor(BULK_ROWS, lambda: manager.apply('add', 'Bewitched')))
+    with pytest.raises(RuntimeError):
+        manager.build(lambda: connection, lambda conn: None)
+    assert manager.index is index and 'Bewitched' in index.names
+    assert manager.pending is None and not manager.building
+    assert manager.stats()['names'] == len(index.names)
+
+def test_artist_tracks_stay_sorted_and_unique():
+    manager = search_index.SearchIndexManager()
+    build(manager)
+    manager.apply('apply_insert', 'artisttrack', {'artist_id': 100, 'track_id': 1})
+    manager.apply('apply_insert', 'track', {'track_id': 3, 'name': 'Bewitched', 'album_id': 10})
+    manager.apply('apply_insert', 'artisttrack', {'artist_id': 100, 'track_id': 3})
+    assert list(manager.index.artist_tracks[100]) == [1, 2, 3]
+
+    manager.apply('apply_delete', 'artisttrack', [{'artist_id': 100, 'track_id': 2}])
+    assert list(manager.index.artist_tracks[100]) == [1, 3]
+    assert sorted(track_id for track_id, _ in manager.search('laufey', 10)) == [1, 3]
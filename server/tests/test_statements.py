@@ -0,0 +1,79 @@
+"""Prepared statements: one batch per connection, statements that do not prepare, and statements that disappear"""
+import psycopg2
+import pytest
+
+import statements
+
+GOOD_SQL = 'SELECT %s::int + 1;'
+NAMED_SQL = 'SELECT %(a)s::int * %(a)s::int;'
+BROKEN_SQL = 'SELECT no_such_function(%s);'
+
+@pytest.fixture
+def registry():
+    infos = {}
+    registry = statements.StatementRegistry(lambda conn: infos.get(id(conn)))
+    registry.register('test_good', GOOD_SQL)
+    registry.register('test_named', NAMED_SQL)
+    registry.register('test_broken', BROKEN_SQL)
+    registry.infos = infos
+    return registry
+
+@pytest.fixture
+def connect(database_dsn, registry):
+    """Opens connections the way the pool does (prepare() with the connection's info dict)"""
+    connections = []
+
+    def open_connection():
+        conn = psycopg2.connect(database_dsn)
+        info = registry.infos[id(conn)] = {}
+        registry.prepare(conn, info)
+        connections.append(conn)
+        return conn, info
+
+    yield open_connection
+    for conn in connections:
+        conn.close()
+
+def prepared_names(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM pg_prepared_statements WHERE name LIKE 'test_%';")
+    names = {row[0] for row in cursor.fetchall()}
+    conn.rollback()
+    return names
+
+def test_a_statement_that_does_not_prepare_is_left_out(connect, registry):
+    conn, info = connect()
+    assert info['prepared'] == {'test_good', 'test_named'}
+    assert prepared_names(conn) == {'test_good', 'test_named'}
+    assert registry.failed == {'test_broken'}
+
+    # The next connection prepares the others in one batch, without trying the broken one again
+    conn, info = connect()
+    assert info['prepared'] == {'test_good', 'test_named'}
+    stats = registry.stats()['statements']
+    assert stats['test_good']['prepares'] == 2
+    assert stats['test_broken']['prepare_failures'] == 1
+
+    registry.forget_failures()
+    connect()
+    assert registry.stats()['statements']['test_broken']['prepare_failures'] == 2
+
+def test_registered_queries_run_with_execute(connect, registry):
+    conn, _ = connect()
+    cursor = conn.cursor()
+    cursor.execute(GOOD_SQL, (41,))
+    assert cursor.fetchone()[0] == 42
+    cursor.execute(NAMED_SQL, {'a': 7})
+    assert cursor.fetchone()[0] == 49
+    assert registry.stats()['statements']['test_good']['executions'] == 1
+
+def test_a_statement_that_disappeared_runs_as_plain_sql(connect, registry):
+    conn, _ = connect()
+    cursor = conn.cursor()
+    cursor.execute('DEALLOCATE ALL;')
+    conn.commit()
+
+    cursor.execute(GOOD_SQL, (1,))
+    assert cursor.fetchone()[0] == 2
+    assert not registry.enabled
+    assert registry.stats()['statements']['test_good']['fallbacks'] == 1
@@ -0,0 +1,96 @@
+"""The suggestion index: deletes and inserts among the remembered rows of a prefix, and the artist/track links"""
+import pytest
+
+import suggest
+from fakes import FakeConnection, FakeCursor
+
+# Enough artists named "Love ..." for the prefixes of "love" to be remembered (artist i has popularity i)
+ARTISTS = 400
+BULK_ROWS = [('artist', artist_id, f'Love {artist_id}', None, artist_id) for artist_id in range(1, ARTISTS + 1)] + [
+    ('album', 1000, 'Midnight', None, 2),
+    ('track', 5000, 'Falling Behind', 1000, 0),
+    ('track', 5001, 'From The Start', 1000, 0),
+    ('artisttrack', 1, None, 5001, None),
+    ('artisttrack', 1, None, 5000, None),
+]
+
+def build(manager, during_read=lambda: None):
+    connection = FakeConnection(FakeCursor(BULK_ROWS, during_read))
+    manager.build(lambda: connection, lambda conn: None)
+
+def suggested(manager, text, kind, limit=suggest.DEFAULT_LIMIT):
+    return [row_id for row_id, _, _ in manager.suggest(text, [kind], limit)[kind]]
+
+@pytest.fixture
+def manager():
+    manager = suggest.SuggestIndexManager()
+    build(manager)
+    return manager
+
+@pytest.fixture
+def no_ranking(monkeypatch):
+    """Fails the test if a request ranks every key of a prefix"""
+    def best(*args):
+        raise AssertionError('a prefix was ranked again')
+    monkeypatch.setattr(suggest.NameKeys, 'best', best)
+
+def test_deleting_a_popular_row_keeps_the_remembered_rows(manager, no_ranking):
+    assert ('artist', 'lo') in manager.index.memo
+    assert suggested(manager, 'lo', 'artist', 3) == [400, 399, 398]
+
+    manager.apply('remove_artists', [400, 398])
+    assert suggested(manager, 'lo', 'artist', 3) == [399, 397, 396]
+    assert suggested(manager, 'l', 'artist', 3) == [399, 397, 396]
+    assert not manager.expired
+
+def test_added_rows_take_their_place_among_the_remembered_rows(manager, no_ranking):
+    manager.apply('remove_artists', [400])
+    manager.apply('add_artist', 901, 'Lovely Day')
+    manager.apply('raise_popularity', 'artist', 901, 1000)
+    manager.apply('add_artist', 902, 'Lonely')
+    assert suggested(manager, 'lo', 'artist', 3) == [901, 399, 398]
+    # Popularity 0 ranks after rows that are no longer remembered
+    assert 902 not in manager.index.memo[('artist', 'lo')].best
+
+def test_deleting_most_remembered_rows_rebuilds_the_index(manager, no_ranking):
+    spare = suggest.MEMO_DEPTH - suggest.MAX_LIMIT
+    manager.apply('remove_artists', list(range(ARTISTS, ARTISTS - spare, -1)))
+    assert not manager.expired
+    manager.apply('remove_artists', [ARTISTS - spare])
+    assert manager.expired
+
+    # The rows that are left are still the best ones until the rebuild
+    best = suggested(manager, 'lo', 'artist', suggest.MAX_LIMIT)
+    assert best == list(range(ARTISTS - spare - 1, ARTISTS - suggest.MEMO_DEPTH, -1))
+
+def test_artist_tracks_stay_sorted_and_unique(manager):
+    assert list(manager.index.artist_tracks[1]) == [5000, 5001]
+    manager.apply('apply_insert', 'track', {'track_id': 4999, 'name': 'Intro', 'album_id': 1000})
+    manager.apply('apply_insert', 'artisttrack', {'artist_id': 1, 'track_id': 4999})
+    manager.apply('apply_insert', 'artisttrack', {'artist_id': 1, 'track_id': 5001})
+    assert list(manager.index.artist_tracks[1]) == [4999, 5000, 5001]
+
+    manager.apply('apply_delete', 'artisttrack', [{'artist_id': 1, 'track_id': 5000}])
+    assert list(manager.index.artist_tracks[1]) == [4999, 5001]
+
+def test_linking_a_track_raises_every_track_of_the_artist(manager):
+    manager.apply('add_track', 5003, 'Falling Down', 1000)
+    manager.apply('raise_popularity', 'track', 5003, 2)
+    assert suggested(manager, 'fall', 'track') == [5003, 5000]
+
+    # Artist 1 now has three tracks, so its tracks all have a popularity of 3
+    manager.apply('add_track', 5002, 'Bewitched', 1000)
+    manager.apply('link_artist_track', 1, 5002)
+    popularity = manager.index.names['track'].popularity
+    assert [popularity[track_id] for track_id in (5000, 5001, 5002)] == [3, 3, 3]
+    assert suggested(manager, 'fall', 'track') == [5000, 5003]
+
+def test_a_more_popular_row_moves_up_among_the_remembered_rows(manager, no_ranking):
+    manager.apply('raise_popularity', 'artist', 390, 1000)
+    assert suggested(manager, 'lo', 'artist', 3) == [390, 400, 399]
+    # A row that was not remembered, tied with the most popular one (the name breaks the tie)
+    manager.apply('raise_popularity', 'artist', 100, 400)
+    assert suggested(manager, 'lo', 'artist', 3) == [390, 100, 400]
+    # Raising the first row leaves it where it is
+    manager.apply('raise_popularity', 'artist', 390, 1001)
+    assert suggested(manager, 'lo', 'artist', 5) == [390, 100, 400, 399, 398]
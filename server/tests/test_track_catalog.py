@@ -0,0 +1,118 @@
+"""track_catalog: the triggers keep it equal to the base tables through writes, and check() and repair() find and fix
+the rows that are not"""
+import uuid
+
+import pytest
+
+import catalog
+
+def fetch_catalog_row(db, track_id):
+    with db.cursor() as cursor:
+        cursor.execute(
+            'SELECT track_name, album_name, artist_names, artists FROM track_catalog WHERE track_id = %s;', (track_id,)
+        )
+        return cursor.fetchone()
+
+def check(db):
+    with db.cursor() as cursor:
+        return catalog.check(cursor)
+
+def insert(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchone()[0]
+
+@pytest.fixture
+def rows(db):
+    """Two artists, two albums, and three tracks on the first album (the first track by both artists)"""
+    token = uuid.uuid4().hex[:8]
+    ids = {'token': token}
+    with db.cursor() as cursor:
+        cursor.execute('SELECT nation_id FROM Nation LIMIT 1;')
+        nation_id = cursor.fetchone()[0]
+        for key in ('alpha', 'beta'):
+            ids[key] = insert(
+                cursor, 'INSERT INTO Artist (name, nation_id) VALUES (%s, %s) RETURNING artist_id;',
+                (f'{token} {key}', nation_id)
+            )
+        for key in ('first', 'second'):
+            ids[key] = insert(cursor, 'INSERT INTO Album (name) VALUES (%s) RETURNING album_id;', (f'{token} {key}',))
+        cursor.execute('INSERT INTO ArtistAlbum (artist_id, album_id) VALUES (%s, %s);', (ids['alpha'], ids['first']))
+        for key in ('one', 'two', 'three'):
+            ids[key] = insert(
+                cursor, 'INSERT INTO Track (name, album_id) VALUES (%s, %s) RETURNING track_id;',
+                (f'{token} {key}', ids['first'])
+            )
+        cursor.execute(
+            'INSERT INTO ArtistTrack (artist_id, track_id) VALUES (%s, %s), (%s, %s);',
+            (ids['alpha'], ids['one'], ids['beta'], ids['one'])
+        )
+    return ids
+
+def test_the_catalog_starts_consistent(db, rows):
+    result = check(db)
+    assert result['consistent'], result
+    token = rows['token']
+    assert fetch_catalog_row(db, rows['one'])[:3] == (
+        f'{token} one', f'{token} first', [f'{token} alpha', f'{token} beta']
+    )
+
+def test_writes_keep_the_catalog_consistent(db, rows):
+    token = rows['token']
+    with db.cursor() as cursor:
+        # Renames of every table the catalog copies a name from
+        cursor.execute('UPDATE Artist SET name = %s WHERE artist_id = %s;', (f'{token} gamma', rows['alpha']))
+        cursor.execute('UPDATE Album SET name = %s WHERE album_id = %s;', (f'{token} renamed', rows['first']))
+        cursor.execute('UPDATE Track SET name = %s WHERE track_id = %s;', (f'{token} deux', rows['two']))
+
+        # A track moved to another album, and album artists added, moved, and removed
+        cursor.execute('UPDATE Track SET album_id = %s WHERE track_id = %s;', (rows['second'], rows['three']))
+        cursor.execute('INSERT INTO ArtistAlbum (artist_id, album_id) VALUES (%s, %s);', (rows['beta'], rows['second']))
+        cursor.execute(
+            'UPDATE ArtistAlbum SET album_id = %s WHERE artist_id = %s AND album_id = %s;',
+            (rows['second'], rows['alpha'], rows['first'])
+        )
+        cursor.execute(
+            'DELETE FROM ArtistAlbum WHERE artist_id = %s AND album_id = %s;', (rows['beta'], rows['second'])
+        )
+
+        # Track artists removed and added, in one transaction
+        db.autocommit = False
+        cursor.execute('DELETE FROM ArtistTrack WHERE artist_id = %s AND track_id = %s;', (rows['beta'], rows['one']))
+        cursor.execute('INSERT INTO ArtistTrack (artist_id, track_id) VALUES (%s, %s);', (rows['beta'], rows['two']))
+        db.commit()
+        db.autocommit = True
+
+        # A new track, a deleted track, and an artist whose links cascade
+        new_track = insert(
+            cursor, 'INSERT INTO Track (name, album_id) VALUES (%s, %s) RETURNING track_id;',
+            (f'{token} four', rows['second'])
+        )
+        cursor.execute('DELETE FROM Track WHERE track_id = %s;', (rows['one'],))
+        cursor.execute('DELETE FROM Artist WHERE artist_id = %s;', (rows['beta'],))
+
+    result = check(db)
+    assert result['consistent'], result
+    assert fetch_catalog_row(db, rows['one']) is None
+    assert fetch_catalog_row(db, rows['two'])[:3] == (f'{token} deux', f'{token} renamed', [])
+    name, album_name, artist_names, artists = fetch_catalog_row(db, rows['three'])
+    assert (album_name, artist_names) == (f'{token} second', [])
+    assert [artist['name'] for artist in artists] == [f'{token} gamma']
+    assert fetch_catalog_row(db, new_track)[1] == f'{token} second'
+
+    # Deleting an album takes its tracks' rows with it
+    with db.cursor() as cursor:
+        cursor.execute('DELETE FROM Album WHERE album_id = %s;', (rows['second'],))
+    assert check(db)['consistent']
+    assert fetch_catalog_row(db, rows['three']) is None
+
+def test_check_finds_the_rows_and_repair_fixes_them(db, rows):
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE track_catalog SET track_name = 'stale' WHERE track_id = %s;", (rows['one'],))
+        cursor.execute('DELETE FROM track_catalog WHERE track_id = %s;', (rows['two'],))
+
+        result = check(db)
+        assert (result['missing'], result['extra'], result['stale']) == (1, 0, 1)
+        assert result['sample_track_ids'] == {'missing': [rows['two']], 'stale': [rows['one']]}
+
+        assert catalog.repair(cursor) == 2
+    assert check(db)['consistent']
@@ -0,0 +1,39 @@
+"""/api/tracks/joined: the same number of queries for every page size (no query per track), and invalid pages"""
+import pytest
+
+PAGE_SIZES = [1, 15, 100]
+
+def query_count(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, response.get_json()
+    return int(response.headers['X-Query-Count']), response.get_json()
+
+@pytest.fixture(params=[False, True], ids=['base-tables', 'track-catalog'])
+def track_catalog(request, app_module, monkeypatch):
+    """Runs a test with the page read from the base tables and from track_catalog"""
+    monkeypatch.setattr(app_module, 'TRACK_CATALOG_ENABLED', request.param)
+    return request.param
+
+def test_offset_pages_run_a_constant_number_of_queries(client, track_catalog):
+    # The first request also counts the tracks and looks for track_catalog (both are cached)
+    query_count(client, '/api/tracks/joined?limit=1')
+
+    counts = {}
+    for limit in PAGE_SIZES:
+        counts[limit], body = query_count(client, f'/api/tracks/joined?limit={limit}')
+        assert len(body['results']) == limit
+    assert len(set(counts.values())) == 1, counts
+
+def test_cursor_pages_run_a_constant_number_of_queries(client, track_catalog):
+    _, first_page = query_count(client, '/api/tracks/joined?limit=1')
+
+    counts = {}
+    for limit in PAGE_SIZES:
+        counts[limit], body = query_count(client, f'/api/tracks/joined?limit={limit}&after={first_page["next_cursor"]}')
+        assert len(body['results']) == limit
+    assert len(set(counts.values())) == 1, counts
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=-1', 'offset=-1'])
+def test_invalid_pages_are_rejected(client, query):
+    response = client.get(f'/api/tracks/joined?{query}')
+    assert response.status_code == 400